@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Measure the copy throughput and memory use of utils.CopyEngine.
+
+For each buffer size, a local file is copied with the CopyEngine and with
+the plain read/write loop it replaced.  Each run happens in a fresh
+process so that the reported peak RSS belongs to that run alone.
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.utils import CopyEngine
+
+Methods = ('engine', 'read')
+
+def copy_read(src, dest, buffer_size):
+    n_bytes = 0
+    buf = src.read(buffer_size)
+    while len(buf) > 0:
+        dest.write(buf)
+        n_bytes += len(buf)
+        buf = src.read(buffer_size)
+    return n_bytes
+
+def copy_engine(src, dest, buffer_size):
+    return CopyEngine(buffer_size).copy(src, dest)
+
+def worker(method, src_path, dest_path, buffer_size):
+    """
+    Copy the file and print: bytes copied, seconds, peak RSS in KB.
+    """
+    fn = copy_engine if method == 'engine' else copy_read
+    start = time.time()
+    with open(src_path) as src, open(dest_path, 'w') as dest:
+        n_bytes = fn(src, dest, buffer_size)
+    duration = time.time() - start
+    print n_bytes, duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_worker(method, src_path, dest_path, buffer_size):
+    out = subprocess.check_output([sys.executable, __file__, '--worker', method,
+        src_path, dest_path, str(buffer_size)])
+    n_bytes, duration, rss = out.split()
+    return int(n_bytes), float(duration), int(rss)
+
+def make_source(path, size):
+    block = os.urandom(2**20)
+    with open(path, 'w') as f:
+        for _ in xrange(size):
+            f.write(block)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1].replace('\n', ' '))
+    parser.add_argument('directory', help="Directory in which to write the test files")
+    parser.add_argument('--size', metavar="MB", type=int, default=512, help="Size of the file to copy (default: 512)")
+    parser.add_argument('--buffer-sizes', metavar="KB", type=int, nargs='+',
+            default=[64, 256, 1024, 4096, 10240], help="Buffer sizes to test (default: 64 256 1024 4096 10240)")
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = args or sys.argv[1:]
+    if args and args[0] == '--worker':
+        worker(args[1], args[2], args[3], int(args[4]))
+        return 0
+
+    options = parse_args(args)
+    src_path = os.path.join(options.directory, 'bench_copy_src.%d' % os.getpid())
+    dest_path = os.path.join(options.directory, 'bench_copy_dest.%d' % os.getpid())
+    try:
+        make_source(src_path, options.size)
+        print "%-8s %12s %10s %14s" % ('method', 'buffer (KB)', 'MB/s', 'peak RSS (MB)')
+        for size_kb in options.buffer_sizes:
+            for method in Methods:
+                n_bytes, duration, rss = run_worker(method, src_path, dest_path, size_kb * 2**10)
+                print "%-8s %12d %10.1f %14.1f" % (method, size_kb,
+                        n_bytes / float(2**20) / max(0.001, duration), rss / 1024.0)
+    finally:
+        for p in (src_path, dest_path):
+            if os.path.exists(p):
+                os.unlink(p)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Measure the time a fresh interpreter takes to import the Hadoop-Galaxy
+tool modules, and compare it with the time it takes to import pydoop.hdfs,
+which the tools defer until they touch a path that isn't local.
+
+Each import runs in a new interpreter, so nothing is cached by earlier runs
+other than by the operating system.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+PackageDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+ToolModules = [
+    'hadoop_galaxy',
+    'hadoop_galaxy.cat_paths',
+    'hadoop_galaxy.dist_cat_paths',
+    'hadoop_galaxy.dist_text_zipper',
+    'hadoop_galaxy.make_pathset',
+    'hadoop_galaxy.put_dataset',
+    'hadoop_galaxy.split_pathset',
+]
+
+def time_import(modules, repeat):
+    """
+    Returns the best wall-clock time, over `repeat` fresh interpreters, to
+    start up and import `modules`, and whether pydoop.hdfs was loaded.
+    """
+    code = "import sys\n" + ''.join("import %s\n" % m for m in modules) + \
+            "sys.stdout.write(str('pydoop.hdfs' in sys.modules))\n"
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=PackageDir)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out.strip() == 'True'
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', metavar="N", type=int, default=5,
+            help="Number of interpreters started for each measurement (default: 5)")
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args or sys.argv[1:])
+    cases = [ ('interpreter', []), ('tool modules', ToolModules), ('pydoop.hdfs', ['pydoop.hdfs']) ]
+    print "%-14s %10s %14s" % ('import', 'time (s)', 'pydoop loaded')
+    for name, modules in cases:
+        try:
+            elapsed, loaded = time_import(modules, options.repeat)
+        except subprocess.CalledProcessError:
+            print "%-14s %10s" % (name, 'failed')
+            continue
+        print "%-14s %10.3f %14s" % (name, elapsed, loaded)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Compare the time to build a large pathset by appending its paths one at a
+time, by extending it in bulk and by extending it with trusted URIs.
+
+The paths are synthetic URIs shaped like those returned by an HDFS listing,
+or relative local paths with --relative.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.pathset import Pathset
+
+def make_paths(n_paths, relative):
+    if relative:
+        fmt = 'data/run%03d/part-%05d'
+    else:
+        fmt = 'hdfs://nn:9000/user/galaxy/workspace/run%03d/part-%05d'
+    return [ fmt % (i // 1000, i % 1000) for i in xrange(n_paths) ]
+
+def build_append(paths):
+    ps = Pathset()
+    for p in paths:
+        ps.append(p)
+    return ps
+
+def build_extend(paths):
+    return Pathset().extend(paths)
+
+def build_trusted(paths):
+    return Pathset().extend(paths, trusted=True)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', metavar="N", type=int, nargs='+', default=[10000, 100000, 1000000],
+            help="Number of paths in the pathsets (default: 10000 100000 1000000)")
+    parser.add_argument('--relative', action='store_true',
+            help="Use relative local paths instead of hdfs:// URIs")
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args or sys.argv[1:])
+    methods = [ ('append', build_append), ('extend', build_extend) ]
+    if not options.relative:
+        methods.append( ('extend trusted', build_trusted) )
+    print "%10s %-16s %10s" % ('paths', 'method', 'time (s)')
+    for n_paths in options.sizes:
+        paths = make_paths(n_paths, options.relative)
+        for name, fn in methods:
+            start = time.time()
+            ps = fn(paths)
+            elapsed = time.time() - start
+            if len(ps) != n_paths:
+                raise RuntimeError("BUG! built a pathset with %s paths instead of %s" % (len(ps), n_paths))
+            print "%10d %-16s %10.3f" % (n_paths, name, elapsed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
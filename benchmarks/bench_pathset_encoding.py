@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Compare file size, write time and parse time of the pathset encodings.
+
+The pathsets contain synthetic URIs shaped like those produced by Hadoop
+jobs run through the hadoop_galaxy adapter:
+hdfs://nn:9000/user/galaxy/workspace/<uuid>/part-NNNNN.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.pathset import FilePathset
+
+def make_pathset(n_paths, files_per_dir):
+    ps = FilePathset()
+    ps.datatype = 'fastq'
+    for i in xrange(n_paths):
+        if i % files_per_dir == 0:
+            base = 'hdfs://nn:9000/user/galaxy/workspace/%s/' % uuid.uuid4()
+        ps.paths.append(base + 'part-%05d' % (i % files_per_dir))
+    return ps
+
+def measure(ps, encoding, path):
+    start = time.time()
+    with open(path, 'w') as f:
+        ps.write(f, encoding)
+    write_time = time.time() - start
+
+    start = time.time()
+    ps2 = FilePathset.from_file(path)
+    parse_time = time.time() - start
+    if len(ps2) != len(ps):
+        raise RuntimeError("BUG! read %s paths but wrote %s" % (len(ps2), len(ps)))
+    return os.path.getsize(path), write_time, parse_time
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', metavar="N", type=int, nargs='+', default=[10000, 100000, 1000000],
+            help="Number of paths in the pathsets (default: 10000 100000 1000000)")
+    parser.add_argument('--files-per-dir', metavar="N", type=int, default=1000,
+            help="Number of part files per job output directory (default: 1000)")
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args or sys.argv[1:])
+    fd, path = tempfile.mkstemp(prefix='bench_pathset')
+    os.close(fd)
+    try:
+        print "%10s %-18s %12s %10s %10s" % ('paths', 'encoding', 'size (KB)', 'write (s)', 'parse (s)')
+        for n_paths in options.sizes:
+            ps = make_pathset(n_paths, options.files_per_dir)
+            for encoding in FilePathset.Encodings:
+                size, write_time, parse_time = measure(ps, encoding, path)
+                print "%10d %-18s %12.1f %10.3f %10.3f" % (n_paths, encoding, size / 1024.0, write_time, parse_time)
+    finally:
+        os.unlink(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
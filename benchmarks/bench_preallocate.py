@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Compare the output preallocation strategies used by dist_cat_paths.
+
+For each strategy, the output file is created with its final size and then
+a number of concurrent writers fill it in, each one writing its own
+contiguous slice like the dist_cat_paths map tasks do.  Run it on the shared
+file system where Galaxy keeps its datasets (e.g., Lustre or GPFS) to see
+the effect on that file system.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.utils import preallocate_file, PreallocStrategies
+
+def write_slice(path, pos, size, block_size):
+    buf = 'x' * block_size
+    with open(path, 'r+') as f:
+        f.seek(pos)
+        left = size
+        while left > 0:
+            n = min(block_size, left)
+            f.write(buf[:n] if n < block_size else buf)
+            left -= n
+
+def run_once(path, strategy, total_size, n_writers, block_size):
+    start = time.time()
+    used = preallocate_file(path, total_size, strategy)
+    alloc_time = time.time() - start
+
+    slice_size = total_size // n_writers
+    threads = []
+    for i in xrange(n_writers):
+        size = slice_size if i < n_writers - 1 else total_size - slice_size * i
+        t = threading.Thread(target=write_slice, args=(path, i * slice_size, size, block_size))
+        threads.append(t)
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    write_time = time.time() - start - alloc_time
+    return used, alloc_time, write_time
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1].replace('\n', ' '))
+    parser.add_argument('directory', help="Directory in which to write the test file")
+    parser.add_argument('--size', metavar="MB", type=int, default=1024, help="Output file size (default: 1024)")
+    parser.add_argument('--writers', metavar="N", type=int, default=8, help="Number of concurrent writers (default: 8)")
+    parser.add_argument('--block-size', metavar="KB", type=int, default=1024, help="Write size (default: 1024)")
+    parser.add_argument('--repeat', metavar="N", type=int, default=3, help="Runs per strategy (default: 3)")
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args or sys.argv[1:])
+    total_size = options.size * 2**20
+    path = os.path.join(options.directory, 'bench_preallocate.%d' % os.getpid())
+    print "%-10s %-10s %10s %10s %10s" % ('strategy', 'used', 'alloc (s)', 'write (s)', 'MB/s')
+    try:
+        for strategy in PreallocStrategies:
+            for _ in xrange(options.repeat):
+                used, alloc_time, write_time = \
+                    run_once(path, strategy, total_size, options.writers, options.block_size * 2**10)
+                print "%-10s %-10s %10.3f %10.3f %10.1f" % (strategy, used, alloc_time, write_time,
+                        options.size / max(0.001, alloc_time + write_time))
+                os.unlink(path)
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,12 +13,13 @@ import logging
 import os
 import subprocess
 import sys
+import threading
+import time
 import yaml
-
-import pydoop.hdfs as phdfs
+from uuid import uuid4
 
 from hadoop_galaxy.pathset import Pathset, FilePathset
-from hadoop_galaxy.utils import get_abs_executable_path
+from hadoop_galaxy.utils import fs_pool, get_abs_executable_path, get_path_meta, split_uri
 
 EnvOutputDataDir = 'HADOOP_GALAXY_DATA_DIR'
 EnvConfPath = 'HADOOP_GALAXY_CONF'
@@ -99,6 +100,8 @@ class HadoopToolRunner(object):
     self.output_str = None
     # a list of options
     self.generic_opts = []
+    # delete stale output in the background while the tool runs
+    self.async_cleanup = True
 
   def __str__(self):
     return '\n\t'.join(
@@ -155,6 +158,53 @@ class HadoopToolRunner(object):
     logging.getLogger(self.__class__.__name__).debug("Found tool: %s", full_path)
     return [full_path] + self.generic_opts + self.input_params + [self.output_str]
 
+  def _prepare_output(self, logger, timings):
+    """
+    Make sure the output path doesn't exist and its parent does, with as
+    few file system operations as possible.  The output path is usually a
+    new dataset name, so we start by probing it once.
+
+    Stale output is renamed out of the way and, if self.async_cleanup is
+    set, deleted by a background thread while the tool runs.  Returns
+    that thread, or None.
+    """
+    host, port, path = split_uri(self.output_str)
+    fs = fs_pool.get(host, port)
+    start = time.time()
+    try:
+      info = fs.get_path_info(path)
+    except IOError:
+      info = None
+    timings.append( ('probe output', time.time() - start) )
+
+    start = time.time()
+    if info is None:
+      # mkdir also succeeds if the parent already exists
+      fs.create_directory(os.path.dirname(path))
+      timings.append( ('create output parent', time.time() - start) )
+      return None
+
+    logger.info("Removing existing output path %s", self.output_str)
+    if not self.async_cleanup:
+      fs.delete(path)
+      timings.append( ('remove old output', time.time() - start) )
+      return None
+
+    stale = os.path.join(os.path.dirname(path), '_%s.stale.%s' % (os.path.basename(path), uuid4().hex))
+    fs.rename(path, stale)
+    timings.append( ('move old output', time.time() - start) )
+
+    def cleanup():
+      try:
+        fs.delete(stale)
+        logger.debug("Removed old output %s", stale)
+      except IOError as e:
+        logger.warning("Failed to remove old output %s: %s", stale, e)
+    thread = threading.Thread(target=cleanup, name='output-cleanup')
+    thread.daemon = True
+    thread.start()
+    return thread
+
   def execute(self, logger, env=None):
     """
     Executes the command.
@@ -162,21 +212,22 @@ class HadoopToolRunner(object):
     This method calls self.command to build the command array and then executes
     the command.  If provided, the specified `env` will be used.
     """
+    timings = []
+    start = time.time()
     cmd = self.command(env)
-    logger.debug("attempting to remove output path %s", self.output_str)
-    try:
-      phdfs.rmr(self.output_str)
-    except IOError as e:
-      logger.warning(e)
+    timings.append( ('find executable', time.time() - start) )
 
-    if not phdfs.path.exists(phdfs.path.dirname(self.output_str)):
-      phdfs.mkdir(phdfs.path.dirname(self.output_str))
-      logger.debug("Created parent of output directory")
+    cleanup_thread = self._prepare_output(logger, timings)
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("Pre-launch timings: %s", ', '.join("%s %.3f s" % t for t in timings))
 
     logger.info("Executing command: %s", cmd)
     logger.debug("PATH: %s", (env or os.environ).get('PATH'))
-    subprocess.check_call(cmd, env=env)
-
+    try:
+      subprocess.check_call(cmd, env=env)
+    finally:
+      if cleanup_thread:
+        cleanup_thread.join()
 
 class HadoopGalaxy(object):
     HadoopOutputDirName = 'hadoop_output'
@@ -200,6 +251,10 @@ class HadoopGalaxy(object):
                 help="URI to a working directory where the Hadoop job will write its output. Can also be " +\
                         "set through HADOOP_GALAXY_DATA_DIR env. variable (default: Galaxy data dir).")
         parser.add_argument('--conf', metavar="conf_file", help="Hadoop+Galaxy configuration file")
+        parser.add_argument('--summarize-output', action='store_true',
+                help="Record the total size and number of files of the job output in the output pathset.  " +\
+                        "This walks the whole output directory; without it, only the output's kind " +\
+                        "and modification time are recorded")
         parser.add_argument('remaining_args', nargs=argparse.REMAINDER)
         return parser
 
@@ -325,6 +380,20 @@ class HadoopGalaxy(object):
                 if k.startswith("HADOOP"):
                     log.info("%s = %s", k, v)
 
+    @staticmethod
+    def _record_output_meta(pset, summarize_dirs=False):
+        """
+        Record the metadata of the job output in the pathset, so that
+        downstream tools don't have to stat it again.  Output directories'
+        size and file count are only recorded with summarize_dirs=True,
+        since they have to be walked.  Failing to do so isn't an error.
+        """
+        for p in pset:
+            try:
+                pset.set_meta(p, get_path_meta(p, summarize_dirs))
+            except (IOError, OSError) as e:
+                log.warning("Couldn't get metadata for output path %s: %s", p, e)
+
     def run(self, options):
         log.debug("options: %s", options)
         self._configure_for_job(options)
@@ -342,6 +411,7 @@ class HadoopGalaxy(object):
             self._runner.set_output(output_pathset)
             log.debug("Executing: %s", self._runner)
             self._runner.execute(log, self._cmd_env)
+            self._record_output_meta(output_pathset, options.summarize_output)
             with open(options.output, 'w') as f:
                 output_pathset.write(f)
         except subprocess.CalledProcessError as e:
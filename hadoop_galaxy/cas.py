@@ -0,0 +1,350 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+A content-addressed store where put_dataset can keep a single copy of files
+uploaded by several datasets (see put_dataset --dedup).
+
+The store lives in a directory (normally WORKSPACE/cas) containing:
+
+  objects/   the stored files
+  index      one line per object:  quick key, object name, full hash,
+             reference count and, for reserved objects, the reservation's
+             token and time, separated by tabs
+  lock       exists while a process is modifying the store
+
+Files are identified by a quick key:  the SHA-1 of their size and of three
+sampled blocks (at the start, in the middle and at the end).  Only when a
+file's quick key matches an object's is the full SHA-1 of both computed,
+to tell whether they really are the same.  The objects keep the extension
+of the first file stored under them, since Hadoop picks compression codecs
+by file extension.
+
+Each dataset that references an object counts as a reference.  Objects are
+deleted when their last reference is released (see the cas_release tool).
+
+So that uploads don't hold the lock while they copy, new objects are first
+reserved:  they're saved in the index, marked with the token of the store
+instance that added them, and the lock is released.  Once they've been
+copied, the uploader locks the store again and commits them.  Until then,
+everybody else treats them as absent.  Reservations that are never
+committed, because their uploader died, are removed after
+ReservationTimeout seconds.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from urlparse import urlparse
+from uuid import uuid4
+
+import hadoop_galaxy.fs as hfs
+from hadoop_galaxy import log
+from hadoop_galaxy.pathset import FilePathset
+from hadoop_galaxy.utils import config_logging, DefaultCopyBufferSize
+
+# name of the store directory in put_dataset's workspace
+CasDir = 'cas'
+
+def _is_local(uri):
+    return urlparse(uri).scheme == 'file'
+
+def _read(f, n):
+    data = []
+    while n > 0:
+        chunk = f.read(n)
+        if not chunk:
+            break
+        data.append(chunk)
+        n -= len(chunk)
+    return ''.join(data)
+
+class CasStore(object):
+    """
+    A content-addressed store rooted at the URI `root`.
+
+    Use it as a context manager:  entering locks the store and loads its
+    index; exiting saves the index and unlocks it.  In between, `add`
+    registers files and `release` drops references.  If the body raises,
+    the index isn't saved and the objects added in the meantime are
+    removed.
+
+    The objects added by `add` are reserved by this instance, which can
+    lock the store as many times as needed.  Once they've been copied,
+    call `commit` (with the store locked) to make them visible to others.
+    """
+    IndexName = 'index'
+    LockName = 'lock'
+    ObjectsDir = 'objects'
+    SampleSize = 64 * 2**10
+    # seconds after which a lock that isn't refreshed is considered stale
+    LockTimeout = 600
+    LockPollInterval = 1
+    # the holder refreshes the lock's modification time at this interval
+    # (in seconds), so that long copies don't lose it
+    LockRefreshInterval = 60
+    # seconds after which reservations that haven't been committed are removed
+    ReservationTimeout = 24 * 3600
+
+    def __init__(self, root):
+        self.root = root.rstrip('/')
+        self.objects_root = self.root + '/' + self.ObjectsDir
+        # identifies the reservations of this instance
+        self.token = uuid4().hex
+        # quick key -> list of [object name, full hash or None, reference count,
+        #                       None or (reservation token, reservation time)]
+        self._entries = {}
+        # object name -> (quick key, entry)
+        self._by_name = {}
+        # object name -> source URI, for the objects reserved by this
+        # instance and not yet committed
+        self._pending = {}
+        # names of the objects reserved since the index was loaded or saved
+        self._unsaved = set()
+        self._lock = None
+
+    def __enter__(self):
+        self.lock()
+        try:
+            self.load()
+        except:
+            self.unlock()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.save()
+            else:
+                self._discard_pending()
+        finally:
+            self.unlock()
+        return False
+
+    def _path(self, name):
+        return self.root + '/' + name
+
+    def object_uri(self, name):
+        return self.objects_root + '/' + name
+
+    def lock(self):
+        hfs.mkdir(self.objects_root)
+        self._lock = hfs.LockFile(self._path(self.LockName),
+                self.LockTimeout, self.LockPollInterval, self.LockRefreshInterval)
+        self._lock.acquire()
+
+    def unlock(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+    @staticmethod
+    def _remove(uri):
+        try:
+            hfs.rm(uri)
+        except IOError as e:
+            log.debug("Error removing %s: %s", uri, e)
+
+    def _is_visible(self, entry):
+        """
+        Whether the entry is committed or reserved by this instance.
+        """
+        return entry[3] is None or entry[3][0] == self.token
+
+    def load(self):
+        self._entries = {}
+        self._by_name = {}
+        self._unsaved = set()
+        index = self._path(self.IndexName)
+        if not hfs.exists(index):
+            return
+        expired = time.time() - self.ReservationTimeout
+        with hfs.open(index) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                qk, name, full_hash, refcount = fields[0:4]
+                reservation = (fields[4], int(fields[5])) if len(fields) > 4 else None
+                if reservation is not None and reservation[0] != self.token and reservation[1] < expired:
+                    log.warning("Removing object %s, reserved but never committed", name)
+                    self._remove(self.object_uri(name))
+                    continue
+                entry = [ name, None if full_hash == '-' else full_hash, int(refcount), reservation ]
+                self._entries.setdefault(qk, []).append(entry)
+                self._by_name[name] = (qk, entry)
+
+    def _discard_pending(self):
+        # the objects added since the index was saved may have been partially copied
+        for name in self._unsaved:
+            self._remove(self.object_uri(name))
+            self._pending.pop(name, None)
+        self._unsaved = set()
+
+    def save(self):
+        # don't overwrite the index of a process that took over our lock
+        if self._lock is not None:
+            self._lock.check()
+        index = self._path(self.IndexName)
+        tmp = self._path('%s.%s' % (self.IndexName, uuid4().hex))
+        with hfs.open(tmp, 'w') as f:
+            for qk, entries in self._entries.iteritems():
+                for name, full_hash, refcount, reservation in entries:
+                    fields = [ qk, name, full_hash or '-', str(refcount) ]
+                    if reservation is not None:
+                        fields.extend( (reservation[0], str(reservation[1])) )
+                    f.write('\t'.join(fields) + '\n')
+        # HDFS doesn't rename over existing files; we're holding the lock
+        if not _is_local(index) and hfs.exists(index):
+            hfs.rm(index)
+        hfs.rename(tmp, index)
+        self._unsaved = set()
+
+    def commit(self):
+        """
+        Make the objects reserved by this instance visible to others.  Their
+        copies must be complete.  Raises RuntimeError if their reservations
+        were removed in the meantime, because they expired.
+        """
+        for name in self._pending:
+            item = self._by_name.get(name)
+            if item is None or item[1][3] is None or item[1][3][0] != self.token:
+                raise RuntimeError("The reservation of %s in the content-addressed store %s expired" %
+                        (self.object_uri(name), self.root))
+        for name in self._pending:
+            self._by_name[name][1][3] = None
+        self._pending = {}
+
+    def quick_key(self, uri, size):
+        h = hashlib.sha1(str(size))
+        with hfs.open(uri) as f:
+            if size <= 3 * self.SampleSize:
+                h.update(_read(f, size))
+            else:
+                for offset in (0, (size - self.SampleSize) // 2, size - self.SampleSize):
+                    f.seek(offset)
+                    h.update(_read(f, self.SampleSize))
+        return h.hexdigest()
+
+    @staticmethod
+    def full_hash(uri):
+        h = hashlib.sha1()
+        with hfs.open(uri) as f:
+            for chunk in iter(lambda: f.read(DefaultCopyBufferSize), ''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def refcount(self, name):
+        """
+        Returns the number of references to the named object (0 if it
+        isn't in the store).
+        """
+        item = self._by_name.get(name)
+        return item[1][2] if item and self._is_visible(item[1]) else 0
+
+    def add(self, uri, size):
+        """
+        Add a reference to the object with the same contents as the file
+        uri, of the given size.  Returns a tuple (object URI, is_new).  If
+        is_new is True, there was no such object:  a new one is reserved, and
+        the caller must copy uri to the object URI and commit it, or release
+        it if that's not possible.
+        """
+        qk = self.quick_key(uri, size)
+        candidates = self._entries.setdefault(qk, [])
+        # the objects reserved by others may never be copied
+        visible = [ entry for entry in candidates if self._is_visible(entry) ]
+        if visible:
+            full_hash = self.full_hash(uri)
+            for entry in visible:
+                if entry[1] is None:
+                    entry[1] = self.full_hash(self._pending.get(entry[0]) or self.object_uri(entry[0]))
+                if entry[1] == full_hash:
+                    entry[2] += 1
+                    return self.object_uri(entry[0]), False
+        else:
+            full_hash = None
+        ext = os.path.splitext(urlparse(uri).path)[1]
+        used = set(entry[0] for entry in candidates)
+        n = 0
+        name = qk + ext
+        while name in used:
+            n += 1
+            name = '%s-%d%s' % (qk, n, ext)
+        entry = [ name, full_hash, 1, (self.token, int(time.time())) ]
+        candidates.append(entry)
+        self._by_name[name] = (qk, entry)
+        self._pending[name] = uri
+        self._unsaved.add(name)
+        return self.object_uri(name), True
+
+    def release(self, object_uri):
+        """
+        Drop a reference to the object at object_uri.  The object is deleted
+        when its last reference is dropped.  Returns the remaining number of
+        references.
+        """
+        name = object_uri.rstrip('/').rsplit('/', 1)[-1]
+        if name not in self._by_name or not self._is_visible(self._by_name[name][1]):
+            raise ValueError("%s is not in the content-addressed store %s" % (object_uri, self.root))
+        qk, entry = self._by_name[name]
+        entry[2] -= 1
+        if entry[2] <= 0:
+            log.debug("Deleting unreferenced object %s", object_uri)
+            # pending objects may have been partially copied
+            self._remove(self.object_uri(name))
+            self._entries[qk].remove(entry)
+            if not self._entries[qk]:
+                del self._entries[qk]
+            del self._by_name[name]
+            self._pending.pop(name, None)
+            self._unsaved.discard(name)
+        return max(entry[2], 0)
+
+def release_pathset(pset):
+    """
+    Release the references of the pathset's paths to the objects of their
+    content-addressed stores.  Paths that aren't in a store are ignored.
+    """
+    by_store = {}
+    for p in pset:
+        objects_dir, name = p.rstrip('/').rsplit('/', 1)
+        root, objects = objects_dir.rsplit('/', 1)
+        if objects == CasStore.ObjectsDir and root.endswith('/' + CasDir):
+            by_store.setdefault(root, []).append(p)
+    for root, uris in by_store.iteritems():
+        with CasStore(root) as store:
+            for uri in uris:
+                try:
+                    store.release(uri)
+                except ValueError as e:
+                    log.warning("%s", e)
+    return sum(len(uris) for uris in by_store.itervalues())
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+            description="Release the references of put_dataset --dedup datasets to the shared copies of their files")
+    parser.add_argument('pathsets', metavar="PATHSET", nargs='+', help="Pathsets written by put_dataset --dedup")
+    parser.add_argument('--log-level',
+            choices=['debug', 'info', 'warn', 'error', 'critical'],
+            default='info')
+    return parser.parse_args(args)
+
+def main(args=None):
+    options = parse_args(args)
+    config_logging(options.log_level)
+    try:
+        for p in options.pathsets:
+            n = release_pathset(FilePathset.from_file(p))
+            log.info("Released %s references from %s", n, p)
+        return 0
+    except Exception as e:
+        print >> sys.stderr, str(e)
+        return 1
@@ -9,81 +9,281 @@
 # END_COPYRIGHT
 
 import argparse
+import collections
 import os
 import sys
+import threading
 import time
 from urlparse import urlparse
 
-import pydoop.hdfs as phdfs
-
+import hadoop_galaxy.fs as hfs
 import hadoop_galaxy.pathset as pathset
 from hadoop_galaxy import log as _log
-from hadoop_galaxy.utils import config_logging
+from hadoop_galaxy.utils import config_logging, kernel_copy, CopyEngine, DefaultCopyBufferSize
 
-def link_file(src_url, dest_path, delete_source=False):
-    # Both source and destination should be on mounted file systems.
-    u = urlparse(src_url)
+def link_file(src_url, dest_url, delete_source=False):
+    """
+    Hard link src_url to dest_url, replacing the file at dest_url.  Raises
+    IOError if the link can't be made (e.g., the two aren't on the same
+    local file system).
+    """
     try:
-        if os.path.exists(dest_path):
-            os.unlink(dest_path)
-    except OSError:
+        if not hfs.isdir(dest_url):
+            hfs.rm(dest_url)
+    except IOError:
         pass
     try:
-        _log.info("Hard linking %s to %s instead of copying", u.path, dest_path)
-        os.link(u.path, dest_path)
-        if delete_source:
-            _log.info("As requested, removing source file %s", u.path)
-            try:
-                os.unlink(u.path)
-            except OSError as e:
-                _log.warn("Failed to remove source file %s", u.path)
-                _log.warn(str(e))
-    except OSError as e:
-       _log.info("failed to hard link %s (Reason: %s). Will copy.", u.path, str(e))
+        _log.info("Hard linking %s to %s instead of copying", src_url, dest_url)
+        hfs.link(src_url, dest_url)
+    except IOError as e:
+       _log.info("failed to hard link %s (Reason: %s). Will copy.", src_url, str(e))
        raise
+    if delete_source:
+        _log.info("As requested, removing source file %s", src_url)
+        try:
+            hfs.rm(src_url)
+        except IOError as e:
+            _log.warn("Failed to remove source file %s", src_url)
+            _log.warn(str(e))
 
-def append_file(src_url, dest_fd):
-    ten_mb = 10 * 2**20
+def append_file(src_url, dest_fd, engine=None):
+    engine = engine or CopyEngine()
     n_bytes = 0
 
     with open_file(src_url) as input_fd:
-        buf = input_fd.read(ten_mb)
-        while len(buf) > 0:
-            dest_fd.write(buf)
-            n_bytes += len(buf)
-            buf = input_fd.read(ten_mb)
+        if isinstance(input_fd, file) and isinstance(dest_fd, file):
+            # local to local:  let the kernel do the copy.  Whatever it
+            # can't copy is done by the buffered copy below.
+            n_bytes += kernel_copy(input_fd, dest_fd)
+        n_bytes += engine.copy(input_fd, dest_fd)
     return n_bytes
 
-def append_dir(d, output):
+def append_dir(d, output, engine=None):
     """
     Appends the contents of all files within directory d to the output.
     The contents within the directory are ordered by name.
 
     Returns the number of bytes appended to the output.
     """
-    contents = [ e for e in sorted(phdfs.ls(d)) if not os.path.basename(e).startswith('_') ]
+    engine = engine or CopyEngine()
+    # the listing tells us which entries are directories, so we don't stat them again
+    contents = [ info for info in sorted(hfs.ls(d), key=lambda info: info['name'])
+                 if not os.path.basename(info['name']).startswith('_') ]
     _log.debug("Appending %s items from directory %s", len(contents), d)
     n_bytes = 0
-    for c in contents:
-        if phdfs.path.isdir(c):
-            _log.debug("Recursively descending into %s", c)
-            n_bytes += append_dir(c, output)
+    for info in contents:
+        if info['kind'] == 'directory':
+            _log.debug("Recursively descending into %s", info['name'])
+            n_bytes += append_dir(info['name'], output, engine)
         else:
-            n_bytes += append_file(c, output)
+            n_bytes += append_file(info['name'], output, engine)
     return n_bytes
 
+def iter_files(pset):
+    """
+    Yield the files referenced by the pathset, in the same order in
+    which perform_copy concatenates them:  directories are expanded
+    recursively, their contents ordered by name and hidden ('_') files
+    skipped.
+    """
+    def expand_dir(d):
+        for info in sorted(hfs.ls(d), key=lambda info: info['name']):
+            if os.path.basename(info['name']).startswith('_'):
+                continue
+            if info['kind'] == 'directory':
+                for f in expand_dir(info['name']):
+                    yield f
+            else:
+                yield info['name']
+
+    for p, meta in pset.iter_with_meta():
+        if _is_dir(p, meta):
+            for f in expand_dir(p):
+                yield f
+        else:
+            yield p
+
+def _is_dir(path, meta=None):
+    """
+    Whether path is a directory.  Uses the pathset metadata, if available,
+    to avoid a call to the file system.
+    """
+    if meta is not None and meta.kind is not None:
+        return meta.kind == 'directory'
+    return hfs.isdir(path)
+
+class _PrefetchSlot(object):
+    """
+    The chunks of one source file read ahead of the writer.
+    """
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        self.chunks = collections.deque()
+        self.done = False
+        self.error = None
+
+class ReadAheadCopier(object):
+    """
+    Concatenates files with a pool of reader threads that open and read
+    the next files while a single writer appends the data to the output,
+    in order.
+
+    The readers take the files in order from a shared iterator.  The data
+    they have read and the writer hasn't yet written is limited to
+    max_in_flight bytes.  The reader of the file currently being written
+    may always read one chunk ahead, so the writer can never starve.
+    """
+
+    def __init__(self, n_readers, max_in_flight, chunk_size=DefaultCopyBufferSize):
+        if n_readers <= 0:
+            raise ValueError("n_readers must be > 0 (got %s)" % n_readers)
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be > 0 (got %s)" % chunk_size)
+        if max_in_flight < chunk_size:
+            raise ValueError("max_in_flight (%s) must be at least as large as chunk_size (%s)" % (max_in_flight, chunk_size))
+        self.n_readers = n_readers
+        self.max_in_flight = max_in_flight
+        self.chunk_size = chunk_size
+
+    def _reset(self, file_iter):
+        self._cond = threading.Condition()
+        self._files = file_iter
+        self._slots = []
+        self._all_assigned = False
+        self._aborted = False
+        # set if file_iter raises
+        self._error = None
+        self._head = 0
+        self._in_flight = 0
+
+    def _next_slot(self):
+        with self._cond:
+            if self._aborted or self._all_assigned:
+                return None
+            try:
+                path = next(self._files)
+            except StopIteration:
+                self._all_assigned = True
+                self._cond.notify_all()
+                return None
+            except BaseException as e:
+                # e.g., failing to list a directory.  The writer raises it.
+                self._error = e
+                self._aborted = True
+                self._cond.notify_all()
+                return None
+            slot = _PrefetchSlot(len(self._slots), path)
+            self._slots.append(slot)
+            self._cond.notify_all()
+            return slot
+
+    def _reserve(self, slot):
+        """
+        Wait until there's room for another chunk.  Returns False if aborted.
+        """
+        with self._cond:
+            while not self._aborted:
+                if self._in_flight + self.chunk_size <= self.max_in_flight or \
+                        (slot.index == self._head and not slot.chunks):
+                    self._in_flight += self.chunk_size
+                    return True
+                self._cond.wait()
+            return False
+
+    def _reader(self):
+        while True:
+            slot = self._next_slot()
+            if slot is None:
+                return
+            try:
+                with open_file(slot.path) as f:
+                    while self._reserve(slot):
+                        data = f.read(self.chunk_size)
+                        with self._cond:
+                            self._in_flight -= self.chunk_size - len(data)
+                            if data:
+                                slot.chunks.append(data)
+                            else:
+                                slot.done = True
+                            self._cond.notify_all()
+                        if not data:
+                            break
+            except BaseException as e:
+                with self._cond:
+                    slot.error = e
+                    self._cond.notify_all()
+                return
+
+    def _write(self, output_fd, callback):
+        n_bytes = 0
+        with self._cond:
+            while True:
+                while self._head >= len(self._slots) and not (self._all_assigned or self._error):
+                    self._cond.wait()
+                if self._error:
+                    raise self._error
+                if self._head >= len(self._slots):
+                    return n_bytes
+                slot = self._slots[self._head]
+                while True:
+                    while not (slot.chunks or slot.done or slot.error or self._error):
+                        self._cond.wait()
+                    if self._error:
+                        raise self._error
+                    if slot.error:
+                        raise slot.error
+                    if not slot.chunks:
+                        break
+                    data = slot.chunks.popleft()
+                    self._cond.release()
+                    try:
+                        output_fd.write(data)
+                    finally:
+                        self._cond.acquire()
+                    self._in_flight -= len(data)
+                    n_bytes += len(data)
+                    self._cond.notify_all()
+                # release the slot so that its memory can be reclaimed
+                self._slots[self._head] = None
+                self._head += 1
+                self._cond.notify_all()
+                if callback:
+                    callback(slot.path, n_bytes)
+
+    def copy(self, file_iter, output_fd, callback=None):
+        """
+        Append the files yielded by file_iter to output_fd.  If provided,
+        callback(path, total_bytes) is called after each file is written.
+
+        Returns the number of bytes written.
+        """
+        self._reset(iter(file_iter))
+        readers = [ threading.Thread(target=self._reader, name="ReadAhead-%d" % i) for i in xrange(self.n_readers) ]
+        for t in readers:
+            t.daemon = True
+            t.start()
+        try:
+            return self._write(output_fd, callback)
+        finally:
+            with self._cond:
+                self._aborted = True
+                self._cond.notify_all()
+            for t in readers:
+                t.join()
+
 def open_file(path, mode='r'):
-    u = urlparse(phdfs.path.abspath(path))
-    if u.scheme == 'file':
-        return open(u.path, mode)
-    else:
-        return phdfs.open(path, mode)
+    return hfs.open(path, mode)
 
-def perform_copy(src_pathset, output_uri, delete_source=False):
+def perform_copy(src_pathset, output_uri, delete_source=False, buffer_size=DefaultCopyBufferSize,
+        readers=0, max_in_flight=None):
     """
     :param src_pathset: Pathset from which to copy data
     :param output_uri: URI to which data will be written.
     :param delete_source: if True, the files/directories referenced by `src_pathset` will be deleted after successully copying their data to `output_path`.
+    :param buffer_size: size in bytes of the buffer used to copy the data.
+    :param readers: if > 0, the number of threads reading ahead of the writer (see ReadAheadCopier).
+    :param max_in_flight: maximum number of bytes read ahead with `readers` (default: 4 buffers per reader).
     """
     # validate input
     parsed_output = urlparse(output_uri)
@@ -100,37 +300,45 @@ def perform_copy(src_pathset, output_uri, delete_source=False):
               100*(float(i) / total), float(n_bytes) / 2**20)
     progress(0)
 
-    first_src_uri = iter(src_pathset).next()
-    u = urlparse(first_src_uri)
+    first_src_uri, first_meta = iter(src_pathset.iter_with_meta()).next()
 
-    if len(src_pathset) == 1 and u.scheme == 'file' and os.path.isfile(u.path) and parsed_output.scheme == 'file':
+    if total == 1 and hfs.split_uri(first_src_uri)[0] == hfs.split_uri(output_uri)[0] == '' \
+            and not _is_dir(first_src_uri, first_meta):
         # Handle single file on local file system as a special case
         _log.debug("Pathset contains single local file. Trying to hard link")
         try:
-            link_file(first_src_uri, parsed_output.path, delete_source)
+            link_file(first_src_uri, output_uri, delete_source)
             progress(total)
             return
-        except OSError:
+        except IOError:
             _log.debug("linking failed.  Continue with simple copy")
 
+    engine = CopyEngine(buffer_size)
     start_time = time.time()
     with open_file(output_uri, 'w') as output_fd:
         _log.debug("output_path %s opened for writing", output_uri)
         try:
-          for idx, p in enumerate(src_pathset):
-            _log.debug("appending path %s", p)
-            if phdfs.path.isdir(p):
-                n_bytes += append_dir(p, output_fd)
-            else:
-                n_bytes += append_file(p, output_fd)
-            if idx % 5 == 0:
-                progress(idx + 1)
-            progress(len(src_pathset))
+          if readers > 0:
+            copier = ReadAheadCopier(readers, max_in_flight or 4 * readers * buffer_size, buffer_size)
+            _log.info("Reading ahead with %s threads (max %0.1f MB in flight)", readers,
+                    float(copier.max_in_flight) / 2**20)
+            n_bytes += copier.copy(iter_files(src_pathset), output_fd, _log_appended)
+            progress(total)
+          else:
+            for idx, (p, meta) in enumerate(src_pathset.iter_with_meta()):
+              _log.debug("appending path %s", p)
+              if _is_dir(p, meta):
+                  n_bytes += append_dir(p, output_fd, engine)
+              else:
+                  n_bytes += append_file(p, output_fd, engine)
+              if idx % 5 == 0:
+                  progress(idx + 1)
+            progress(total)
         except StandardError as e:
             _log.exception(e)
             _log.info('Trying to clean-up partial output file %s', output_uri)
             try:
-                phdfs.rmr(output_uri)
+                hfs.rm(output_uri)
             except StandardError:
                 pass
             raise e
@@ -142,10 +350,13 @@ def perform_copy(src_pathset, output_uri, delete_source=False):
         _log.info("Deleting source data")
         _delete_pathset_data(src_pathset)
 
+def _log_appended(path, total_bytes):
+    _log.debug("appended path %s. Copied %0.1f MB", path, float(total_bytes) / 2**20)
+
 def _delete_pathset_data(pset):
     for path in pset:
         try:
-            phdfs.rmr(path)
+            hfs.rm(path)
         except IOError as e:
             _log.warn("Unable to delete source path %s", path)
             _log.warn(str(e))
@@ -157,12 +368,25 @@ def parse_args(args):
     parser.add_argument('output_file', help="Output file to be written")
     parser.add_argument('--delete-source', action='store_true', default=False,
             help="Delete the data referenced by the source pathset after it has been concatenated into the destination file.")
+    parser.add_argument('--buffer-size', metavar="KB", type=int, default=DefaultCopyBufferSize // 2**10,
+            help="Size of the copy buffer (default: %s)" % (DefaultCopyBufferSize // 2**10))
+    parser.add_argument('--readers', metavar="N", type=int, default=0,
+            help="Read ahead with N parallel reader threads.  Useful with HDFS sources (default: 0, no read-ahead)")
+    parser.add_argument('--max-in-flight', metavar="MB", type=int,
+            help="Maximum amount of data read ahead with --readers (default: 4 buffers per reader)")
     parser.add_argument('--log-level',
             choices=['debug', 'info', 'warn', 'error', 'critical'],
             default='info')
 
     options = parser.parse_args(args)
 
+    if options.buffer_size <= 0:
+        parser.error("--buffer-size must be > 0 (got %s)" % options.buffer_size)
+    if options.readers < 0:
+        parser.error("--readers must be >= 0 (got %s)" % options.readers)
+    if options.max_in_flight is not None and options.max_in_flight * 2**20 < options.buffer_size * 2**10:
+        parser.error("--max-in-flight must be at least as large as the buffer size")
+
     if not os.access(options.input_pathset, os.R_OK):
         parser.error("Can't read specified input path %s" % options.input_pathset)
 
@@ -180,8 +404,9 @@ def main(args=None):
       config_logging(options.log_level)
       _log.debug("arguments parsed: %s", options)
 
-      pset = pathset.FilePathset.from_file(options.input_pathset)
-      perform_copy(pset, options.output_file, options.delete_source)
+      pset = pathset.FilePathset.from_file(options.input_pathset, lazy=True)
+      perform_copy(pset, options.output_file, options.delete_source, options.buffer_size * 2**10,
+              options.readers, options.max_in_flight * 2**20 if options.max_in_flight else None)
       return 0
   except StandardError as e:
       _log.critical("IOError copying pathset to %s", options.output_file)
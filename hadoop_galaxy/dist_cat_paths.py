@@ -14,38 +14,43 @@ import sys
 import time
 from urlparse import urlparse
 from uuid import uuid4
-import pydoop.app.main as pydoop_main
-import pydoop.hdfs as phdfs
 
-from hadoop_galaxy.utils import config_logging
+import hadoop_galaxy.fs as hfs
+from hadoop_galaxy.lazy import phdfs, pydoop_main
+from hadoop_galaxy.utils import config_logging, preallocate_file, PreallocStrategies
+from hadoop_galaxy.utils import CopyEngine, DefaultCopyBufferSize, fs_pool
 from hadoop_galaxy.pathset import FilePathset
 from hadoop_galaxy.cat_paths import _delete_pathset_data
 
 from hadoop_galaxy import log
 
-_TenMB = 10 * 2**20
+# job configuration property used to pass the copy buffer size to the tasks
+_ConfBufferSize = 'hadoop_galaxy.dist_cat_paths.buffer.size'
+# src path, src read pos, src read size, dest path, dest write pos
+_NumRecordFields = 5
 
-def serialize(src_path_info, dest_path, dest_pos):
-    return '\t'.join( map(str, (src_path_info.path, 0, src_path_info.size,
-        dest_path, dest_pos)) )
+def serialize(src_path, src_pos, src_size, dest_path, dest_pos):
+    return '\t'.join( map(str, (src_path, src_pos, src_size, dest_path, dest_pos)) )
 
 def unserialize(line):
+    """
+    Parse a line of job input.  A line may pack several consecutive records,
+    so a list of record dicts is returned.
+    """
     fields = line.rstrip().split('\t')
-    if len(fields) != 5:
-        raise ValueError("Invalid format.  Expected 5 lines but found %s. Line: '%s'" % (len(fields), line))
-    return dict(
-        src_path=fields[0],
-        src_pos=int(fields[1]),
-        src_size=int(fields[2]),
-        dest_path=fields[3],
-        dest_pos=int(fields[4]))
+    if len(fields) == 0 or len(fields) % _NumRecordFields != 0:
+        raise ValueError("Invalid format.  Expected a multiple of %s fields but found %s. Line: '%s'" % \
+                (_NumRecordFields, len(fields), line))
+    return [ dict(
+        src_path=fields[i],
+        src_pos=int(fields[i + 1]),
+        src_size=int(fields[i + 2]),
+        dest_path=fields[i + 3],
+        dest_pos=int(fields[i + 4]))
+        for i in xrange(0, len(fields), _NumRecordFields) ]
 
 def open_file(path, mode='r'):
-    u = urlparse(phdfs.path.abspath(path))
-    if u.scheme == 'file':
-        return open(u.path, mode)
-    else:
-        return phdfs.open(path, mode)
+    return hfs.open(path, mode)
 
 def bytes_to_mb(b):
     return b / float(2**20)
@@ -91,9 +96,20 @@ class CopyState(object):
         self._current_time = the_time
 
 
-def mapper(_, line, writer):
-    record = unserialize(line)
+# the copy buffer is allocated once per task process and reused for every record
+_engine = None
+
+def _get_engine(conf):
+    global _engine
+    if _engine is None:
+        try:
+            buffer_size = int(conf[_ConfBufferSize])
+        except KeyError:
+            buffer_size = DefaultCopyBufferSize
+        _engine = CopyEngine(buffer_size)
+    return _engine
 
+def _copy_slice(record, output_fd, writer, engine):
     state = CopyState(record['src_size'])
 
     def statusline():
@@ -101,32 +117,46 @@ def mapper(_, line, writer):
             (state.current_byte, state.total_bytes,
             round(100 * state.fraction),
             bytes_to_mb(state.current_speed),
-            record['src_path'], state.current_byte, state.current_byte + state.total_bytes,
+            record['src_path'], record['src_pos'], record['src_pos'] + state.total_bytes,
             record['dest_path'], record['dest_pos'])
         return msg
     writer.status(statusline())
 
-    u = urlparse(record['dest_path'])
+    with open_file(record['src_path']) as input_fd:
+        input_fd.seek(record['src_pos'])
+        output_fd.seek(record['dest_pos'])
+
+        def progress(n):
+            state.update(state.current_byte + n)
+            writer.count('file bytes written', n)
+            writer.status(statusline())
+
+        # The record may cover only a slice of the source file, so we must
+        # stop after src_size bytes rather than at the end of the file.
+        engine.copy(input_fd, output_fd, state.bytes_left, progress)
+    if state.bytes_left > 0:
+        raise RuntimeError("Unexpected end of file %s. %s bytes short of the expected slice size" % \
+                (record['src_path'], state.bytes_left))
+    writer.count('slices catted', 1)
+    if record['src_pos'] == 0:
+        writer.count('files catted', 1)
+
+def mapper(_, line, writer, conf):
+    records = unserialize(line)
+    engine = _get_engine(conf)
+
+    dest_path = records[0]['dest_path']
+    if any(r['dest_path'] != dest_path for r in records):
+        raise ValueError("All records on an input line must have the same destination. Line: '%s'" % line)
+    u = urlparse(dest_path)
     if u.scheme != 'file':
         raise ValueError("output scheme must be 'file'. Found: %s" % u.scheme)
     if not os.path.exists(u.path):
         raise RuntimeError("Output file %s doesn't exist.  File a bug report" % u.path)
 
-    with open_file(record['src_path']) as input_fd, \
-          open(u.path, 'r+') as output_fd:
-
-        input_fd.seek(record['src_pos'])
-        output_fd.seek(record['dest_pos'])
-        bytes_left = state.bytes_left
-
-        buf = input_fd.read(min(_TenMB, bytes_left))
-        while len(buf) > 0 and bytes_left > 0:
-            output_fd.write(buf)
-            state.update(state.current_byte + len(buf))
-            writer.count('file bytes written', len(buf))
-            buf = input_fd.read(min(_TenMB, bytes_left))
-            writer.status(statusline())
-    writer.count('files catted', 1)
+    with open(u.path, 'r+') as output_fd:
+        for record in records:
+            _copy_slice(record, output_fd, writer, engine)
 
 def parse_args(args):
     description = "Use Hadoop to concatenate the data referenced by a pathset into a\n" + \
@@ -137,11 +167,28 @@ def parse_args(args):
             help="Output file. MUST be on a mounted file system accessible from all Hadoop nodes")
     parser.add_argument('--delete-source', action='store_true', default=False,
             help="Delete the data referenced by the source pathset after it has been concatenated into the destination file.")
+    parser.add_argument('--max-chunk-size', metavar="MB", type=int, default=0,
+            help="Split source files larger than this many MB into several chunks to be copied " +\
+                 "by separate map tasks (default: 0, don't split)")
+    parser.add_argument('--pack-size', metavar="MB", type=int, default=0,
+            help="Pack consecutive small files into a single map task, up to this many MB " +\
+                 "per task (default: 0, one task per file)")
+    parser.add_argument('--preallocate', choices=PreallocStrategies, default='fallocate',
+            help="How to size the output file before launching the copy tasks (default: fallocate)")
+    parser.add_argument('--buffer-size', metavar="KB", type=int, default=DefaultCopyBufferSize // 2**10,
+            help="Size of the copy buffer used by each task (default: %s)" % (DefaultCopyBufferSize // 2**10))
     parser.add_argument('--log-level',
             choices=['debug', 'info', 'warn', 'error', 'critical'],
             default='info')
     options = parser.parse_args(args)
 
+    if options.max_chunk_size < 0:
+        parser.error("--max-chunk-size must be >= 0 (got %s)" % options.max_chunk_size)
+    if options.pack_size < 0:
+        parser.error("--pack-size must be >= 0 (got %s)" % options.pack_size)
+    if options.buffer_size <= 0:
+        parser.error("--buffer-size must be > 0 (got %s)" % options.buffer_size)
+
     if not os.access(options.input_pathset, os.R_OK):
         parser.error("Can't read specified input path %s" % options.input_pathset)
 
@@ -192,6 +239,66 @@ class DistCatPaths(object):
         self._output_path = None
         self._input_pathset = None
         self._delete_source = False
+        self._max_chunk_size = None
+        self._pack_size = None
+        self._preallocate = 'fallocate'
+        self._buffer_size = DefaultCopyBufferSize
+
+    @property
+    def max_chunk_size(self):
+        """
+        Maximum number of bytes copied by a single map task.  Source files larger
+        than this will be split into several byte ranges.  None means no limit.
+        """
+        return self._max_chunk_size
+
+    @max_chunk_size.setter
+    def max_chunk_size(self, v):
+        if v is not None and v <= 0:
+            raise ValueError("max_chunk_size must be > 0 or None (got %s)" % v)
+        self._max_chunk_size = v
+
+    @property
+    def pack_size(self):
+        """
+        Byte budget for packing consecutive small slices into a single map
+        task.  Slices are packed while their total size doesn't exceed this
+        value.  None disables packing.
+        """
+        return self._pack_size
+
+    @pack_size.setter
+    def pack_size(self, v):
+        if v is not None and v <= 0:
+            raise ValueError("pack_size must be > 0 or None (got %s)" % v)
+        self._pack_size = v
+
+    @property
+    def preallocate(self):
+        """
+        Strategy used to allocate the output file before the copy tasks
+        start writing into it.  One of utils.PreallocStrategies.
+        """
+        return self._preallocate
+
+    @preallocate.setter
+    def preallocate(self, v):
+        if v not in PreallocStrategies:
+            raise ValueError("preallocate must be one of %s (got %s)" % (', '.join(PreallocStrategies), v))
+        self._preallocate = v
+
+    @property
+    def buffer_size(self):
+        """
+        Size in bytes of the copy buffer used by each task.
+        """
+        return self._buffer_size
+
+    @buffer_size.setter
+    def buffer_size(self, v):
+        if v <= 0:
+            raise ValueError("buffer_size must be > 0 (got %s)" % v)
+        self._buffer_size = v
 
     @property
     def delete_source(self):
@@ -225,28 +332,65 @@ class DistCatPaths(object):
         source_paths = []
 
         def ordered_traverse(root):
-            host, port, root_path = phdfs.path.split(root)
-            fs = phdfs.fs.hdfs(host, port)
+            root_path = phdfs.path.split(root)[2]
+            fs = fs_pool.get_for(root)
             ipaths = \
                 iter(_PathInfo(info['name'], info['size'])
                         for info in fs.walk(root_path)
                             if not os.path.basename(info['name']).startswith('_') and info['kind'] == 'file')
             # appends to the list defined in the parent function
             source_paths.extend(sorted(ipaths, cmp=lambda x, y: cmp(x.path, y.path)))
-        for p in pset:
-            ordered_traverse(p)
+        for p, meta in pset.iter_with_meta():
+            if meta is not None and meta.kind == 'file' and meta.size is not None:
+                # the pathset already tells us what we need; no need to ask the namenode
+                if not os.path.basename(p).startswith('_'):
+                    source_paths.append(_PathInfo(p, meta.size))
+            else:
+                ordered_traverse(p)
         return source_paths
 
+    @staticmethod
+    def split_path_info(src, max_chunk_size):
+        """
+        Split a _PathInfo into (src_pos, src_size) slices of at most
+        max_chunk_size bytes.  Empty files produce a single empty slice.
+        """
+        if not max_chunk_size or src.size <= max_chunk_size:
+            return [ (0, src.size) ]
+        return [ (pos, min(max_chunk_size, src.size - pos))
+                    for pos in xrange(0, src.size, max_chunk_size) ]
+
     def _write_mr_input(self, fd):
+        """
+        Write the copy tasks, one per line.  Each line contains one or more
+        records (more than one only when packing).
+
+        Returns the number of lines written.
+        """
         if self._src_paths is None or self._output_path is None:
             raise RuntimeError("You must set source and destination paths")
 
+        count = 0
+        pack = []
+        pack_bytes = 0
+
+        def flush():
+            fd.write("%s\n" % '\t'.join(pack))
+            del pack[:]
+            return 1
+
         dest_pos = 0
         for src in self._src_paths:
-            # src path, src read pos, src read size, dest path, dest write pos
-            line = serialize(src, self.output_path, dest_pos)
-            fd.write("%s\n" % line)
+            for src_pos, src_size in self.split_path_info(src, self._max_chunk_size):
+                if pack and (not self._pack_size or pack_bytes + src_size > self._pack_size):
+                    count += flush()
+                    pack_bytes = 0
+                pack.append(serialize(src.path, src_pos, src_size, self.output_path, dest_pos + src_pos))
+                pack_bytes += src_size
             dest_pos += src.size
+        if pack:
+            count += flush()
+        return count
 
     @staticmethod
     def _clean_up(*paths):
@@ -263,10 +407,11 @@ class DistCatPaths(object):
             raise RuntimeError("You must set the input pathset before running")
 
         log.info("Analysing input paths")
-        pset = FilePathset.from_file(self._input_pathset)
+        pset = FilePathset.from_file(self._input_pathset, lazy=True)
         self._src_paths = self.traverse_input(pset)
+        total_size = sum(i.size for i in self._src_paths)
         log.info("Found %s input paths for a total of %0.1f MB", len(self._src_paths),
-                sum(i.size for i in self._src_paths) / float(2**20))
+                total_size / float(2**20))
 
         output_dir = os.path.dirname(self.output_path)
         work_dir = os.path.join(output_dir, str(uuid4()))
@@ -284,7 +429,7 @@ class DistCatPaths(object):
         log.debug("work_exec_path: %s", work_exec_path)
 
         host, port, path = phdfs.path.split(work_dir)
-        fs = phdfs.fs.hdfs(host, port)
+        fs = fs_pool.get(host, port)
         if not fs.exists(path):
             log.debug("Creating work directory %s on fs (%s, %s)", path, host, port)
             fs.create_directory(path)
@@ -292,22 +437,25 @@ class DistCatPaths(object):
             log.debug("Creating job input file %s", work_input_path)
             # need to only pass the path to this call (no host/port)
             with fs.open_file(phdfs.path.split(work_input_path)[2], 'w') as f:
-                self._write_mr_input(f)
-            log.debug("Wrote temp input file %s", work_input_path)
+                num_records = self._write_mr_input(f)
+            log.debug("Wrote temp input file %s (%s records)", work_input_path, num_records)
 
-            # Create/truncate the output file. The individual tasks will later
+            # Create the output file with its final size. The individual tasks will later
             # reopen it for writing and copy their chunk to the appropriate position
-            log.info("Creating output file %s", work_output_path)
-            with open(phdfs.path.split(self.output_path)[2], 'w'):
-                pass
+            log.info("Creating output file %s (%s bytes, preallocation: %s)",
+                    self.output_path, total_size, self._preallocate)
+            used = preallocate_file(phdfs.path.split(self.output_path)[2], total_size, self._preallocate)
+            if used != self._preallocate:
+                log.info("Output file preallocated with strategy '%s'", used)
 
             script_args = [
                 'script',
                 '--num-reducers', '0',
-                '-Dmapred.map.tasks=%d' % len(self._src_paths),
+                '-Dmapred.map.tasks=%d' % num_records,
                 '-Dmapred.input.format.class=org.apache.hadoop.mapred.lib.NLineInputFormat',
                 '-Dmapred.line.input.format.linespermap=1',
                 '-Dmapred.map.tasks.speculative.execution=false',
+                '-D%s=%d' % (_ConfBufferSize, self._buffer_size),
                 __file__,
                 work_input_path,
                 work_output_path ]
@@ -328,6 +476,12 @@ def run_program(options):
     driver.set_src_pathset(options.input_pathset)
     driver.output_path = options.output_file
     driver.delete_source = options.delete_source
+    driver.preallocate = options.preallocate
+    driver.buffer_size = options.buffer_size * 2**10
+    if options.max_chunk_size > 0:
+        driver.max_chunk_size = options.max_chunk_size * 2**20
+    if options.pack_size > 0:
+        driver.pack_size = options.pack_size * 2**20
 
     start_time = time.time()
 
@@ -11,33 +11,13 @@ import logging
 import os
 import sys
 import tempfile
-from urlparse import urlparse
-import warnings
 
-import hadoop_galaxy.text_zipper_mr as text_zipper_mr
+import hadoop_galaxy.fs as hfs
 import hadoop_galaxy.utils as utils
+from hadoop_galaxy.lazy import phdfs as hdfs, pydoop_main as pydoop_app
 
-import pydoop.hdfs as hdfs
-import pydoop.app.main as pydoop_app
-
-def walk(fs, root):
-    """
-    Walk a directory hierarchy.  Yield all files.
-    """
-    root_info = fs.get_path_info(root)
-    if root_info['kind'] == 'file':
-        # special case -- the root is a file, so we yield it and exit
-        yield root_info
-    elif root_info['kind'] == 'directory':
-        listing = fs.list_directory(root_info['name'])
-        for parent in listing:
-            if parent['kind'] == 'file':
-                yield parent
-            else:
-                for child in walk(fs, parent['name']):
-                    yield child
-    else:
-        warnings.warn("Skipping item %s. Unsupported file kind %s" % (root_info['name'], root_info['kind']))
+# the pydoop script run by the job.  We don't import it, since it loads pydoop.
+TextZipperScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'text_zipper_mr.py')
 
 class TextZipperDriver(object):
     def __init__(self, options):
@@ -64,15 +44,13 @@ class TextZipperDriver(object):
         """
         count = 0
         for input_root in sorted(self.input_paths):
-            fs_host, fs_port, _ = hdfs.path.split(input_root)
-            fs = hdfs.fs.hdfs(fs_host, fs_port)
             self.log.debug("Walking %s", input_root)
-            files = [ file_info['name'] for file_info in walk(fs, input_root) ]
+            files = [ info['name'] for info in hfs.walk(input_root) if info['kind'] == 'file' ]
             files.sort()
             for in_name in files:
                 if input_root == in_name:
                     # the file was explicitly named as an input path
-                    root = hdfs.path.dirname(in_name)
+                    root = os.path.dirname(in_name)
                     output_name = os.path.basename(in_name)
                 else:
                     root = input_root
@@ -114,7 +92,7 @@ class TextZipperDriver(object):
                       '-Dmapred.line.input.format.linespermap=1',
                       '-Dmapred.output.compress=true',
                       '-Dmapred.output.compression.codec=%s' % 'org.apache.hadoop.io.compress.GzipCodec',
-                      text_zipper_mr.__file__,
+                      TextZipperScript,
                       input_filename,
                       self.output_path]
                 self.log.debug("pydoop_args: %s", pydoop_args)
@@ -144,20 +122,13 @@ class TextZipperDriver(object):
 
     def rename_compressed_files(self, file_table):
         # find the extension
-        output_files = hdfs.ls(self.output_path)
+        output_files = [ info['name'] for info in hfs.ls(self.output_path) ]
         if len(output_files) == 0:
             return
 
         compressor_extension = self.get_compressor_extension(output_files)
         self.log.debug("compressor extension is %s", compressor_extension)
 
-        hdfs_host, hdfs_port, _ = hdfs.path.split(output_files[0])
-        if hdfs_host == '':
-            is_local_fs = True
-        else:
-            is_local_fs = False
-            output_hdfs = hdfs.hdfs(hdfs_host, hdfs_port)
-
         file_table.seek(0)
         for mapid, line in enumerate(file_table.xreadlines()):
             _, _, relative_output_name = line.rstrip('\n').split('\t')
@@ -168,19 +139,13 @@ class TextZipperDriver(object):
             desired_file_name = os.path.join(self.output_path, relative_output_name) + compressor_extension
             if hadoop_output != desired_file_name:
                 self.log.debug("renaming %s to %s", hadoop_output, desired_file_name)
-                if is_local_fs:
-                    # Though we could transparently use hdfs.move for both local fs and hdfs,
-                    # using native methods for the local fs should be faster.
-                    # os.renames automatically creates necessary parent directories for destination.
-                    os.renames(urlparse(hadoop_output).path, urlparse(desired_file_name).path)
-                else:
-                    # create the output subdirectory, if necessary
-                    dirname = os.path.dirname(relative_output_name)
-                    if dirname:
-                        output_hdfs.create_directory( os.path.join(self.output_path, dirname) )
-                    if output_hdfs.exists(desired_file_name):
-                        raise RuntimeError("Can't overwrite file in output directory: %s" % desired_file_name)
-                    output_hdfs.move(hadoop_output, output_hdfs, desired_file_name)
+                # create the output subdirectory, if necessary
+                dirname = os.path.dirname(relative_output_name)
+                if dirname:
+                    hfs.mkdir(os.path.join(self.output_path, dirname))
+                if hfs.exists(desired_file_name):
+                    raise RuntimeError("Can't overwrite file in output directory: %s" % desired_file_name)
+                hfs.rename(hadoop_output, desired_file_name)
 
 def parse_args(args):
     parser = argparse.ArgumentParser(description="Distributed text file zipper.")
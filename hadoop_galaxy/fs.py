@@ -0,0 +1,536 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+File system access for all the tools, whatever the URI scheme.
+
+The functions at the bottom of this module (stat, ls, walk, open, rename,
+rm, link, ...) take full URIs and dispatch them to a backend picked by
+scheme:  LocalFs for file: URIs, which doesn't load pydoop, and a pydoop
+hdfs handle for all others.  Backend handles come from the process-wide
+`fs_pool` and have the pydoop hdfs interface, so code that needs to make
+several calls on the same file system can get one and use it directly.
+
+Like pydoop, all the functions raise IOError on failure.
+"""
+
+import __builtin__
+import atexit
+import collections
+import errno
+import logging
+import os
+import shutil
+import stat as _stat
+import threading
+import time
+import urlparse
+import uuid
+
+from hadoop_galaxy.lazy import phdfs
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+class OpCounter(object):
+    """
+    Thread-safe counters, used to keep track of the file system
+    operations (i.e., namenode RPCs) performed by the tools.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = collections.defaultdict(int)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def get(self, name):
+        with self._lock:
+            return self._counts.get(name, 0)
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self._counts.itervalues())
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+# process-wide counters of file system operations
+fs_op_counter = OpCounter()
+
+def split_uri(uri):
+    """
+    Split uri into (host, port, path), like pydoop.hdfs.path.split.  The
+    host of file: URIs is '' (the local file system).  Those are split
+    here, without loading pydoop.
+    """
+    if uri.startswith('file:'):
+        return '', 0, urlparse.urlparse(uri).path
+    return phdfs.path.split(uri)
+
+class LocalFs(object):
+    """
+    A pure-Python implementation of the parts of the pydoop hdfs file
+    system interface used by Hadoop-Galaxy, for the local file system.
+    Paths are local paths.  Path info dictionaries have the same keys as
+    pydoop's, except for those (owner, replication, ...) we don't use.
+
+    Directories are listed with scandir, if available, and each entry is
+    stat'ed once to get both its kind and size.
+    """
+    host = ''
+    port = 0
+
+    @staticmethod
+    def _info(path, st):
+        return {
+            'name': 'file://' + os.path.abspath(path),
+            'kind': 'directory' if _stat.S_ISDIR(st.st_mode) else 'file',
+            'size': st.st_size,
+            'last_mod': int(st.st_mtime),
+            'last_access': int(st.st_atime),
+            'permissions': _stat.S_IMODE(st.st_mode),
+        }
+
+    @staticmethod
+    def _io_error(e):
+        # pydoop raises IOError for all file system errors
+        return IOError(e.errno, e.strerror, e.filename)
+
+    def get_path_info(self, path):
+        try:
+            return self._info(path, os.stat(path))
+        except OSError as e:
+            raise self._io_error(e)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def _entry_info(self, path, entry_stat):
+        try:
+            return self._info(path, entry_stat())
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise self._io_error(e)
+            # a dangling symlink
+            return self._info(path, os.lstat(path))
+
+    def list_directory(self, path):
+        """
+        Returns the infos of the contents of directory path or, if path is
+        a file, a list with its info (like pydoop).
+        """
+        try:
+            if _scandir is not None:
+                return [ self._entry_info(e.path, e.stat) for e in _scandir(path) ]
+            return [ self._entry_info(p, lambda: os.stat(p))
+                     for p in (os.path.join(path, n) for n in os.listdir(path)) ]
+        except OSError as e:
+            if e.errno == errno.ENOTDIR:
+                return [ self.get_path_info(path) ]
+            raise self._io_error(e)
+
+    def walk(self, top):
+        """
+        Yield the info of top and of everything below it, top-down.
+        """
+        info = self.get_path_info(top)
+        yield info
+        if info['kind'] == 'directory':
+            dirs = [ top ]
+            while dirs:
+                children = self.list_directory(dirs.pop())
+                for child in children:
+                    yield child
+                dirs.extend(reversed([ urlparse.urlparse(c['name']).path
+                                       for c in children if c['kind'] == 'directory' ]))
+
+    def open_file(self, path, mode='r', buff_size=0, replication=0, blocksize=0, readahead=0):
+        return __builtin__.open(path, mode)
+
+    def create_directory(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST or not os.path.isdir(path):
+                raise self._io_error(e)
+
+    def delete(self, path, recursive=True):
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                if recursive:
+                    shutil.rmtree(path)
+                else:
+                    os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            raise self._io_error(e)
+
+    def rename(self, from_path, to_path):
+        try:
+            os.rename(from_path, to_path)
+        except OSError as e:
+            raise self._io_error(e)
+
+    def link(self, src_path, dest_path):
+        try:
+            os.link(src_path, dest_path)
+        except OSError as e:
+            raise self._io_error(e)
+
+    def utime(self, path, mtime, atime):
+        try:
+            os.utime(path, (atime, mtime))
+        except OSError as e:
+            raise self._io_error(e)
+
+    def close(self):
+        pass
+
+def connect(host, port, user=None):
+    """
+    Open a file system handle:  a LocalFs for the local file system
+    (host ''), a pydoop hdfs handle for all others.
+    """
+    if host == '':
+        return LocalFs()
+    return phdfs.hdfs(host, port, user)
+
+DefaultFsPoolSize = 16
+
+class FsPool(object):
+    """
+    A bounded pool of pydoop hdfs file system handles, keyed by
+    (host, port, user).  Opening a handle sets up a new JNI connection,
+    so the tools get their handles from the process-wide `fs_pool`
+    rather than opening one for each path they look at.
+
+    When the pool is full, the least recently used handle is dropped from
+    it to make room.  It isn't closed, since other threads may still be
+    using it:  like all handles, it's closed at exit (by close_all).
+    Handles obtained from the pool must not be closed by the caller.
+
+    The `counter` records the number of 'hits' (handle reused), 'opened',
+    'evicted' and 'closed' handles.
+
+    `connect` is the function called to open new handles, with arguments
+    (host, port, user).  It defaults to `connect`, which doesn't load
+    pydoop for the local file system.
+    """
+    def __init__(self, max_size=DefaultFsPoolSize, connect=None):
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1 (got %s)" % max_size)
+        self.max_size = max_size
+        self._connect = connect
+        self.counter = OpCounter()
+        self._lock = threading.Lock()
+        self._handles = collections.OrderedDict()
+        # handles dropped from the pool, closed by close_all
+        self._evicted = []
+
+    def get(self, host='default', port=0, user=None):
+        """
+        Returns a handle to the file system at host:port, as user.
+        Arguments have the same meaning as in pydoop.hdfs.hdfs.
+        """
+        key = (host, port, user)
+        with self._lock:
+            fs = self._handles.pop(key, None)
+            if fs is not None:
+                self.counter.incr('hits')
+            else:
+                if len(self._handles) >= self.max_size:
+                    _, oldest = self._handles.popitem(last=False)
+                    self._evicted.append(oldest)
+                    self.counter.incr('evicted')
+                fs = (self._connect or connect)(host, port, user)
+                self.counter.incr('opened')
+            self._handles[key] = fs # most recently used
+            return fs
+
+    def get_for(self, uri, user=None):
+        """
+        Returns a handle to the file system of uri.
+        """
+        host, port, _ = split_uri(uri)
+        return self.get(host, port, user)
+
+    def _close(self, fs):
+        try:
+            fs.close()
+        except StandardError as e:
+            logging.getLogger('HadoopGalaxy').debug("Error closing file system handle: %s", e)
+        self.counter.incr('closed')
+
+    def close_all(self):
+        with self._lock:
+            while self._handles:
+                _, fs = self._handles.popitem(last=False)
+                self._close(fs)
+            while self._evicted:
+                self._close(self._evicted.pop(0))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+# process-wide pool of file system handles
+fs_pool = FsPool()
+atexit.register(fs_pool.close_all)
+
+def _resolve(uri):
+    """
+    Returns the pooled handle to the file system of uri and the path of
+    uri within it.
+    """
+    host, port, path = split_uri(uri)
+    return fs_pool.get(host, port), path
+
+def _same_fs(uri1, uri2):
+    host1, port1, path1 = split_uri(uri1)
+    host2, port2, path2 = split_uri(uri2)
+    if (host1, port1) != (host2, port2):
+        raise IOError(errno.EXDEV, "%s and %s are on different file systems" % (uri1, uri2))
+    return fs_pool.get(host1, port1), path1, path2
+
+def stat(uri):
+    """
+    Returns the info dictionary of uri (see pydoop.hdfs.hdfs.get_path_info).
+    Raises IOError if uri doesn't exist.
+    """
+    fs, path = _resolve(uri)
+    return fs.get_path_info(path)
+
+def exists(uri):
+    fs, path = _resolve(uri)
+    return fs.exists(path)
+
+def isdir(uri):
+    """
+    Whether uri is a directory.  False if it doesn't exist.
+    """
+    try:
+        return stat(uri)['kind'] == 'directory'
+    except IOError:
+        return False
+
+def ls(uri):
+    """
+    Returns the infos of the contents of directory uri or, if uri is a
+    file, a list with its info.  Names are full URIs.
+    """
+    fs, path = _resolve(uri)
+    return fs.list_directory(path)
+
+def walk(uri):
+    """
+    Yield the infos of uri and of everything below it.
+    """
+    fs, path = _resolve(uri)
+    return fs.walk(path)
+
+def open(uri, mode='r'):
+    """
+    Open the file at uri.  Local files are opened as regular Python files.
+    """
+    fs, path = _resolve(uri)
+    return fs.open_file(path, mode)
+
+def mkdir(uri):
+    """
+    Create directory uri and its missing parents.
+    """
+    fs, path = _resolve(uri)
+    fs.create_directory(path)
+
+def rename(src_uri, dest_uri):
+    fs, src_path, dest_path = _same_fs(src_uri, dest_uri)
+    fs.rename(src_path, dest_path)
+
+def rm(uri):
+    """
+    Remove uri and, if it's a directory, everything below it.
+    """
+    fs, path = _resolve(uri)
+    fs.delete(path)
+
+def utime(uri, mtime, atime=None):
+    """
+    Set the modification and access times of uri, in seconds since the
+    epoch.  atime defaults to mtime.
+    """
+    fs, path = _resolve(uri)
+    fs.utime(path, int(mtime), int(mtime if atime is None else atime))
+
+def link(src_uri, dest_uri):
+    """
+    Hard link src_uri to dest_uri.  Only supported on the local file system:
+    callers are expected to fall back to copying when this raises IOError.
+    """
+    fs, src_path, dest_path = _same_fs(src_uri, dest_uri)
+    if not hasattr(fs, 'link'):
+        raise IOError(errno.EOPNOTSUPP, "Hard links aren't supported on %s" % src_uri)
+    fs.link(src_path, dest_path)
+
+class LockFile(object):
+    """
+    A lock held by creating the file at `uri`, for processes that share
+    a directory on any file system.  The file contains a token that's
+    unique to each acquisition, identifying its owner.
+
+    While the lock is held, a thread refreshes the file's modification time
+    every `refresh_interval` seconds.  A lock that hasn't been refreshed in
+    `timeout` seconds was left behind by a process that died, so `acquire`
+    removes it.  Since a process that's only slow may then find its lock
+    taken over, holders must call `check` before committing the work the
+    lock protects.  Use it as a context manager or call acquire and release.
+    """
+    def __init__(self, uri, timeout=600, poll_interval=1, refresh_interval=60):
+        self.uri = uri
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.locked = False
+        self.token = None
+        self._refresher = None
+        self._stop_refresh = threading.Event()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+        return False
+
+    def try_acquire(self):
+        """
+        Create the lock file, unless it exists.  Returns whether it was
+        created.  The lock isn't refreshed:  use acquire for that.
+        """
+        token = uuid.uuid4().hex
+        host, port, path = split_uri(self.uri)
+        if host == '':
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+            try:
+                os.write(fd, token)
+            finally:
+                os.close(fd)
+        else:
+            # On HDFS, renaming fails if the destination exists
+            tmp = '%s.%s' % (self.uri, token)
+            with open(tmp, 'w') as f:
+                f.write(token)
+            try:
+                rename(tmp, self.uri)
+            except IOError:
+                rm(tmp)
+                return False
+        self.token = token
+        return True
+
+    def owner(self):
+        """
+        The token in the lock file, or None if it doesn't exist.
+        """
+        try:
+            with open(self.uri) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def age(self):
+        """
+        Seconds since the lock file was last modified (0 if it doesn't exist).
+        """
+        try:
+            mtime = stat(self.uri)['last_mod']
+        except IOError:
+            return 0 # it was just removed
+        return time.time() - mtime
+
+    def acquire(self):
+        """
+        Wait until the lock can be created, and start refreshing it.
+        """
+        log = logging.getLogger('HadoopGalaxy')
+        while not self.try_acquire():
+            owner = self.owner()
+            # Other waiters may remove the stale lock and take it before we
+            # do:  make sure it's still the one we found stale.
+            if owner is not None and self.age() > self.timeout and self.owner() == owner:
+                log.warning("Removing stale lock %s", self.uri)
+                self._remove()
+            else:
+                log.debug("Waiting for lock %s", self.uri)
+                time.sleep(self.poll_interval)
+        self.locked = True
+        self._stop_refresh.clear()
+        self._refresher = threading.Thread(target=self._refresh, name='lock-refresh')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def held(self):
+        """
+        Whether we hold the lock:  it's still ours, and wasn't removed as
+        stale (and maybe taken) by another process.
+        """
+        return self.locked and self.owner() == self.token
+
+    def check(self):
+        """
+        Raise IOError unless we hold the lock (see held).
+        """
+        if not self.held():
+            raise IOError(errno.ENOLCK, "Lost lock %s" % self.uri)
+
+    def _refresh(self):
+        log = logging.getLogger('HadoopGalaxy')
+        while not self._stop_refresh.wait(self.refresh_interval):
+            if not self.held():
+                log.error("Lost lock %s", self.uri)
+                return
+            try:
+                utime(self.uri, time.time())
+            except IOError as e:
+                log.warning("Failed to refresh lock %s: %s", self.uri, e)
+
+    def release(self):
+        if self._refresher is not None:
+            self._stop_refresh.set()
+            self._refresher.join()
+            self._refresher = None
+        if self.locked:
+            # don't remove the lock of the process that took it over
+            if self.held():
+                self._remove()
+            self.locked = False
+            self.token = None
+
+    def _remove(self):
+        try:
+            rm(self.uri)
+        except IOError as e:
+            logging.getLogger('HadoopGalaxy').debug("Error removing %s: %s", self.uri, e)
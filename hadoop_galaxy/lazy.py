@@ -0,0 +1,64 @@
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+"""
+Deferred imports of the pydoop modules.
+
+Importing pydoop.hdfs loads libhdfs and its JNI bindings, which is slow and
+useless for tools that only touch local (file://) paths or are just asked
+for --help.  The modules defined here stand in for the pydoop ones and
+import them the first time one of their attributes is accessed.  Use them
+as you would the real modules:
+
+    from hadoop_galaxy.lazy import phdfs
+    phdfs.path.exists(uri)
+"""
+
+import importlib
+import threading
+
+class LazyModule(object):
+    """
+    A proxy for the module `name`, imported on first attribute access.
+    """
+    _import_lock = threading.Lock()
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self._import_lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    self.__dict__['_module'] = module
+        return module
+
+    @property
+    def loaded(self):
+        """
+        Whether the module has been imported through this proxy.
+        """
+        return self.__dict__['_module'] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module '%s'%s>" % (self._name, '' if self.loaded else ' (not loaded)')
+
+pydoop = LazyModule('pydoop')
+phdfs = LazyModule('pydoop.hdfs')
+pydoop_main = LazyModule('pydoop.app.main')
@@ -9,17 +9,17 @@
 # END_COPYRIGHT
 
 import argparse
+from multiprocessing.pool import ThreadPool
 import os
-import subprocess
 import sys
+import tempfile
+import time
 import urlparse
 
-import pydoop
-import pydoop.hdfs as phdfs
-
+from hadoop_galaxy.lazy import phdfs, pydoop
 from hadoop_galaxy import log
 from hadoop_galaxy.pathset import FilePathset
-from hadoop_galaxy.utils import Uri, expand_paths, print_err
+from hadoop_galaxy.utils import Uri, expand_paths, print_err, config_logging, fs_op_counter, fs_pool, get_path_meta
 
 ValidModes = ('default', 'local')
 
@@ -41,6 +41,7 @@ def resolve_datapath(mode, datapath):
         raise RuntimeError("blank path in %s" % datapath)
 
     if mode == 'default' and not u.scheme: # datapath not specified completely. Assume it's on the default fs
+        fs_op_counter.incr('abspath')
         u = Uri(urlparse.urlparse(phdfs.path.abspath(u.path)))
     elif mode == 'local':
         if u.scheme and u.scheme != 'file':
@@ -55,22 +56,123 @@ def parse_args(args=None):
     parser = argparse.ArgumentParser(description="Make a pathset file from one or more paths")
     parser.add_argument('--force-local', action='store_true', help="Force path to be local (i.e., URI starting with file://")
     parser.add_argument('--data-format', help="Set the type of the pathset contents to this data type (e.g. 'fastq')")
+    parser.add_argument('--resolve-workers', metavar="N", type=int, default=8,
+            help="Number of paths to resolve and expand concurrently (default: 8)")
+    parser.add_argument('--pathset-encoding', choices=FilePathset.Encodings, default=FilePathset.TextEncoding,
+            help="Encoding of the output pathset (default: %s)" % FilePathset.TextEncoding)
+    parser.add_argument('--metadata', choices=['none', 'stat', 'summary'], default='stat',
+            help="Path metadata to record in the pathset: none; size, mtime and kind (stat); " +\
+                 "or also the total size and file count of directories (summary). Default: stat")
+    parser.add_argument('--log-level',
+            choices=['debug', 'info', 'warn', 'error', 'critical'],
+            default='info')
     parser.add_argument('output_path', help="Pathset file to write")
     parser.add_argument('paths', nargs='*', help="Paths to be written to the pathset. Alternatively, provide the on stdin, one per line.")
-    return parser.parse_args(args)
+    options = parser.parse_args(args)
+    if options.resolve_workers <= 0:
+        parser.error("--resolve-workers must be > 0 (got %s)" % options.resolve_workers)
+    if options.metadata == 'none':
+        options.metadata = None
+    return options
+
+def _hadoop_env_key():
+    """
+    A string that changes whenever the Hadoop environment may have changed:
+    the hadoop executable and the configuration directory with the
+    modification times of its files.
+    """
+    conf_dir = os.environ.get('HADOOP_CONF_DIR') or pydoop.hadoop_conf()
+    parts = [ pydoop.hadoop_exec(), conf_dir or '' ]
+    if conf_dir and os.path.isdir(conf_dir):
+        parts.append(str(os.path.getmtime(conf_dir)))
+        for name in sorted(os.listdir(conf_dir)):
+            if name.endswith('.xml'):
+                parts.append("%s:%s" % (name, os.path.getmtime(os.path.join(conf_dir, name))))
+    return '\t'.join(parts)
+
+def _env_marker_path():
+    return os.path.join(tempfile.gettempdir(), "hadoop_galaxy_env_verified.%d" % os.getuid())
 
 def test_hadoop():
     """
-    Test the hadoop configuration.
+    Test the hadoop configuration by connecting to the default file system
+    through pydoop.  A successful test is recorded in a marker file
+    keyed on the Hadoop configuration, so later runs in the same
+    environment skip it.
+
     Calls sys.exit if test fails.
     """
-    cmd = [pydoop.hadoop_exec(), 'dfs', '-stat', 'file:///']
+    marker = _env_marker_path()
     try:
-        subprocess.check_output(cmd)
-    except subprocess.CalledProcessError as e:
-        print_err("Error running hadoop program.  Please check your environment (tried %s)" % ' '.join(cmd))
+        key = _hadoop_env_key()
+    except (OSError, RuntimeError) as e:
+        print_err("Error inspecting the Hadoop environment.  Please check your configuration")
         print_err("Message:", str(e))
         sys.exit(2)
+    try:
+        with open(marker) as f:
+            if f.read() == key:
+                log.debug("Hadoop environment already verified (marker %s)", marker)
+                return
+    except IOError:
+        pass # no marker
+
+    try:
+        fs_pool.get()
+    except StandardError as e:
+        print_err("Error connecting to the default file system.  Please check your environment")
+        print_err("Message:", str(e))
+        sys.exit(2)
+
+    try:
+        # write to a temporary file and rename, so concurrent runs never read a partial key
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(marker), prefix=os.path.basename(marker))
+        with os.fdopen(fd, 'w') as f:
+            f.write(key)
+        os.rename(tmp_path, marker)
+    except (IOError, OSError) as e:
+        log.debug("Couldn't write environment marker %s: %s", marker, e)
+
+class _ResolveExit(Exception):
+    """
+    Carries a sys.exit from a resolver thread to the main thread.
+    """
+    def __init__(self, code):
+        super(_ResolveExit, self).__init__(code)
+        self.code = code
+
+def _resolve_and_expand(work_item):
+    mode, path, metadata = work_item
+    try:
+        uris = expand_paths(resolve_datapath(mode, path))
+    except SystemExit as e:
+        # SystemExit would kill the pool's worker thread and hang the pool
+        raise _ResolveExit(e.code)
+    if metadata is None:
+        return [ (u, None) for u in uris ]
+    return [ (u, get_path_meta(u, summarize_dirs=(metadata == 'summary'))) for u in uris ]
+
+def resolve_paths(mode, data_paths, n_workers=1, metadata=None):
+    """
+    Resolve and expand the data paths into full URIs, working on up to
+    n_workers paths concurrently.  The order of data_paths is preserved.
+
+    metadata: None, to skip collecting path metadata; 'stat', to stat
+    each URI; 'summary', to also compute size and file count for
+    directories.
+
+    Returns a list of (URI, PathMeta or None) tuples.
+    """
+    work = [ (mode, p, metadata) for p in data_paths ]
+    if n_workers <= 1 or len(work) <= 1:
+        expanded = map(_resolve_and_expand, work)
+    else:
+        pool = ThreadPool(min(n_workers, len(work)))
+        try:
+            expanded = pool.map(_resolve_and_expand, work)
+        finally:
+            pool.terminate()
+    return [ u for uris in expanded for u in uris ]
 
 def do_work(options):
     mode = 'local' if options.force_local else 'default'
@@ -85,16 +187,29 @@ def do_work(options):
     log.info("read %s paths", len(data_paths))
 
     # this is the real work
-    uris = [ resolve_datapath(mode, p) for p in data_paths ]
-    expanded_uris = [ u for wild in uris for u in expand_paths(wild) ]
-    output_pathset = FilePathset(*expanded_uris)
+    start_time = time.time()
+    fs_op_counter.reset()
+    try:
+        expanded_uris = resolve_paths(mode, data_paths, options.resolve_workers, options.metadata)
+    except _ResolveExit as e:
+        sys.exit(e.code)
+    log.info("Resolved %s paths into %s URIs in %0.2f seconds (%s file system operations: %s)",
+            len(data_paths), len(expanded_uris), time.time() - start_time,
+            fs_op_counter.total, fs_op_counter.as_dict())
+    log.debug("File system handles: %s", fs_pool.counter.as_dict())
+    output_pathset = FilePathset()
+    for uri, meta in expanded_uris:
+        output_pathset.append(uri, meta)
     output_pathset.set_datatype(data_format)
     with open(output_path, 'w') as f:
-        output_pathset.write(f)
+        output_pathset.write(f, options.pathset_encoding)
 
 def main(args=None):
     args = args or sys.argv[1:]
     options = parse_args(args)
-    test_hadoop() # calls sys.exit if test fails
+    config_logging(options.log_level)
+    if not options.force_local:
+        # local mode doesn't touch Hadoop at all
+        test_hadoop() # calls sys.exit if test fails
     do_work(options)
 
@@ -7,8 +7,191 @@
 #
 # END_COPYRIGHT
 
+import array
+import collections
+import itertools
 import os
+import re
 import urlparse
+import zlib
+
+# Optional metadata about a path in a pathset.  Any field may be None if
+# unknown.  `kind` is 'file' or 'directory'; `mtime` is in seconds since
+# the epoch.  For directories, `size` and `count` are the total size and
+# number of the (non-hidden) files they contain.
+PathMeta = collections.namedtuple('PathMeta', ('size', 'mtime', 'kind', 'count'))
+
+# Matches the start of a fully qualified URI (scheme://).  Used to skip
+# urlparse on the common case in Pathset.sanitize_path.
+_QualifiedUriRe = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://')
+# Matches paths that os.path.normpath wouldn't change:  no empty, '.' or
+# '..' components and no trailing slash.
+_CleanPathRe = re.compile(r'/?(?!\.\.?(/|$))[^/]+(/(?!\.\.?(/|$))[^/]+)*$')
+
+def _encode_varint(n, out):
+  """
+  Append the unsigned LEB128 encoding of n to bytearray out.
+  """
+  while n >= 0x80:
+    out.append((n & 0x7f) | 0x80)
+    n >>= 7
+  out.append(n)
+
+def _decode_varint(data, pos):
+  """
+  Decode a varint from the bytearray data at pos.  Returns (value, new pos).
+  """
+  result = 0
+  shift = 0
+  while True:
+    b = data[pos]
+    pos += 1
+    result |= (b & 0x7f) << shift
+    if b < 0x80:
+      return result, pos
+    shift += 7
+
+class _ChunkedInput(object):
+  """
+  A buffer over the contents of a file, read a chunk at a time and
+  decompressed on the fly if `decompressor` (a zlib decompression object)
+  is given.  Consumers decode `data` in place and call `fill` when they
+  need more of it.
+  """
+  ChunkSize = 2**16
+
+  def __init__(self, fd, decompressor=None):
+    self._fd = fd
+    self._decompressor = decompressor
+    self._eof = False
+    self.data = bytearray()
+
+  def fill(self, pos, n):
+    """
+    Drop the data before pos and read until at least n bytes are buffered,
+    unless the file ends first.  Returns (data, 0), the buffer and the
+    position of what was at pos.
+    """
+    del self.data[0:pos]
+    while len(self.data) < n and not self._eof:
+      chunk = self._fd.read(self.ChunkSize)
+      if not chunk:
+        self._eof = True
+        if self._decompressor is not None:
+          chunk = self._decompressor.flush()
+      elif self._decompressor is not None:
+        chunk = self._decompressor.decompress(chunk)
+      self.data.extend(chunk)
+    return self.data, 0
+
+def _common_prefix_len(a, b):
+  """
+  Length of the common prefix of strings a and b.  Uses a binary search
+  over slice comparisons, which is much faster than a character loop.
+  """
+  lo, hi = 0, min(len(a), len(b))
+  while lo < hi:
+    mid = (lo + hi + 1) // 2
+    if a[lo:mid] == b[lo:mid]:
+      lo = mid
+    else:
+      hi = mid - 1
+  return lo
+
+class CompactPathList(object):
+  """
+  A list-like container of path URIs that uses much less memory than a
+  plain list of strings when paths share their directories, as they do in
+  the pathsets produced by the tools.
+
+  Each path is split into its scheme://netloc authority, its directory
+  and its basename.  Authorities and (authority, directory) prefixes are
+  stored once in tables; each path is then represented by the id of its
+  prefix (kept in an array of C ints) and its basename.  Basenames are
+  interned, so names such as part-00000 repeated across directories
+  are stored only once.
+
+  Only appending, iteration, len and indexing are supported.
+  """
+
+  def __init__(self, iterable=()):
+    self._authorities = []
+    self._authority_ids = {}
+    self._prefixes = []
+    self._prefix_ids = {}
+    self._entry_prefix = array.array('i')
+    self._entry_name = []
+    self.extend(iterable)
+
+  @staticmethod
+  def _split(path):
+    """
+    Split path into (authority, directory, basename).
+    """
+    start = 0
+    authority = ''
+    sep = path.find('://')
+    if sep >= 0:
+      start = path.find('/', sep + 3)
+      if start < 0:
+        return path, '', ''
+      authority = path[0:start]
+    slash = path.rfind('/')
+    if slash < start:
+      return authority, '', path[start:]
+    return authority, path[start:slash + 1], path[slash + 1:]
+
+  def _get_prefix_id(self, authority, directory):
+    key = (authority, directory)
+    pid = self._prefix_ids.get(key)
+    if pid is None:
+      aid = self._authority_ids.get(authority)
+      if aid is None:
+        aid = len(self._authorities)
+        self._authorities.append(authority)
+        self._authority_ids[authority] = aid
+      pid = len(self._prefixes)
+      self._prefixes.append( (aid, directory) )
+      self._prefix_ids[key] = pid
+    return pid
+
+  def append(self, path):
+    authority, directory, name = self._split(path)
+    self._entry_prefix.append(self._get_prefix_id(authority, directory))
+    self._entry_name.append(intern(name))
+
+  def extend(self, iterable):
+    for p in iterable:
+      self.append(p)
+
+  def _build(self, pid, name):
+    aid, directory = self._prefixes[pid]
+    return self._authorities[aid] + directory + name
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [ self[j] for j in xrange(*i.indices(len(self))) ]
+    return self._build(self._entry_prefix[i], self._entry_name[i])
+
+  def __iter__(self):
+    build = self._build
+    for pid, name in itertools.izip(self._entry_prefix, self._entry_name):
+      yield build(pid, name)
+
+  def __len__(self):
+    return len(self._entry_name)
+
+  def __eq__(self, other):
+    if not isinstance(other, (list, CompactPathList)):
+      return NotImplemented
+    return len(self) == len(other) and all(a == b for a, b in itertools.izip(self, other))
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    return result if result is NotImplemented else not result
+
+  def __repr__(self):
+    return "CompactPathList(%r)" % list(self)
 
 class Pathset(object):
   """
@@ -17,14 +200,22 @@ class Pathset(object):
 
   Unknown = "Unknown"
 
-  def __init__(self, *pathlist):
+  def __init__(self, *pathlist, **kwargs):
     """
     Create a pathset.  If paths are provided in pathset,
     they will be sanitized and inserted into the new pathset.
+
+    With the keyword argument compact=True, the paths are kept in a
+    CompactPathList instead of a list.  Use it for large pathsets.
     """
-    self.paths = map(self.sanitize_path, pathlist)
+    self._compact = kwargs.pop('compact', False)
+    if kwargs:
+      raise TypeError("Unexpected keyword arguments: %s" % ', '.join(kwargs.keys()))
+    self.paths = self._new_path_list()
+    self.extend(pathlist)
     self.datatype = self.Unknown
     self._comment = ""
+    self._meta = {}
 
   @property
   def comment(self):
@@ -37,32 +228,86 @@ class Pathset(object):
   def set_datatype(self, datatype):
     self.datatype = datatype
 
+  def _new_path_list(self):
+    return CompactPathList() if self._compact else []
+
   @staticmethod
-  def sanitize_path(path):
+  def sanitize_path(path, cwd=None):
     """
     Turns a path into a full URI, if it's not already.  This method is applied
     to the input and output paths passed to the Hadoop command.  At the moment
     we're assuming all paths that don't specify a scheme are on the local file
     system (file://).
 
+    Relative paths are made absolute with respect to cwd, if given, else
+    to the current working directory.
+
     TODO:  consider incomplete URI's to be on the configured default file
     system instead of file://
     """
-    url = urlparse.urlparse(path)
-    if url.scheme: # empty string if not available
+    if _QualifiedUriRe.match(path):
       return path
-    else:
+    if ':' in path and urlparse.urlparse(path).scheme: # empty string if not available
+      return path
+    elif cwd is None:
       return "file://" + os.path.abspath(path)
+    elif _CleanPathRe.match(path):
+      # nothing for normpath to do
+      return "file://" + (path if path[0] == '/' else os.path.join(cwd, path))
+    else:
+      return "file://" + os.path.normpath(os.path.join(cwd, path))
 
-  def append(self, p):
+  def append(self, p, meta=None):
     """
     Appena a path to this pathset.  The path will be sanitized.
+    Optionally, a PathMeta can be associated to the path.
+    """
+    p = self.sanitize_path(p)
+    self.paths.append(p)
+    if meta is not None:
+      self._meta[p] = meta
+    return self
+
+  def extend(self, iterable, trusted=False):
     """
-    self.paths.append(self.sanitize_path(p))
+    Append all the paths in iterable to this pathset.  The paths are
+    sanitized, unless trusted is True, in which case the caller
+    guarantees they already are full URIs (e.g., because they come from
+    an HDFS listing) and they're appended as they are.
+    """
+    if trusted:
+      self.paths.extend(iterable)
+    else:
+      cwd = os.getcwd()
+      sanitize = self.sanitize_path
+      self.paths.extend(sanitize(p, cwd) for p in iterable)
     return self
 
   def get_paths(self):
-    return self.paths
+    """
+    Returns the paths as a list.
+    """
+    if isinstance(self.paths, list):
+      return self.paths
+    return list(self.paths)
+
+  def get_meta(self, p):
+    """
+    Returns the PathMeta associated to path p, or None.
+    """
+    return self._meta.get(p)
+
+  def set_meta(self, p, meta):
+    self._meta[self.sanitize_path(p)] = meta
+
+  def has_meta(self):
+    return bool(self._meta)
+
+  def iter_with_meta(self):
+    """
+    Iterate over (path, PathMeta or None) tuples.
+    """
+    return ( (p, self._meta.get(p)) for p in self )
 
   def __iter__(self):
     return iter(self.paths)
@@ -79,12 +324,39 @@ class FilePathset(Pathset):
   """
   Magic = "# Pathset"
   VersionTag = "Version"
-  Version = "0.0"
+  # Version 1.0 adds optional tab-separated metadata columns after each
+  # path: size, mtime, kind, count.  Pathsets without metadata are
+  # still written as version 0.0, for compatibility with older readers.
+  Version = "1.0"
+  PlainVersion = "0.0"
+  SupportedVersions = ("0.0", "1.0")
   DataTypeTag = "DataType"
+  # Version 1.0 pathsets can also be written in a compact binary encoding.
+  # The header line stays the same (plus the Encoding tag) and is followed by
+  # the front-coded paths:  each path is stored as the length of the prefix
+  # it shares with the previous path and the rest of the path.  Optionally,
+  # everything after the header is zlib-compressed.
+  EncodingTag = "Encoding"
+  TextEncoding = "text"
+  FrontCodedEncoding = "front-coded"
+  FrontCodedZlibEncoding = "front-coded+zlib"
+  Encodings = (TextEncoding, FrontCodedEncoding, FrontCodedZlibEncoding)
 
   @staticmethod
-  def from_file(fd):
-    retval = FilePathset()
+  def from_file(fd, lazy=False, compact=False):
+    """
+    Read a FilePathset from a file path or an I/O object.
+
+    With lazy=True, `fd` must be a file path.  Only the header is read
+    right away; the paths are read from the file each time the pathset
+    is iterated (see LazyFilePathset).  With compact=True, the paths are
+    kept in memory in a CompactPathList.
+    """
+    if lazy:
+      if hasattr(fd, 'readline'):
+        raise ValueError("A lazy FilePathset must be read from a file path, not an I/O object")
+      return LazyFilePathset(fd, compact=compact)
+    retval = FilePathset(compact=compact)
     if not hasattr(fd, 'readline'):
       # not an I/O object.  Assume it's a file path
       with open(fd) as io:
@@ -94,11 +366,36 @@ class FilePathset(Pathset):
       retval.read(fd)
     return retval
 
-  def __init__(self, *pathlist):
-    super(FilePathset, self).__init__(*pathlist)
+  def __init__(self, *pathlist, **kwargs):
+    super(FilePathset, self).__init__(*pathlist, **kwargs)
+    self._file_version = None
 
-  def __format_header(self):
-    return '\t'.join((self.Magic, ':'.join( (self.VersionTag, self.Version) ), ':'.join( (self.DataTypeTag, self.datatype or self.Unknown) )))
+  def __format_header(self, version, encoding=TextEncoding):
+    fields = [ self.Magic, ':'.join( (self.VersionTag, version) ), ':'.join( (self.DataTypeTag, self.datatype or self.Unknown) ) ]
+    if encoding != self.TextEncoding:
+      fields.append(':'.join( (self.EncodingTag, encoding) ))
+    return '\t'.join(fields)
+
+  @staticmethod
+  def format_meta(meta):
+    # trailing unknown fields are omitted
+    return '\t'.join( '' if v is None else str(v) for v in meta ).rstrip('\t')
+
+  @staticmethod
+  def parse_meta(fields):
+    """
+    Parse the metadata columns following a path.  Returns a PathMeta, or
+    None if there are no columns.
+    """
+    if not fields:
+      return None
+    fields = (list(fields) + [''] * len(PathMeta._fields))[0:len(PathMeta._fields)]
+    size, mtime, kind, count = [ f or None for f in fields ]
+    return PathMeta(
+        int(size) if size is not None else None,
+        int(mtime) if mtime is not None else None,
+        kind,
+        int(count) if count is not None else None)
 
   def __parse_header(self, header_line):
     if not header_line.startswith(self.Magic):
@@ -107,14 +404,89 @@ class FilePathset(Pathset):
     fields = header_line.split('\t')
     field_dict = dict( f.split(':') for f in fields[1:] )
 
-    if field_dict.get(self.VersionTag, self.Version) != self.Version:
-      raise ValueError("Incompatible Pathset file format (found version %s but expected version %s)" % (field_dict[self.VersionTag], self.Version))
+    version = field_dict.get(self.VersionTag, self.PlainVersion)
+    if version not in self.SupportedVersions:
+      raise ValueError("Incompatible Pathset file format (found version %s but expected one of %s)" % (version, ', '.join(self.SupportedVersions)))
     self.datatype = field_dict.get(self.DataTypeTag, self.Unknown)
+    encoding = field_dict.get(self.EncodingTag, self.TextEncoding)
+    if encoding not in self.Encodings:
+      raise ValueError("Unsupported Pathset encoding %s (expected one of %s)" % (encoding, ', '.join(self.Encodings)))
+    return version, encoding
 
-  def read(self, fd):
-    header = fd.readline().rstrip('\n')
-    self.__parse_header(header)
-    self.paths = [ ]
+  def _read_header(self, fd):
+    """
+    Read and parse the header line from fd.  Sets the data type and
+    returns the (version, encoding) of the file.
+    """
+    version, encoding = self.__parse_header(fd.readline().rstrip('\n'))
+    self._file_version = version
+    return version, encoding
+
+  def iter_file(self, fd, with_meta=False):
+    """
+    Parse the header from fd and return an iterator over the paths that
+    follow, which are read from fd as they're requested.  The data type is
+    set right away; the comment is set as comment lines are encountered.
+
+    With with_meta=True, the iterator yields (path, PathMeta or None) tuples.
+    """
+    version, encoding = self._read_header(fd)
+    self._comment = ""
+    if encoding == self.TextEncoding:
+      return self.__iter_lines(fd, version != self.PlainVersion, with_meta)
+    decompressor = zlib.decompressobj() if encoding == self.FrontCodedZlibEncoding else None
+    return self.__iter_front_coded(_ChunkedInput(fd, decompressor), with_meta)
+
+  def __iter_front_coded(self, source, with_meta):
+    # Each record is three varints (at most 10 bytes each) and two strings.
+    # Refilling the buffer only when less than that may be left keeps the
+    # decoding loop as tight as when the whole file was in memory.
+    margin = 30
+    data, pos = source.fill(0, margin)
+    length, pos = _decode_varint(data, pos)
+    data, pos = source.fill(pos, length + margin)
+    self._comment = str(data[pos:pos + length])
+    pos += length
+    n_paths, pos = _decode_varint(data, pos)
+    previous = ''
+    for _ in xrange(n_paths):
+      if len(data) - pos < margin:
+        data, pos = source.fill(pos, margin)
+      shared, pos = _decode_varint(data, pos)
+      length, pos = _decode_varint(data, pos)
+      if len(data) - pos < length + margin:
+        data, pos = source.fill(pos, length + margin)
+      path = previous[0:shared] + str(data[pos:pos + length])
+      pos += length
+      length, pos = _decode_varint(data, pos)
+      if length > 0 and len(data) - pos < length:
+        data, pos = source.fill(pos, length)
+      if with_meta:
+        meta = self.parse_meta(str(data[pos:pos + length]).split('\t')) if length > 0 else None
+        yield path, meta
+      else:
+        yield path
+      pos += length
+      previous = path
+
+  def __encode_front_coded(self):
+    out = bytearray()
+    _encode_varint(len(self._comment), out)
+    out.extend(self._comment)
+    _encode_varint(len(self), out)
+    previous = ''
+    for p, meta in self.iter_with_meta():
+      shared = _common_prefix_len(previous, p)
+      _encode_varint(shared, out)
+      _encode_varint(len(p) - shared, out)
+      out.extend(p[shared:])
+      meta_str = self.format_meta(meta) if meta is not None else ''
+      _encode_varint(len(meta_str), out)
+      out.extend(meta_str)
+      previous = p
+    return out
+
+  def __iter_lines(self, fd, has_columns, with_meta):
     comments = []
     for line in fd:
       line = line.rstrip('\n')
@@ -125,21 +497,168 @@ class FilePathset(Pathset):
           comments.append(line[2:])
         else:
           comments.append(line[1:]) # else only trim the #
+        self._comment = '\n'.join(comments)
+      elif has_columns:
+        fields = line.split('\t')
+        if with_meta:
+          yield fields[0], self.parse_meta(fields[1:])
+        else:
+          yield fields[0]
+      elif with_meta:
+        yield line, None
       else:
-        self.paths.append(line)
-    self._comment = '\n'.join(comments)
+        yield line
+
+  def read(self, fd):
+    self.paths = self._new_path_list()
+    self._meta = {}
+    for p, meta in self.iter_file(fd, with_meta=True):
+      self.paths.append(p)
+      if meta is not None:
+        self._meta[p] = meta
     return self
 
-  def write(self, fd):
-    fd.write(self.__format_header() + '\n')
+  def write(self, fd, encoding=TextEncoding):
+    """
+    Write the pathset to fd, using one of the Encodings.
+    """
+    if encoding not in self.Encodings:
+      raise ValueError("Unsupported Pathset encoding %s (expected one of %s)" % (encoding, ', '.join(self.Encodings)))
+    if encoding != self.TextEncoding:
+      fd.write(self.__format_header(self.Version, encoding) + '\n')
+      data = self.__encode_front_coded()
+      if encoding == self.FrontCodedZlibEncoding:
+        data = zlib.compress(str(data))
+      fd.write(str(data))
+      return
+    has_meta = self.has_meta()
+    fd.write(self.__format_header(self.Version if has_meta else self.PlainVersion) + '\n')
     # write comments
     if self._comment:
       fd.write('#')
       fd.write(self._comment.replace('\n', '\n# '))
       if self._comment[-1] != '\n':
         fd.write('\n')
-    for p in self.paths:
-      fd.write(p)
-      fd.write('\n')
+    if has_meta:
+      for p, meta in self.iter_with_meta():
+        fd.write(p)
+        if meta is not None:
+          fd.write('\t')
+          fd.write(self.format_meta(meta))
+        fd.write('\n')
+    else:
+      for p in self:
+        fd.write(p)
+        fd.write('\n')
+
+class LazyFilePathset(FilePathset):
+  """
+  A FilePathset that doesn't keep its paths in memory.  Each iteration
+  streams them from the pathset file, so very large pathsets can be
+  processed in a single pass.
+
+  The paths are loaded into memory only if the `paths` attribute is
+  accessed (e.g., by `append` or `get_paths`), after which the pathset
+  behaves like a regular FilePathset.  The comment and the number of paths
+  are known once the pathset has been iterated completely; asking for them
+  before that streams the file once.
+  """
+
+  def __init__(self, path, compact=False):
+    super(LazyFilePathset, self).__init__(compact=compact)
+    self._path = path
+    self._paths = None
+    # set by the first complete pass over the file
+    self._len = None
+    self._comment_loaded = False
+    with open(path) as f:
+      self._read_header(f)
+
+  @property
+  def comment(self):
+    self.__load()
+    return self._comment
+
+  @comment.setter
+  def comment(self, c):
+    self._comment = (c if c is not None else "")
+    self._comment_loaded = True
+
+  def __load(self):
+    """
+    Stream the file once, if it hasn't been yet, to get the comment and
+    the number of paths.
+    """
+    if self._paths is None and (self._len is None or not self._comment_loaded):
+      for _ in self.__stream():
+        pass
+
+  @property
+  def paths(self):
+    if self._paths is None:
+      paths = self._new_path_list()
+      for p, meta in self.__stream(with_meta=True):
+        paths.append(p)
+        if meta is not None:
+          self._meta[p] = meta
+      self._paths = paths
+    return self._paths
+
+  @paths.setter
+  def paths(self, value):
+    self._paths = value
+
+  def __stream(self, with_meta=False):
+    # iter_file sets the comment as it reads it from the file
+    comment = self._comment if self._comment_loaded else None
+    n = 0
+    try:
+      with open(self._path) as f:
+        for item in self.iter_file(f, with_meta):
+          n += 1
+          yield item
+      self._len = n
+      self._comment_loaded = True
+    finally:
+      if comment is not None:
+        self._comment = comment
+
+  def iter_with_meta(self):
+    if self._paths is not None:
+      return super(LazyFilePathset, self).iter_with_meta()
+    return self.__stream(with_meta=True)
+
+  def has_meta(self):
+    if self._paths is not None:
+      return super(LazyFilePathset, self).has_meta()
+    if self._file_version == self.PlainVersion:
+      return False
+    return any(meta is not None for _, meta in self.__stream(with_meta=True))
+
+  def __iter__(self):
+    if self._paths is not None:
+      return iter(self._paths)
+    return self.__stream()
+
+  def __len__(self):
+    if self._paths is not None:
+      return len(self._paths)
+    self.__load()
+    return self._len
+
+  def __str__(self):
+    return os.pathsep.join(self)
+
+  def write(self, fd, encoding=FilePathset.TextEncoding):
+    self.__load() # the comment is written first
+    super(LazyFilePathset, self).write(fd, encoding)
+
+  def get_meta(self, p):
+    self.paths # metadata is loaded with the paths
+    return super(LazyFilePathset, self).get_meta(p)
+
+  def set_meta(self, p, meta):
+    self.paths
+    super(LazyFilePathset, self).set_meta(p, meta)
 
 # vim: expandtab autoindent shiftwidth=2 tabstop=2
@@ -9,23 +9,37 @@
 # END_COPYRIGHT
 
 import argparse
+import hashlib
 import itertools as it
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import sys
-import subprocess
+import threading
+import time
 from urlparse import urlparse
+from uuid import uuid4
 
-import pydoop
-import pydoop.hdfs as phdfs
-
+from hadoop_galaxy.lazy import phdfs, pydoop, pydoop_main
+import hadoop_galaxy.fs as hfs
 from hadoop_galaxy import log
-from hadoop_galaxy.utils import expand_paths, config_logging
-from hadoop_galaxy.pathset import FilePathset
+from hadoop_galaxy.cas import CasStore, CasDir
+from hadoop_galaxy.utils import expand_paths, config_logging, fs_pool, get_path_meta, DefaultCopyBufferSize
+from hadoop_galaxy.pathset import CompactPathList, FilePathset
 
 # Environment variable to specify where to put the datasets
 EnvPutDir = 'HADOOP_GALAXY_PUT_DIR'
 
+DefaultMaxCopyTasks = 100
+DefaultCopyRetries = 2
+# seconds to wait before retrying a failed copy, multiplied by the attempt number
+RetryDelay = 1
+# seconds between progress reports
+ReportInterval = 30
+# workspace subdirectory holding the destinations of --sync uploads
+SyncDir = 'sync'
+SyncCompareModes = ('mtime', 'checksum')
+
 def parse_args(args=None):
     # define the parser
     parser = argparse.ArgumentParser(description="Copy data referenced by a pathset to HDFS")
@@ -34,7 +48,25 @@ def parse_args(args=None):
     parser.add_argument('--hadoop-workspace', metavar="URI",
             help="URI to a directory on the destination file system where the dataset(s) " +\
                  "will be copied (default: value of %s environment variable)" % EnvPutDir)
-    parser.add_argument('--distcp', action='store_true', help="Use Hadoop distcp to perform the copy")
+    parser.add_argument('--distcp', action='store_true', help="Use a Hadoop job to perform the copy")
+    parser.add_argument('--max-copy-tasks', metavar="N", type=int, default=DefaultMaxCopyTasks,
+            help="Maximum number of map tasks of the --distcp copy job (default: %s)" % DefaultMaxCopyTasks)
+    parser.add_argument('--parallel', metavar="N", type=int, default=1,
+            help="Without --distcp, number of files to copy concurrently (default: 1)")
+    parser.add_argument('--copy-retries', metavar="N", type=int, default=DefaultCopyRetries,
+            help="Without --distcp, number of times a failed copy is retried (default: %s)" % DefaultCopyRetries)
+    parser.add_argument('--sync', action='store_true',
+            help="Copy the data to a location in the workspace determined by the source paths, " +
+                 "copying only the files that aren't already there or have changed since the last upload.  " +
+                 "Datasets uploaded from the same sources share that location, so each sync updates them all")
+    parser.add_argument('--sync-compare', choices=SyncCompareModes, default=SyncCompareModes[0],
+            help="With --sync, compare files by size and modification time or by size and checksum (default: %s)" % SyncCompareModes[0])
+    parser.add_argument('--dedup', action='store_true',
+            help="Copy the files to a content-addressed store in the workspace (%s/), shared by all datasets, " % CasDir +
+                 "unless it already contains a file with the same contents.  Use cas_release to release " +
+                 "the dataset's references to the store before deleting it")
+    parser.add_argument('--pathset-encoding', choices=FilePathset.Encodings, default=FilePathset.TextEncoding,
+            help="Encoding of the output pathset (default: %s)" % FilePathset.TextEncoding)
     parser.add_argument('--log-level',
             choices=['debug', 'info', 'warn', 'error', 'critical'],
             default='info')
@@ -42,6 +74,14 @@ def parse_args(args=None):
     options = parser.parse_args(args)
 
     # validation
+    if options.max_copy_tasks <= 0:
+        parser.error("--max-copy-tasks must be > 0 (got %s)" % options.max_copy_tasks)
+    if options.parallel <= 0:
+        parser.error("--parallel must be > 0 (got %s)" % options.parallel)
+    if options.copy_retries < 0:
+        parser.error("--copy-retries must be >= 0 (got %s)" % options.copy_retries)
+    if sum(map(bool, (options.sync, options.distcp, options.dedup))) > 1:
+        parser.error("--sync, --distcp and --dedup are mutually exclusive")
     workspace = options.hadoop_workspace or os.environ.get(EnvPutDir)
     if not workspace:
         parser.error("You need to specify a workspace URI, either via the --hadoop-workspace option or the %s environment variable" % EnvPutDir)
@@ -70,40 +110,334 @@ def _group_by_dest_dir(src_uris, dest_uris):
     groups = dict(( (dest_dir, [ src for src, dest in tuple_it]) for dest_dir, tuple_it in it_grouped))
     return groups
 
-def perform_distcp(copy_groups):
-    cmd_start = [ pydoop.hadoop_exec(), 'distcp2', '-atomic' ]
+def mapper(_, line, writer):
+    """
+    Mapper of the copy job run by perform_distcp.  Each input line holds
+    a source URI and the URI of its copy, separated by a tab.
+    """
+    src, dest = line.rstrip('\n').split('\t')
+    writer.status("Copying %s to %s" % (src, dest))
+    # Remove what a failed attempt of this task may have copied:  if dest
+    # were a directory, cp would copy src inside it.
     try:
-        for output_path, src_paths in copy_groups.iteritems():
-            cmd = cmd_start[:]
-            cmd.extend(src_paths)
-            cmd.append(output_path)
-            log.debug("%s", cmd)
-            subprocess.check_call(cmd)
-            # Hadoop distcp2 doesn't seem to correctly report errors through its
-            # exit code. For instance, it exists with a 0 even when the job is killed.
-            # To verify its success we'll check that the destination directory exists.
-            # Since we're using -atomic it should only exist if everything went well.
-            if phdfs.path.exists(output_path):
-                log.info("Successfully ran distcp")
-            else:
-                raise RuntimeError("Distcp2 failed to complete. Output path not created: %s" % output_path)
-    except (subprocess.CalledProcessError, RuntimeError) as e:
-        log.critical("Error running distcp: %s", e.message)
+        phdfs.rmr(dest)
+    except IOError:
+        pass
+    phdfs.mkdir(phdfs.path.dirname(dest))
+    phdfs.cp(src, dest)
+    writer.count('paths copied', 1)
+
+def _staged_paths(fs, root):
+    """
+    Returns the set of the paths (without scheme and host) under root.
+    """
+    return set( urlparse(info['name']).path.rstrip('/') for info in fs.walk(phdfs.path.split(root)[2]) )
+
+def perform_distcp(src_uris, dest_path, max_tasks=DefaultMaxCopyTasks):
+    """
+    Copy the src_uris to their destinations under dest_path (see
+    src_to_dest_path) with a single Hadoop job.
+
+    distcp can't do this:  it copies all its sources into a single
+    directory, so it would need a job per destination directory.  Instead,
+    we run a pydoop script job whose input lists source and destination of
+    each copy, spread over at most max_tasks map tasks.  The data is first
+    copied to a hidden staging directory in the workspace, which is renamed
+    to dest_path only after all the copies have been verified; so either
+    dest_path is complete or it doesn't exist.
+    """
+    workspace = phdfs.path.dirname(dest_path)
+    staging_path = phdfs.path.join(workspace, '_%s.%s' % (phdfs.path.basename(dest_path), uuid4().hex))
+    work_dir = staging_path + '.job'
+    work_input_path = phdfs.path.join(work_dir, "copy_input")
+    # An output directory is used only because pipes requires it.
+    work_output_path = phdfs.path.join(work_dir, "junk_output")
+    fs = fs_pool.get_for(dest_path)
+    try:
+        fs.create_directory(phdfs.path.split(work_dir)[2])
+        expected = []
+        with phdfs.open(work_input_path, 'w') as f:
+            for src in src_uris:
+                staged = src_to_dest_path(staging_path, src)
+                f.write('%s\t%s\n' % (src, staged))
+                expected.append(urlparse(staged).path.rstrip('/'))
+        lines_per_map = max(1, (len(expected) + max_tasks - 1) // max_tasks)
+        log.info("Copying %s paths with a single Hadoop job (%s per task)", len(expected), lines_per_map)
+
+        script_args = [
+            'script',
+            '--num-reducers', '0',
+            '-Dmapred.input.format.class=org.apache.hadoop.mapred.lib.NLineInputFormat',
+            '-Dmapred.line.input.format.linespermap=%d' % lines_per_map,
+            '-Dmapred.map.tasks.speculative.execution=false',
+            __file__,
+            work_input_path,
+            work_output_path ]
+        log.debug("pydoop script args: %s", script_args)
+        pydoop_main.main(script_args)
+
+        # Like distcp, the job may not report all errors.  Check that all the
+        # copies are there before moving them into place.
+        staged = _staged_paths(fs, staging_path)
+        missing = [ p for p in expected if p not in staged ]
+        if missing:
+            raise RuntimeError("Copy job failed to copy %s paths (e.g., %s)" % (len(missing), missing[0]))
+        log.debug("Renaming %s to %s", staging_path, dest_path)
+        fs.rename(phdfs.path.split(staging_path)[2], phdfs.path.split(dest_path)[2])
+        log.info("Successfully ran copy job")
+    except StandardError as e:
+        log.critical("Error running copy job: %s", e)
+        try:
+            phdfs.rmr(staging_path)
+        except IOError:
+            log.debug("Failed to clean-up staging path %s. Maybe it was never created.", staging_path)
         raise e
+    finally:
+        try:
+            phdfs.rmr(work_dir)
+        except IOError:
+            log.debug("Failed to clean-up work directory %s", work_dir)
 
-def perform_simple_cp(copy_groups):
+def _path_size(uri):
+    """
+    The size of uri for the progress reports, with a single stat:  0 if it's
+    a directory (we'd have to walk it) or can't be stat'ed (the copy will
+    report the error).
+    """
     try:
-        for output_path, src_paths in copy_groups.iteritems():
-            for src in src_paths:
-                log.debug("pydoop.hdfs.cp('%s','%s')", src, output_path)
-                pydoop.hdfs.cp(src, output_path)
+        return get_path_meta(uri).size or 0
+    except EnvironmentError:
+        return 0
+
+def _copy_with_retries(src, dest, retries, abort, size=None):
+    """
+    Copy src to dest, trying again up to `retries` times if the copy fails.
+    Returns the number of bytes copied:  `size`, if known, else the
+    _path_size of src.  Does nothing if the abort event is set.
+    """
+    if abort.is_set():
+        return 0
+    if size is None:
+        size = _path_size(src)
+    for attempt in xrange(retries + 1):
+        if abort.is_set():
+            return 0
+        try:
+            log.debug("pydoop.hdfs.cp('%s','%s')", src, dest)
+            phdfs.cp(src, dest)
+            return size
+        except StandardError as e:
+            if attempt >= retries:
+                raise
+            log.warning("Error copying %s to %s (%s).  Retrying (%s of %s)", src, dest, e, attempt + 1, retries)
+            try:
+                phdfs.rmr(dest) # remove partial copies
+            except IOError:
+                pass
+            time.sleep(RetryDelay * (attempt + 1))
+
+def perform_simple_cp(copy_groups, n_threads=1, retries=DefaultCopyRetries):
+    """
+    Copy the source paths of each group into its destination directory,
+    running up to n_threads copies concurrently (see _copy_all).
+    """
+    tasks = []
+    for output_path, src_paths in copy_groups.iteritems():
+        phdfs.mkdir(output_path)
+        tasks.extend( (src, phdfs.path.join(output_path, phdfs.path.basename(src))) for src in src_paths )
+    _copy_all(tasks, n_threads, retries)
+
+def _copy_all(tasks, n_threads=1, retries=DefaultCopyRetries):
+    """
+    Perform the copies in tasks, a list of (src, dest) or (src, dest, size)
+    tuples, running up to n_threads copies concurrently.  Each failed copy
+    is retried up to `retries` times.  If a copy fails for good, the copies
+    still running are allowed to finish and the error is raised.
+    """
+    abort = threading.Event()
+    copy = lambda task: _copy_with_retries(task[0], task[1], retries, abort, *task[2:])
+    pool = ThreadPool(min(n_threads, len(tasks))) if n_threads > 1 and len(tasks) > 1 else None
+    start_time = last_report = time.time()
+    n_bytes = n_done = 0
+    try:
+        for size in (pool.imap_unordered(copy, tasks) if pool else it.imap(copy, tasks)):
+            n_bytes += size
+            n_done += 1
+            now = time.time()
+            if now - last_report >= ReportInterval:
+                log.info("Copied %s of %s paths (%0.1f MB, %0.1f MB/s)", n_done, len(tasks),
+                        n_bytes / float(2**20), n_bytes / float(2**20) / (now - start_time))
+                last_report = now
     except StandardError as e:
-        log.critical("Error while performing copy: %s", e.message)
+        abort.set()
+        log.critical("Error while performing copy: %s", e)
+        raise e
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    elapsed = max(time.time() - start_time, 1e-6)
+    log.info("Copied %s paths (%0.1f MB) in %0.1f seconds (%0.1f MB/s, %s threads)", n_done,
+            n_bytes / float(2**20), elapsed, n_bytes / float(2**20) / elapsed, n_threads)
+
+def sync_dest_path(workspace, src_uris):
+    """
+    The destination path of a sync.  It's named after a hash of the
+    sorted source URIs, so repeated uploads of the same sources reuse it.
+    """
+    h = hashlib.sha1()
+    for u in sorted(src_uris):
+        h.update(u)
+        h.update('\n')
+    return phdfs.path.join(workspace, SyncDir, h.hexdigest())
+
+def _iter_files(uri):
+    """
+    Yield (file URI, size, mtime) for uri, if it's a file, or for all the
+    files under it, if it's a directory.
+    """
+    for info in hfs.walk(uri):
+        if info['kind'] == 'file':
+            yield info['name'], info['size'], int(info['last_mod'])
+
+def _same_content(uri1, uri2):
+    h1, h2 = hashlib.md5(), hashlib.md5()
+    for uri, h in ((uri1, h1), (uri2, h2)):
+        with hfs.open(uri) as f:
+            for chunk in iter(lambda: f.read(DefaultCopyBufferSize), ''):
+                h.update(chunk)
+    return h1.digest() == h2.digest()
+
+def _concurrent_map(fn, items, n_threads=1):
+    """
+    Like map, with up to n_threads calls to fn running concurrently.
+    """
+    pool = ThreadPool(min(n_threads, len(items))) if n_threads > 1 and len(items) > 1 else None
+    try:
+        return (pool.map if pool else map)(fn, items)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+def perform_sync(src_uris, dest_path, compare=SyncCompareModes[0], n_threads=1, retries=DefaultCopyRetries):
+    """
+    Bring the copies of src_uris under dest_path up to date, copying only
+    the files that are missing or have changed and removing those that
+    no longer exist in the source directories.  With compare='mtime', a
+    file has changed if its size or modification time differ from its copy's
+    (copies are given the modification time of their source); with
+    compare='checksum', if its size or its MD5 checksum differ.
+
+    The copies are shared by all the datasets uploaded from the same
+    sources, which therefore all see the result of the latest sync.  Syncs
+    to the same destination are serialized by a lock file next to it.  New
+    and changed files are copied to a staging directory and moved into
+    dest_path only after all the copies have succeeded, so a failed sync
+    leaves dest_path as it was.
+    """
+    hfs.mkdir(phdfs.path.dirname(dest_path))
+    with hfs.LockFile(dest_path + '.lock') as lock:
+        _sync(src_uris, dest_path, compare, n_threads, retries, lock)
+
+def _sync(src_uris, dest_path, compare, n_threads, retries, lock):
+    dest_files = {}
+    if phdfs.path.exists(dest_path):
+        # list the existing copies with a single walk
+        dest_files = dict( (urlparse(name).path, (size, mtime)) for name, size, mtime in _iter_files(dest_path) )
+    # files to copy, and files to compare by checksum:
+    # (source, copy, source size and mtime, whether the copy exists)
+    changed = []
+    same_size = []
+    n_unchanged = 0
+    for src in src_uris:
+        for src_file, size, mtime in _iter_files(src):
+            dest_file = src_to_dest_path(dest_path, src_file)
+            copy = dest_files.pop(urlparse(dest_file).path, None)
+            if copy is None or copy[0] != size:
+                changed.append( (src_file, dest_file, size, mtime, copy is not None) )
+            elif compare == 'checksum':
+                same_size.append( (src_file, dest_file, size, mtime, True) )
+            elif copy[1] == mtime:
+                n_unchanged += 1
+            else:
+                changed.append( (src_file, dest_file, size, mtime, True) )
+    if same_size:
+        log.info("Sync: comparing the checksums of %s files", len(same_size))
+        same = _concurrent_map(lambda f: _same_content(f[0], f[1]), same_size, n_threads)
+        n_unchanged += sum(same)
+        changed.extend( f for f, unchanged in it.izip(same_size, same) if not unchanged )
+    log.info("Sync: %s files unchanged, %s to copy, %s to remove", n_unchanged, len(changed), len(dest_files))
+
+    if changed:
+        staging_path = phdfs.path.join(phdfs.path.dirname(dest_path),
+                '_%s.%s' % (phdfs.path.basename(dest_path), uuid4().hex))
+        tasks = [ (src_file, src_to_dest_path(staging_path, src_file), size) for src_file, _, size, _, _ in changed ]
+        try:
+            for d in set( phdfs.path.dirname(staged) for _, staged, _ in tasks ):
+                phdfs.mkdir(d)
+            _copy_all(tasks, n_threads, retries)
+            for (_, staged, _), (_, _, _, mtime, _) in it.izip(tasks, changed):
+                hfs.utime(staged, mtime, time.time())
+            # now move the new copies into place, unless another sync took over
+            lock.check()
+            for (_, staged, _), (_, dest_file, _, _, exists) in it.izip(tasks, changed):
+                if exists:
+                    hfs.rm(dest_file)
+                hfs.mkdir(phdfs.path.dirname(dest_file))
+                hfs.rename(staged, dest_file)
+        finally:
+            try:
+                phdfs.rmr(staging_path)
+            except IOError:
+                log.debug("Failed to clean-up staging path %s. Maybe it was never created.", staging_path)
+
+    # what's left in dest_files has been removed from the source directories
+    if dest_files:
+        lock.check()
+    for path in dest_files:
+        phdfs.rmr(phdfs.path.join(dest_path, path[len(urlparse(dest_path).path):]))
+
+def perform_dedup(src_uris, workspace, n_threads=1, retries=DefaultCopyRetries):
+    """
+    Store the files of src_uris in the workspace's content-addressed
+    store, copying only those whose contents aren't already there.  Returns
+    the list of the URIs of the stored files.
+
+    The store is locked only to look up the files and reserve the new
+    objects, and then to commit them:  not while they're copied, so that
+    other uploads can proceed in the meantime.
+    """
+    objects = []
+    tasks = []
+    store = CasStore(phdfs.path.join(workspace, CasDir))
+    with store:
+        for src in src_uris:
+            for src_file, size, _ in _iter_files(src):
+                object_uri, is_new = store.add(src_file, size)
+                objects.append(object_uri)
+                if is_new:
+                    tasks.append( (src_file, object_uri, size) )
+    log.info("Dedup: %s files already stored, %s to copy", len(objects) - len(tasks), len(tasks))
+    try:
+        _copy_all(tasks, n_threads, retries)
+        with store:
+            store.commit()
+    except BaseException as e:
+        # even when interrupted, so that no references remain to objects we didn't copy
+        log.info("Releasing the references to the content-addressed store")
+        with store:
+            for object_uri in objects:
+                try:
+                    store.release(object_uri)
+                except ValueError as release_error:
+                    log.warning("%s", release_error)
         raise e
+    return objects
 
 def perform_copy(options):
     with open(options.src_pathset) as f:
-        input_pathset = FilePathset.from_file(f)
+        input_pathset = FilePathset.from_file(f, compact=True)
 
     # set up workspace
     workspace = options.workspace
@@ -112,31 +446,58 @@ def perform_copy(options):
         log.info("Workspace directory %s doesn't exist. Creating it.", workspace)
         phdfs.mkdir(workspace)
 
-    src_paths = [ p for p in input_pathset ]
-    log.debug("Source paths (first 5 or less): %s", src_paths[0:5])
+    log.debug("Source paths (first 5 or less): %s", input_pathset.paths[0:5])
 
-    # dest_path is a unique path under the workspace whose name should be the same
-    # as the Galaxy dataset name.
-    dest_path = phdfs.path.join(workspace, phdfs.path.basename(options.output_dataset))
-    log.info("Destination path: %s", dest_path)
-    if phdfs.path.exists(dest_path):
-        raise RuntimeError("Destination path %s already exists. Did you provide a valid Galaxy output dataset argument?" % dest_path)
-
-    # We need to run a separate copy operation for each "leaf" destination
+    # Without --distcp, we copy the source paths into their "leaf" destination
     # directory.  E.g.,
     #   /tmp/dirA/file1 /tmp/dirA/file2 -> workspace/dirA/
     #   /tmp/dirB/file1                 -> workspace/dirB/
     #
     # As shown in the example, in general we cannot be sure the source paths have
     # unique basenames. We also cannot rename multiple files on-the-fly (to a new
-    # name guaranteed to be unique, such as a uuid4).  So, to reduce the number of
-    # distcp or cp invocations, we group the source paths together by destination directory
-    # (in the example, dirA and dirB).
+    # name guaranteed to be unique, such as a uuid4).  So we group the source paths
+    # together by destination directory (in the example, dirA and dirB), which
+    # are created before copying.
 
-    # expand for wildcards
-    src_uris = [ u for wild in src_paths for u in expand_paths(urlparse(wild)) ]
+    # expand for wildcards.  Paths with metadata are known to exist literally,
+    # so we don't need to check them.
+    src_uris = CompactPathList(u for wild, meta in input_pathset.iter_with_meta()
+                   for u in ([wild] if meta is not None else expand_paths(urlparse(wild))))
     log.debug("first 5 src_uris: %s", src_uris[0:5])
-    destination_uris = [ src_to_dest_path(dest_path, u) for u in src_uris ]
+
+    if options.dedup:
+        try:
+            output_paths = perform_dedup(src_uris, workspace, options.parallel, options.copy_retries)
+        except Exception as e:
+            log.critical("Failed to copy data to the content-addressed store")
+            log.exception(e)
+            raise e
+    else:
+        output_paths = _perform_copy_to_dest(options, workspace, src_uris)
+    output_pathset = FilePathset(*output_paths)
+    output_pathset.set_datatype(input_pathset.datatype)
+    output_pathset.comment = "Copied from\n" + '\n'.join(input_pathset)
+    with open(options.output_dataset, 'w') as f:
+        output_pathset.write(f, options.pathset_encoding)
+
+def _perform_copy_to_dest(options, workspace, src_uris):
+    """
+    Copy src_uris to a destination directory in the workspace.  Returns the
+    list of the destination directories that contain the copies.
+    """
+    if options.sync:
+        # the destination is shared by all the uploads of the same sources
+        dest_path = sync_dest_path(workspace, src_uris)
+        log.info("Destination path: %s", dest_path)
+    else:
+        # dest_path is a unique path under the workspace whose name should be the same
+        # as the Galaxy dataset name.
+        dest_path = phdfs.path.join(workspace, phdfs.path.basename(options.output_dataset))
+        log.info("Destination path: %s", dest_path)
+        if phdfs.path.exists(dest_path):
+            raise RuntimeError("Destination path %s already exists. Did you provide a valid Galaxy output dataset argument?" % dest_path)
+
+    destination_uris = CompactPathList(src_to_dest_path(dest_path, u) for u in src_uris)
     log.debug("first 5 destination_uris: %s", destination_uris[0:5])
     copy_groups = _group_by_dest_dir(src_uris, destination_uris)
     if log.isEnabledFor(logging.DEBUG) and len(copy_groups) > 0:
@@ -144,24 +505,25 @@ def perform_copy(options):
         log.debug("one copy group:\n\tdest: %s\n\tsrc: %s", tpl[0], tpl[1])
 
     try:
-        if options.distcp:
-            perform_distcp(copy_groups)
+        if options.sync:
+            perform_sync(src_uris, dest_path, options.sync_compare, options.parallel, options.copy_retries)
+        elif options.distcp:
+            perform_distcp(src_uris, dest_path, options.max_copy_tasks)
         else:
-            perform_simple_cp(copy_groups)
+            perform_simple_cp(copy_groups, options.parallel, options.copy_retries)
     except Exception as e:
         log.critical("Failed to copy data to %s", dest_path)
         log.exception(e)
-        log.info("Cleaning up %s, if it exists", dest_path)
-        try:
-            phdfs.rmr(dest_path)
-        except IOError:
-            log.debug("Failed to clean-up destination path %s. Maybe it was never created.", dest_path)
+        # A sync destination holds the copies made by previous runs, which
+        # perform_sync leaves alone when it fails.
+        if not options.sync:
+            log.info("Cleaning up %s, if it exists", dest_path)
+            try:
+                phdfs.rmr(dest_path)
+            except IOError:
+                log.debug("Failed to clean-up destination path %s. Maybe it was never created.", dest_path)
         raise e
-    output_pathset = FilePathset(*copy_groups.iterkeys())
-    output_pathset.set_datatype(input_pathset.datatype)
-    output_pathset.comment = "Copied from\n" + '\n'.join(src_paths)
-    with open(options.output_dataset, 'w') as f:
-        output_pathset.write(f)
+    return copy_groups.keys()
 
 def main(args=None):
     try:
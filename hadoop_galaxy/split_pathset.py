@@ -18,97 +18,380 @@ The `match` method from re.RegexObject is used to test, so the expression
 must match from the start of the path.  The expression can optionally be
 anchored to the end as well.
 
+Alternatively, the pathset can be split into several parts in a single pass
+by giving an ordered list of rules with `--rule NAME EXPRESSION`.  Each path
+goes to the output pathset of the first rule it matches (written as NAME in
+--output-dir), or to the default output if it matches none.
+
 Optionally, the tool can descend into the input path up to a specified
 maximum number of levels (--expand-levels) before applying the regex to
 each resulting path individually.  By default expansion is off (0 levels).
+The directories at each level are listed concurrently (--expand-workers);
+the resulting paths are sorted by name within each directory.
+
+Paths can also be required to satisfy conditions on their size and
+modification time (--min-size, --max-size, --newer-than) in addition to
+matching the expression; those that don't go to the "false" (or default)
+pathset.  These conditions are checked against the information returned
+by the directory listings, so they don't cost additional file system calls.
 """
 
 
+import hadoop_galaxy.fs as hfs
 import hadoop_galaxy.pathset as pathset
-import pydoop.hdfs as hdfs
+from hadoop_galaxy.utils import fs_op_counter
 
 import argparse
+from multiprocessing.pool import ThreadPool
+import os
+import posixpath
 import re
+import sre_constants
+import sre_parse
 import sys
+import time
+import urlparse
 import warnings
 
-def parse_args(args=None):
-    parser = argparse.ArgumentParser(description="Split a pathset by regular expression")
+DefaultBucket = 'default'
+
+_RuleNameRe = re.compile(r'[A-Za-z0-9_.-]+$')
+
+def _add_common_args(parser):
     parser.add_argument('-a', '--anchor-end', action="store_true",
             help="If set, the regular expression must match at end of the path (like appending '$')")
 
     parser.add_argument('-e', '--expand-levels', metavar="N", type=int, default=0,
             help="Number of levels to descent into path (Default: 0)")
+    parser.add_argument('--expand-workers', metavar="N", type=int, default=8,
+            help="Number of directories to list concurrently while expanding (Default: 8)")
+    parser.add_argument('--pathset-encoding', choices=pathset.FilePathset.Encodings, default=pathset.FilePathset.TextEncoding,
+            help="Encoding of the output pathsets (default: %s)" % pathset.FilePathset.TextEncoding)
+    parser.add_argument('--min-size', metavar="BYTES", type=int,
+            help="Files smaller than this never match (e.g., 1 to leave out empty files)")
+    parser.add_argument('--max-size', metavar="BYTES", type=int,
+            help="Files larger than this never match")
+    parser.add_argument('--newer-than', metavar="TIME", type=_timestamp,
+            help="Paths last modified before TIME never match.  TIME is a date (YYYY-MM-DD, " +
+                 "optionally followed by HH:MM or HH:MM:SS, local time) or seconds since the epoch")
+
+def _check_common_args(parser, options):
+    if options.expand_levels < 0:
+        parser.error("number of levels to descend into path must be >= 0 (got %s)" % options.expand_levels)
+    if options.expand_workers <= 0:
+        parser.error("--expand-workers must be > 0 (got %s)" % options.expand_workers)
+    if options.min_size is not None and options.min_size < 0:
+        parser.error("--min-size must be >= 0 (got %s)" % options.min_size)
+    if options.max_size is not None and options.max_size < 0:
+        parser.error("--max-size must be >= 0 (got %s)" % options.max_size)
+
+_TimeFormats = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+def _timestamp(s):
+    """
+    Convert a date in one of the _TimeFormats (local time) or a number of
+    seconds since the epoch to seconds since the epoch.
+    """
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    for fmt in _TimeFormats:
+        try:
+            return time.mktime(time.strptime(s, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time %r (expected YYYY-MM-DD[ HH:MM[:SS]] or seconds since the epoch)" % s)
+
+def _parse_multi_args(args):
+    parser = argparse.ArgumentParser(description="Split a pathset into several by regular expressions")
+    _add_common_args(parser)
+    parser.add_argument('--rule', nargs=2, metavar=("NAME", "EXPRESSION"), action='append', required=True,
+            help="Send paths matching EXPRESSION to the output pathset NAME.  Can be repeated; " +
+                 "each path goes to the first rule it matches")
+    parser.add_argument('--output-dir', metavar="DIR", default='.',
+            help="Directory where the output pathsets are written, named after their rule (Default: .)")
+    parser.add_argument('--default-output', metavar="PATH",
+            help="Output pathset for paths not matching any rule (Default: DIR/%s)" % DefaultBucket)
+    parser.add_argument('input_pathset', help="Input pathset file")
+
+    options = parser.parse_args(args)
+    _check_common_args(parser, options)
+
+    names = [ name for name, _ in options.rule ]
+    bad_names = [ name for name in names if not _RuleNameRe.match(name) ]
+    if bad_names:
+        parser.error("Invalid rule name(s) %s.  Use only letters, digits, '_', '-' and '.'" % ', '.join(bad_names))
+    if len(set(names)) != len(names):
+        parser.error("Rule names must be unique")
+    options.expressions = [ expr for _, expr in options.rule ]
+    options.outputs = [ os.path.join(options.output_dir, name) for name in names ]
+    options.default_output = options.default_output or os.path.join(options.output_dir, DefaultBucket)
+    if options.default_output in options.outputs:
+        parser.error("The default output %s is also used by a rule" % options.default_output)
+    return options
+
+def parse_args(args=None):
+    """
+    Parse the command line.  If it contains --rule options, the tool
+    works in multi-way mode (see _parse_multi_args); else, it takes a
+    single expression and a "true" and a "false" output.  In both cases
+    the returned options have the lists `expressions` and `outputs`,
+    and the `default_output` for paths matching none of the expressions.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    if '--rule' in args:
+        return _parse_multi_args(args)
+
+    parser = argparse.ArgumentParser(description="Split a pathset by regular expression",
+            epilog="To split the pathset into more than two parts, use instead:  " +
+                   "split_pathset --rule NAME EXPRESSION [--rule NAME EXPRESSION ...] " +
+                   "[--output-dir DIR] [--default-output PATH] [common options] INPUT_PATHSET")
+    _add_common_args(parser)
     parser.add_argument('expression', help="Regular expression to apply as a test")
     parser.add_argument('input_pathset', help="Input pathset file")
     parser.add_argument('output_true', help="Output pathset for paths matching the expression")
     parser.add_argument('output_false', help="Output pathset for paths not matching the expression")
 
     options = parser.parse_args(args)
-
-    if options.expand_levels < 0:
-        parser.error("number of levels to descend into path must be >= 0 (got %s)" % options.expand_levels)
+    _check_common_args(parser, options)
+    options.expressions = [ options.expression ]
+    options.outputs = [ options.output_true ]
+    options.default_output = options.output_false
     return options
 
+def _can_combine(expr):
+    """
+    Whether the regular expression can be an alternative in a combined
+    expression:  it mustn't refer back to its groups (e.g., with \\1,
+    (?P=name) or (?(1)...)), since their numbers change, nor set flags
+    with (?iLmsux), since they'd apply to the whole combined expression.
+    """
+    def has_refs(item):
+        if isinstance(item, sre_parse.SubPattern):
+            item = item.data
+        if isinstance(item, (list, tuple)):
+            if len(item) == 2 and item[0] in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+                return True
+            return any(has_refs(x) for x in item)
+        return False
+    parsed = sre_parse.parse(expr)
+    return parsed.pattern.flags == 0 and not has_refs(parsed)
+
+def compile_rules(expressions, anchor_end=False):
+    """
+    Compile the regular expressions into a function that maps a path to
+    the index of the first expression that matches it (with re.match) or
+    to len(expressions) if none does.
+
+    When there are several expressions, they're combined into a single
+    one, so that each path can be classified with one regex scan.  Each
+    expression becomes an alternative in a named group.  Alternatives are
+    tried in order, so the first matching one wins; and since its group is
+    closed after any group in the expression, `lastindex` identifies it.
+    Expressions that can't be combined this way, because they refer to
+    their groups, set flags or reuse each other's group names (see
+    _can_combine), are instead tried one at a time.
+
+    Raises re.error if an expression is invalid.
+    """
+    end = '$' if anchor_end else ''
+    # report errors for the offending expression
+    compiled = [ re.compile(expr + end) for expr in expressions ]
+    no_match = len(expressions)
+
+    combined = None
+    if len(expressions) > 1 and all(_can_combine(expr) for expr in expressions):
+        try:
+            combined = re.compile('|'.join( '(?P<_rule%d>%s%s)' % (i, expr, end) for i, expr in enumerate(expressions) ))
+        except (re.error, AssertionError):
+            # a group name used by more than one expression, or more groups
+            # than the re module supports (which it reports with an assertion)
+            pass
+
+    if combined is None:
+        def classify(path):
+            for i, pattern in enumerate(compiled):
+                if pattern.match(path):
+                    return i
+            return no_match
+        return classify
+
+    rule_by_group = dict( (combined.groupindex['_rule%d' % i], i) for i in xrange(len(expressions)) )
+
+    def classify(path):
+        m = combined.match(path)
+        return rule_by_group[m.lastindex] if m else no_match
+    return classify
+
+def make_predicate(min_size=None, max_size=None, newer_than=None):
+    """
+    Make a function that tests a path_info dict against the given
+    conditions, or return None if there are none.  The size conditions only
+    apply to files.  A path whose size or modification time is unknown
+    fails the conditions on it.
+    """
+    if min_size is None and max_size is None and newer_than is None:
+        return None
+
+    def predicate(info):
+        if info.get('kind') == 'file':
+            size = info.get('size')
+            if min_size is not None and (size is None or size < min_size):
+                return False
+            if max_size is not None and (size is None or size > max_size):
+                return False
+        if newer_than is not None:
+            last_mod = info.get('last_mod')
+            if last_mod is None or last_mod < newer_than:
+                return False
+        return True
+    return predicate
 
-def expand(fs, root, max_levels):
+def root_infos(pset, n_workers=1):
     """
-    Walk a directory hierarchy up to max_levels.  Yield all leaves.
+    Yield a path_info dict for each path in pset, for use without expansion.
+    The path's metadata in the pathset is used if it has all the fields of
+    interest; otherwise it's fetched with get_path_info, with up to
+    n_workers concurrent calls.  The order of the pathset is preserved.
+    """
+    infos = []
+    missing = []
+    for p, meta in pset.iter_with_meta():
+        if meta is not None and meta.kind is not None and meta.mtime is not None and \
+                (meta.size is not None or meta.kind != 'file'):
+            infos.append({ 'name': p, 'kind': meta.kind, 'size': meta.size, 'last_mod': meta.mtime })
+        else:
+            missing.append(len(infos))
+            infos.append(p)
+    if missing:
+        pool = ThreadPool(min(n_workers, len(missing))) if n_workers > 1 and len(missing) > 1 else None
+        try:
+            fetched = (pool.map if pool else map)(_get_info, [ infos[i] for i in missing ])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        for i, info in zip(missing, fetched):
+            # keep the path as it was written in the pathset
+            info['name'] = infos[i]
+            infos[i] = info
+    return infos
+
+def _is_hidden(uri):
+    name = posixpath.basename(urlparse.urlparse(uri).path.rstrip('/'))
+    return name[0:1] in ('.', '_')
+
+def _get_info(uri):
+    fs_op_counter.incr('get_path_info')
+    return hfs.stat(uri)
+
+def _list_children(uri):
+    """
+    List the non-hidden children of directory uri, sorted by name.
+    """
+    fs_op_counter.incr('list_directory')
+    listing = [ path_info for path_info in hfs.ls(uri) if not _is_hidden(path_info['name']) ]
+    listing.sort(key=lambda path_info: path_info['name'])
+    return listing
+
+def expand(roots, max_levels, n_workers=1):
+    """
+    Walk the directory hierarchies under roots up to max_levels.  Yield the
+    path_info dicts of all the leaves; if max_levels <= 0, yield the roots
+    themselves as {'name': root}, without contacting the file system.
+
+    The hierarchies are walked breadth-first:  the directories at each
+    level are listed concurrently by up to n_workers threads.  Children are
+    classified by the kind reported in their parent's listing, so each
+    directory costs a single list_directory call.  The leaves are yielded in
+    the same order as a depth-first walk with children sorted by name.
     """
     if max_levels <= 0:
-      yield root
-    else: # max_levels >= 1
-      root_info = fs.get_path_info(root)
-      if root_info['kind'] == 'file':
-          yield root_info['name']
-      elif root_info['kind'] == 'directory':
-          listing = \
-            [ path_info for path_info in fs.list_directory(root_info['name'])
-                   # Skip hidden files
-                   if path_info['name'][0] not in ('.', '_') ]
-          for item in listing:
-              if max_levels == 1 or item['kind'] == 'file':
-                  yield item['name']
-              else:
-                  for child in expand(fs, item['name'], max_levels - 1):
-                      yield child
-      else:
-          warnings.warn("Skipping item %s. Unsupported file kind %s" % (root_info['name'], root_info['kind']))
+        # stream the roots, without reading them all first
+        for root in roots:
+            yield { 'name': root }
+        return
+
+    roots = list(roots)
+    children = {}
+    pool = ThreadPool(n_workers) if n_workers > 1 else None
+    map_fn = pool.map if pool else map
+    try:
+        root_infos = map_fn(_get_info, roots)
+        frontier = [ info for info in root_infos if info['kind'] == 'directory' ]
+        level = 1
+        while frontier:
+            listings = map_fn(_list_children, [ info['name'] for info in frontier ])
+            next_frontier = []
+            for info, listing in zip(frontier, listings):
+                children[info['name']] = listing
+                if level < max_levels:
+                    next_frontier.extend(item for item in listing if item['kind'] == 'directory')
+            frontier = next_frontier
+            level += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    def leaves(info):
+        if info['kind'] == 'directory' and info['name'] in children:
+            for item in children[info['name']]:
+                for leaf in leaves(item):
+                    yield leaf
+        elif info['kind'] in ('file', 'directory'):
+            yield info
+        else:
+            warnings.warn("Skipping item %s. Unsupported file kind %s" % (info['name'], info['kind']))
+
+    for info in root_infos:
+        for leaf in leaves(info):
+            yield leaf
 
 def main(args=None):
     options = parse_args(args)
 
-    expr = options.expression
-    if options.anchor_end:
-        expr += '$'
     try:
-        pattern = re.compile(expr)
-    except RuntimeError as e:
-        print >> sys.stderr, "Error compiling regular expression '%s'" % expr
-        print >> sys.stderr, e
+        classify = compile_rules(options.expressions, options.anchor_end)
+    except re.error as e:
+        print >> sys.stderr, "Error compiling regular expression: %s" % e
         sys.exit(2)
 
     # read input pathset
-    source_pathset = pathset.FilePathset.from_file(options.input_pathset)
-    # and set up output pathsets
-    match_pathset = pathset.FilePathset()
-    match_pathset.datatype = source_pathset.datatype
+    source_pathset = pathset.FilePathset.from_file(options.input_pathset, lazy=True)
+    # and set up the output pathsets:  one per expression, plus the default
+    output_paths = options.outputs + [ options.default_output ]
+    output_pathsets = [ pathset.FilePathset(compact=True) for _ in output_paths ]
+    for ps in output_pathsets:
+        ps.datatype = source_pathset.datatype
+
+    # Leaves found by expansion are full URIs returned by HDFS, so they
+    # don't need to be sanitized.  Without expansion they're the paths
+    # from the input pathset, which may not be.
+    trusted = options.expand_levels > 0
 
-    no_match_pathset = pathset.FilePathset()
-    no_match_pathset.datatype = source_pathset.datatype
+    # Paths that don't satisfy the predicate go to the default output.
+    # When expanding, it's evaluated on the path_info from the listings;
+    # else on the input paths' metadata, if the pathset has it.
+    predicate = make_predicate(options.min_size, options.max_size, options.newer_than)
+    default = len(output_pathsets) - 1
+    if predicate is not None and options.expand_levels == 0:
+        leaves = root_infos(source_pathset, options.expand_workers)
+    else:
+        leaves = expand(source_pathset, options.expand_levels, options.expand_workers)
 
     # now iterate through the paths
-    for p in source_pathset:
-        host, port = hdfs.path.split(p)[0:2]
-        fs = hdfs.fs.hdfs(host, port)
-        for leaf in expand(fs, p, options.expand_levels):
-            if pattern.match(leaf):
-                match_pathset.append(leaf)
-            else:
-                no_match_pathset.append(leaf)
+    for leaf in leaves:
+        name = leaf['name']
+        if predicate is None or predicate(leaf):
+            target = classify(name)
+        else:
+            target = default
+        output_pathsets[target].extend((name,), trusted)
 
     # write to file
-    with open(options.output_true, 'w') as f:
-        match_pathset.write(f)
-    with open(options.output_false, 'w') as f:
-        no_match_pathset.write(f)
+    for path, ps in zip(output_paths, output_pathsets):
+        with open(path, 'w') as f:
+            ps.write(f, options.pathset_encoding)
@@ -7,17 +7,28 @@
 #
 # END_COPYRIGHT
 
+import ctypes
+import ctypes.util
+import errno
 import logging
 import os
+import re
+import stat
 import subprocess
 import sys
 import urlparse
 
-import pydoop
-import pydoop.hdfs as phdfs
+# the file system handles and counters used to live here
+from hadoop_galaxy.fs import OpCounter, fs_op_counter, FsPool, LocalFs, fs_pool, split_uri
+from hadoop_galaxy.lazy import phdfs, pydoop
+from hadoop_galaxy.pathset import PathMeta
 
 EnvLogLevel = 'HADOOP_GALAXY_LOG_LEVEL'
 
+PreallocStrategies = ('fallocate', 'truncate', 'none')
+
+DefaultCopyBufferSize = 10 * 2**20 # 10 MB
+
 def config_logging(log_level='INFO'):
     if isinstance(log_level, basestring):
         level = getattr(logging, log_level.upper())
@@ -80,6 +91,216 @@ class Uri(object):
             url = self.path
         return url
 
+# Characters with a special meaning in Hadoop glob patterns
+_GlobChars = '*?[{\\'
+
+def has_glob(path):
+    """
+    Whether path contains any Hadoop glob special characters.
+    """
+    return any(c in path for c in _GlobChars)
+
+def _find_closing(pattern, start, opening, closing):
+    """
+    Return the index of the `closing` character matching the `opening` one
+    at pattern[start], skipping escaped characters and nested groups.
+    """
+    depth = 0
+    i = start
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif c == opening:
+            depth += 1
+        elif c == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError("Unbalanced '%s' in glob pattern %s" % (opening, pattern))
+
+def _split_alternatives(text):
+    """
+    Split the contents of a {...} group on its top-level commas.
+    """
+    alternatives = []
+    depth = 0
+    current = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '\\' and i + 1 < len(text):
+            current.append(text[i:i+2])
+            i += 2
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            alternatives.append(''.join(current))
+            current = []
+            i += 1
+            continue
+        current.append(c)
+        i += 1
+    alternatives.append(''.join(current))
+    return alternatives
+
+def _expand_slash_braces(pattern):
+    """
+    Like Hadoop's GlobExpander, expand {a,b} groups that contain a '/'
+    into separate patterns.  Other groups are left for the regex matching.
+    """
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '{':
+            end = _find_closing(pattern, i, '{', '}')
+            body = pattern[i+1:end]
+            if '/' in body:
+                head, tail = pattern[:i], pattern[end+1:]
+                return [ p for alt in _split_alternatives(body)
+                           for p in _expand_slash_braces(head + alt + tail) ]
+            i = end + 1
+            continue
+        i += 1
+    return [ pattern ]
+
+def _glob_to_regex(component):
+    """
+    Translate one path component of a Hadoop glob to a regular expression.
+    """
+    out = []
+    i = 0
+    while i < len(component):
+        c = component[i]
+        if c == '\\':
+            if i + 1 >= len(component):
+                raise ValueError("Glob pattern %s ends with an escape character" % component)
+            out.append(re.escape(component[i+1]))
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            i = _class_to_regex(component, i, out)
+        elif c == '{':
+            end = _find_closing(component, i, '{', '}')
+            out.append('(?:%s)' % '|'.join(_glob_to_regex(alt)
+                for alt in _split_alternatives(component[i+1:end])))
+            i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def _class_to_regex(component, start, out):
+    """
+    Translate the character class that starts at component[start] ('[')
+    to a regular expression, appended to out.  Returns the position of
+    the closing ']'.
+
+    The class is negated by a leading '^' or '!'.  A ']' right after that
+    is part of the class; so is any character escaped with a backslash.
+    Other characters are escaped for the regex, except for a '-' between
+    two characters, which specifies a range.
+    """
+    i = start + 1
+    negated = i < len(component) and component[i] in '^!'
+    if negated:
+        i += 1
+    body = []
+    while i < len(component) and (component[i] != ']' or not body):
+        c = component[i]
+        if c == '\\':
+            if i + 1 >= len(component):
+                raise ValueError("Glob pattern %s ends with an escape character" % component)
+            body.append(re.escape(component[i+1]))
+            i += 2
+            continue
+        if c == '-' and body and i + 1 < len(component) and component[i+1] != ']':
+            body.append('-')
+        else:
+            body.append(re.escape(c))
+        i += 1
+    if i >= len(component):
+        raise ValueError("Unbalanced '[' in glob pattern %s" % component)
+    out.append('[%s%s]' % ('^' if negated else '', ''.join(body)))
+    return i
+
+def _unescape(component):
+    return re.sub(r'\\(.)', r'\1', component)
+
+class _LocalGlobLister(object):
+    @staticmethod
+    def list_names(path):
+        try:
+            return os.listdir(path)
+        except OSError:
+            return []
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path)
+
+class _HdfsGlobLister(object):
+    def __init__(self, fs):
+        self.fs = fs
+
+    def list_names(self, path):
+        fs_op_counter.incr('list_directory')
+        try:
+            listing = self.fs.list_directory(path)
+        except IOError:
+            return []
+        names = [ urlparse.urlparse(info['name']).path for info in listing ]
+        if len(names) == 1 and names[0].rstrip('/') == path.rstrip('/'):
+            return [] # listing a file returns the file itself
+        return [ os.path.basename(n.rstrip('/')) for n in names ]
+
+    def exists(self, path):
+        fs_op_counter.incr('exists')
+        return self.fs.exists(path)
+
+def glob_path(lister, pattern):
+    """
+    Expand the absolute path `pattern`, which may contain Hadoop glob
+    wildcards (`*`, `?`, `[...]`, `{a,b}`), one path component at a
+    time.  Only directories along wildcard components are listed.
+
+    Returns the list of matching paths.  Within each expansion of the
+    {...} groups containing a '/', matches are sorted by name.
+    """
+    results = []
+    for expanded in _expand_slash_braces(pattern):
+        # each candidate is a (path, verified to exist) tuple
+        candidates = [ ('/', True) ]
+        for component in ( c for c in expanded.split('/') if c ):
+            new_candidates = []
+            if not has_glob(component):
+                name = _unescape(component)
+                new_candidates = [ (os.path.join(path, name), False) for path, _ in candidates ]
+            else:
+                try:
+                    regex = re.compile(_glob_to_regex(component) + '$')
+                except re.error as e:
+                    raise ValueError("Invalid glob pattern %s: %s" % (component, e))
+                for path, _ in candidates:
+                    matches = sorted(n for n in lister.list_names(path) if regex.match(n))
+                    new_candidates.extend( (os.path.join(path, n), True) for n in matches )
+            candidates = new_candidates
+            if not candidates:
+                break
+        results.extend(path for path, verified in candidates if verified or lister.exists(path))
+    return results
+
 def expand_paths(datapath_uri):
     """
     If a URI contains wildcards, this function expands them.
@@ -87,20 +308,51 @@ def expand_paths(datapath_uri):
     Returns a list of URIs.
     """
     # simple case:  the path simply exists
-    if phdfs.path.exists(datapath_uri.geturl()):
+    if datapath_uri.scheme == 'file':
+        exists = os.path.exists(datapath_uri.path)
+    else:
+        fs_op_counter.incr('exists')
+        exists = phdfs.path.exists(datapath_uri.geturl())
+    if exists:
         return [datapath_uri.geturl()]
 
-    # second case:  the path doesn't exist as it is.  It may contain wildcards, so we try
-    # listing the datapath with hadoop dfs.  If we were to list with
-    # pydoop.hdfs.ls we'd have to implement hadoop wildcards ourselves (perhaps with fnmatch)
+    # second case:  the path doesn't exist as it is.  It may contain wildcards, so we
+    # expand them ourselves by listing the directories along the path.
+    if has_glob(datapath_uri.path) and datapath_uri.scheme in ('file', 'hdfs'):
+        try:
+            if datapath_uri.scheme == 'file':
+                lister = _LocalGlobLister()
+            else:
+                lister = _HdfsGlobLister(fs_pool.get_for(datapath_uri.geturl()))
+            matches = glob_path(lister, datapath_uri.path)
+        except ValueError as e:
+            print_err("Invalid glob pattern in %s: %s" % (datapath_uri.geturl(), e))
+            sys.exit(1)
+        except StandardError as e:
+            logging.getLogger('HadoopGalaxy').warning(
+                "In-process expansion of %s failed (%s). Trying with hadoop dfs -ls", datapath_uri.geturl(), e)
+        else:
+            if not matches:
+                print_err("Could not list datapath %s.  Please check whether it exists" % datapath_uri.geturl())
+                sys.exit(1)
+            return [ Uri(datapath_uri.scheme, datapath_uri.netloc, p).geturl() for p in matches ]
+
+    return _expand_paths_with_hadoop(datapath_uri)
 
+def _expand_paths_with_hadoop(datapath_uri):
+    """
+    Expand wildcards by listing the datapath with `hadoop dfs -ls`.
+    Slow, since it starts a JVM, but it supports any Hadoop file system.
+    """
     def process(ls_line):
-        path = ls_line[(ls_line.rindex(' ') + 1):]
+        # permissions, replication, owner, group, size, date, time, path
+        path = ls_line.split(None, 7)[7]
         url = Uri(urlparse.urlparse(path))
         url.scheme = datapath_uri.scheme
         url.netloc = datapath_uri.netloc
         return url.geturl()
 
+    fs_op_counter.incr('hadoop_ls')
     try:
         # run -ls with hadoop dfs the process the output.
         # We drop the first line since it's something like "Found xx items".
@@ -112,6 +364,225 @@ def expand_paths(datapath_uri):
         print_err("Message:", str(e))
         sys.exit(1)
 
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+def _posix_fallocate(fd, offset, length):
+    """
+    Call posix_fallocate(3) through the C library.  Raises OSError on failure.
+    """
+    libc = _get_libc()
+    fallocate = getattr(libc, 'posix_fallocate64', None) or libc.posix_fallocate
+    fallocate.argtypes = [ ctypes.c_int, ctypes.c_int64, ctypes.c_int64 ]
+    # posix_fallocate returns the error number rather than setting errno
+    err = fallocate(fd, offset, length)
+    if err != 0:
+        raise OSError(err, os.strerror(err))
+
+def preallocate_file(path, size, strategy='fallocate'):
+    """
+    Create or truncate the local file `path` and extend it to `size` bytes.
+
+    strategy:
+      * 'fallocate': reserve the blocks with posix_fallocate, so that
+        later writers only overwrite allocated space.  Falls back to
+        'truncate' if the file system doesn't support it;
+      * 'truncate': set the file size with ftruncate (the file is sparse);
+      * 'none': just create an empty file.
+
+    Returns the strategy actually used.
+    """
+    if strategy not in PreallocStrategies:
+        raise ValueError("Unknown preallocation strategy %s. Must be one of %s" % (strategy, ', '.join(PreallocStrategies)))
+    log = logging.getLogger('HadoopGalaxy')
+    with open(path, 'w') as f:
+        if strategy == 'none' or size <= 0:
+            return strategy
+        if strategy == 'fallocate':
+            try:
+                _posix_fallocate(f.fileno(), 0, size)
+                return strategy
+            except (OSError, AttributeError) as e:
+                if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                    raise
+                log.warning("posix_fallocate failed on %s (%s). Falling back to ftruncate", path, e)
+        os.ftruncate(f.fileno(), size)
+        return 'truncate'
+
+class CopyEngine(object):
+    """
+    Copies data between file objects through a single buffer that is
+    allocated once and reused for every copy, instead of allocating a new
+    string for each read.
+
+    Sources that support `readinto` (local files) are read straight into
+    the buffer.  Others (e.g., pydoop HDFS files) fall back to `read`.
+    """
+
+    def __init__(self, buffer_size=DefaultCopyBufferSize):
+        if buffer_size <= 0:
+            raise ValueError("buffer_size must be > 0 (got %s)" % buffer_size)
+        self._buf = bytearray(buffer_size)
+
+    @property
+    def buffer_size(self):
+        return len(self._buf)
+
+    def _read_chunk(self, src_fd, n):
+        """
+        Read up to n bytes from src_fd.  Returns an object that can be written
+        to a file and its length.
+        """
+        readinto = getattr(src_fd, 'readinto', None)
+        if readinto is None:
+            data = src_fd.read(n)
+            return data, len(data)
+        if n == len(self._buf):
+            count = readinto(self._buf)
+        else:
+            count = readinto(memoryview(self._buf)[:n])
+        return buffer(self._buf, 0, count), count
+
+    def copy(self, src_fd, dest_fd, max_bytes=None, callback=None):
+        """
+        Copy from the current position of src_fd to the current position
+        of dest_fd until the end of the source or until max_bytes have been
+        copied.  If provided, callback(n) is called after each chunk of n
+        bytes is written.
+
+        Returns the number of bytes copied.
+        """
+        n_bytes = 0
+        while max_bytes is None or n_bytes < max_bytes:
+            want = self.buffer_size if max_bytes is None else min(self.buffer_size, max_bytes - n_bytes)
+            data, count = self._read_chunk(src_fd, want)
+            if count <= 0:
+                break
+            dest_fd.write(data)
+            n_bytes += count
+            if callback:
+                callback(count)
+        return n_bytes
+
+# Errors meaning a kernel copy method can't be used for this pair of files
+_KernelCopyUnsupported = (errno.ENOSYS, errno.EINVAL, errno.EXDEV, errno.EOPNOTSUPP, errno.EBADF)
+# Maximum number of bytes to request in a single system call (same as Linux's limit)
+_KernelCopyMaxChunk = 0x7ffff000
+
+def _copy_file_range_fn():
+    fn = getattr(_get_libc(), 'copy_file_range', None)
+    if fn is not None:
+        fn.argtypes = [ ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint ]
+        fn.restype = ctypes.c_ssize_t
+        return lambda in_fd, out_fd, count: fn(in_fd, None, out_fd, None, count, 0)
+    return None
+
+def _sendfile_fn():
+    fn = getattr(_get_libc(), 'sendfile64', None) or getattr(_get_libc(), 'sendfile', None)
+    if fn is not None:
+        fn.argtypes = [ ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t ]
+        fn.restype = ctypes.c_ssize_t
+        return lambda in_fd, out_fd, count: fn(out_fd, in_fd, None, count)
+    return None
+
+def kernel_copy(src_fd, dest_fd):
+    """
+    Copy the rest of local file `src_fd` to local file `dest_fd` (both
+    file objects) without passing the data through user space.  Tries
+    copy_file_range(2), which can reflink on file systems such as XFS and
+    btrfs, and then sendfile(2).
+
+    Copies from and to the current file positions, which are advanced by
+    the number of bytes copied.  The copy stops early if neither system call
+    is usable for these files, so the caller must finish the job with a
+    regular read/write loop.
+
+    Returns the number of bytes copied.
+    """
+    # flush any buffered data before working at the file descriptor level
+    dest_fd.flush()
+    in_fd, out_fd = src_fd.fileno(), dest_fd.fileno()
+    # The file objects may have their own idea of the position
+    os.lseek(in_fd, src_fd.tell(), os.SEEK_SET)
+    os.lseek(out_fd, dest_fd.tell(), os.SEEK_SET)
+
+    n_bytes = 0
+    try:
+        for get_fn in (_copy_file_range_fn, _sendfile_fn):
+            fn = get_fn()
+            if fn is None:
+                continue
+            while True:
+                n = fn(in_fd, out_fd, _KernelCopyMaxChunk)
+                if n < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    if err in _KernelCopyUnsupported:
+                        break # try the next method
+                    raise OSError(err, os.strerror(err))
+                if n == 0:
+                    return n_bytes # EOF
+                n_bytes += n
+        return n_bytes
+    finally:
+        # re-synchronize the file objects with the descriptors
+        src_fd.seek(os.lseek(in_fd, 0, os.SEEK_CUR))
+        dest_fd.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+
+def _is_hidden(relative_path):
+    """
+    Whether any component of the path starts with '_'.  cat_paths and
+    dist_cat_paths skip these (e.g., Hadoop's _SUCCESS and _logs) when
+    reading a directory.
+    """
+    return any(c.startswith('_') for c in relative_path.split('/'))
+
+def get_path_meta(uri, summarize_dirs=False):
+    """
+    Get a PathMeta for the URI, with one stat on the file system.  With
+    summarize_dirs=True, directories are also walked to fill in the
+    total size and number of the non-hidden files they contain.
+    """
+    u = urlparse.urlparse(uri)
+    if u.scheme == 'file':
+        st = os.stat(u.path)
+        if not stat.S_ISDIR(st.st_mode):
+            return PathMeta(st.st_size, int(st.st_mtime), 'file', None)
+        size = count = None
+        if summarize_dirs:
+            size = count = 0
+            for dirpath, _, filenames in os.walk(u.path):
+                for name in filenames:
+                    full = os.path.join(dirpath, name)
+                    if not _is_hidden(os.path.relpath(full, u.path)):
+                        size += os.path.getsize(full)
+                        count += 1
+        return PathMeta(size, int(st.st_mtime), 'directory', count)
+    else:
+        path = phdfs.path.split(uri)[2]
+        fs = fs_pool.get_for(uri)
+        fs_op_counter.incr('get_path_info')
+        info = fs.get_path_info(path)
+        if info['kind'] != 'directory':
+            return PathMeta(info['size'], int(info['last_mod']), info['kind'], None)
+        size = count = None
+        if summarize_dirs:
+            size = count = 0
+            root = urlparse.urlparse(info['name']).path.rstrip('/')
+            fs_op_counter.incr('walk')
+            for item in fs.walk(path):
+                item_path = urlparse.urlparse(item['name']).path
+                if item['kind'] == 'file' and not _is_hidden(item_path[len(root):]):
+                    size += item['size']
+                    count += 1
+        return PathMeta(size, int(info['last_mod']), 'directory', count)
+
 def get_abs_executable_path(executable_name, env=None):
     if env is None:
         env = os.environ
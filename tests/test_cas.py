@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.cas import CasStore, CasDir, release_pathset
+from hadoop_galaxy.fs import LockFile
+from hadoop_galaxy.pathset import FilePathset
+
+class _SmallSampleStore(CasStore):
+    SampleSize = 4
+
+class TestCasStore(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_cas')
+        self.root = 'file://' + os.path.join(self.wd, CasDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _make_file(self, name, contents):
+        path = os.path.join(self.wd, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return 'file://' + path, len(contents)
+
+    def _store(self, store, uri, size):
+        """Add uri to the store and copy it if needed, like put_dataset does"""
+        object_uri, is_new = store.add(uri, size)
+        if is_new:
+            shutil.copy(uri[len('file://'):], object_uri[len('file://'):])
+        return object_uri, is_new
+
+    def test_add_and_reuse(self):
+        a = self._make_file('a.txt', 'some data')
+        b = self._make_file('b.txt', 'some data')
+        c = self._make_file('c.txt', 'other data')
+        with CasStore(self.root) as store:
+            obj_a, new_a = self._store(store, *a)
+            obj_b, new_b = self._store(store, *b)
+            obj_c, new_c = self._store(store, *c)
+            self.assertTrue(new_a)
+            self.assertFalse(new_b)
+            self.assertTrue(new_c)
+            self.assertEqual(obj_a, obj_b)
+            self.assertNotEqual(obj_a, obj_c)
+            self.assertTrue(obj_a.endswith('.txt'))
+            self.assertEqual(2, store.refcount(os.path.basename(obj_a)))
+
+    def test_index_persists(self):
+        a = self._make_file('a', 'some data')
+        with CasStore(self.root) as store:
+            obj, _ = self._store(store, *a)
+            store.commit()
+        with CasStore(self.root) as store:
+            self.assertEqual(1, store.refcount(os.path.basename(obj)))
+            self.assertEqual((obj, False), self._store(store, *a))
+            self.assertEqual(2, store.refcount(os.path.basename(obj)))
+
+    def test_quick_key_collision(self):
+        # the files differ only in bytes that aren't sampled
+        a = self._make_file('a', 'head' + 'xxxx' + 'midd' + 'xxxx' + 'tail')
+        b = self._make_file('b', 'head' + 'yyyy' + 'midd' + 'yyyy' + 'tail')
+        a_again = self._make_file('a_again', 'head' + 'xxxx' + 'midd' + 'xxxx' + 'tail')
+        with _SmallSampleStore(self.root) as store:
+            self.assertEqual(store.quick_key(*a), store.quick_key(*b))
+            obj_a, _ = self._store(store, *a)
+            obj_b, new_b = self._store(store, *b)
+            self.assertTrue(new_b)
+            self.assertNotEqual(obj_a, obj_b)
+            store.commit()
+        with _SmallSampleStore(self.root) as store:
+            self.assertEqual((obj_a, False), self._store(store, *a_again))
+
+    def test_release(self):
+        a = self._make_file('a', 'some data')
+        with CasStore(self.root) as store:
+            obj, _ = self._store(store, *a)
+            self._store(store, *a)
+            self.assertEqual(1, store.release(obj))
+            self.assertTrue(os.path.exists(obj[len('file://'):]))
+            self.assertEqual(0, store.release(obj))
+            self.assertFalse(os.path.exists(obj[len('file://'):]))
+            self.assertRaises(ValueError, store.release, obj)
+        with CasStore(self.root) as store:
+            self.assertEqual(0, store.refcount(os.path.basename(obj)))
+
+    def test_release_pathset(self):
+        a = self._make_file('a', 'some data')
+        with CasStore(self.root) as store:
+            obj, _ = self._store(store, *a)
+            self._store(store, *a)
+            store.commit()
+        n = release_pathset(FilePathset(obj, 'file:///not/in/a/store'))
+        self.assertEqual(1, n)
+        with CasStore(self.root) as store:
+            self.assertEqual(1, store.refcount(os.path.basename(obj)))
+
+    def test_interrupted(self):
+        a = self._make_file('a.txt', 'some data')
+        try:
+            with CasStore(self.root) as store:
+                obj, _ = self._store(store, *a)
+                raise KeyboardInterrupt()
+        except KeyboardInterrupt:
+            pass
+        self.assertFalse(os.path.exists(obj[len('file://'):]))
+        with CasStore(self.root) as store:
+            self.assertEqual(0, store.refcount(os.path.basename(obj)))
+            self.assertEqual((obj, True), self._store(store, *a))
+
+    def test_reservations(self):
+        a = self._make_file('a', 'some data')
+        uploader = CasStore(self.root)
+        with uploader:
+            obj, is_new = uploader.add(*a)
+        self.assertTrue(is_new)
+        # the uploader isn't holding the lock while it copies
+        with CasStore(self.root) as store:
+            self.assertEqual(0, store.refcount(os.path.basename(obj)))
+            self.assertRaises(ValueError, store.release, obj)
+            other, is_new = store.add(*a)
+            self.assertTrue(is_new)
+            self.assertNotEqual(obj, other)
+            store.release(other)
+        shutil.copy(a[0][len('file://'):], obj[len('file://'):])
+        with uploader:
+            uploader.commit()
+        with CasStore(self.root) as store:
+            self.assertEqual((obj, False), store.add(*a))
+            self.assertEqual(2, store.refcount(os.path.basename(obj)))
+
+    def test_expired_reservation(self):
+        a = self._make_file('a', 'some data')
+        uploader = CasStore(self.root)
+        with uploader:
+            obj, _ = self._store(uploader, *a)
+        store = CasStore(self.root)
+        store.ReservationTimeout = -1
+        with store:
+            self.assertEqual(0, store.refcount(os.path.basename(obj)))
+        self.assertFalse(os.path.exists(obj[len('file://'):]))
+        with uploader:
+            self.assertRaises(RuntimeError, uploader.commit)
+
+    def _lock_path(self):
+        return os.path.join(self.wd, CasDir, CasStore.LockName)
+
+    def test_lock(self):
+        with CasStore(self.root):
+            self.assertFalse(LockFile('file://' + self._lock_path()).try_acquire())
+        self.assertFalse(os.path.exists(self._lock_path()))
+
+    def test_stale_lock(self):
+        # a lock left behind by a process that died an hour ago
+        os.makedirs(os.path.join(self.wd, CasDir))
+        open(self._lock_path(), 'w').close()
+        os.utime(self._lock_path(), (time.time() - 3600, time.time() - 3600))
+        store = CasStore(self.root)
+        store.LockPollInterval = 0.01
+        with store:
+            pass
+        self.assertFalse(os.path.exists(self._lock_path()))
+
+    def test_lost_lock(self):
+        a = self._make_file('a', 'some data')
+        try:
+            with CasStore(self.root) as store:
+                self._store(store, *a)
+                # another process removed our lock as stale and took it
+                os.remove(self._lock_path())
+                self.assertTrue(LockFile('file://' + self._lock_path()).try_acquire())
+            self.fail("saving the index without the lock didn't raise")
+        except IOError:
+            pass
+        self.assertFalse(os.path.exists(os.path.join(self.wd, CasDir, CasStore.IndexName)))
+        self.assertTrue(os.path.exists(self._lock_path()))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(TestCasStore)
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
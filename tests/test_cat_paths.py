@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+from StringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.cat_paths import ReadAheadCopier, iter_files, perform_copy
+from hadoop_galaxy.pathset import FilePathset
+
+class TestReadAheadCopier(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_cat_paths')
+        self.uris = []
+        self.expected = StringIO()
+        for i in xrange(20):
+            data = ''.join(chr((i * 7 + j) % 256) for j in xrange(i * 300))
+            path = os.path.join(self.wd, 'part-%05d' % i)
+            with open(path, 'w') as f:
+                f.write(data)
+            self.uris.append('file://' + path)
+            self.expected.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_order_preserved(self):
+        for n_readers in (1, 2, 8):
+            out = StringIO()
+            copier = ReadAheadCopier(n_readers, 1024, 256)
+            n = copier.copy(self.uris, out)
+            self.assertEqual(len(self.expected.getvalue()), n)
+            self.assertEqual(self.expected.getvalue(), out.getvalue())
+
+    def test_callback(self):
+        done = []
+        ReadAheadCopier(3, 1024, 256).copy(self.uris, StringIO(), lambda path, n: done.append(path))
+        self.assertEqual(self.uris, done)
+
+    def test_read_error(self):
+        uris = self.uris[0:3] + [ 'file://' + os.path.join(self.wd, 'missing') ] + self.uris[3:]
+        self.assertRaises(IOError, ReadAheadCopier(2, 1024, 256).copy, uris, StringIO())
+
+    def test_iterator_error(self):
+        def files():
+            for u in self.uris[0:5]:
+                yield u
+            raise IOError("listing failed")
+        for n_readers in (1, 2, 8):
+            self.assertRaises(IOError, ReadAheadCopier(n_readers, 1024, 256).copy, files(), StringIO())
+
+    def test_bad_limits(self):
+        self.assertRaises(ValueError, ReadAheadCopier, 0, 1024, 256)
+        self.assertRaises(ValueError, ReadAheadCopier, 2, 100, 256)
+
+class TestPerformCopy(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_cat_paths')
+        for name, data in (('a', 'a'), ('dir/b', 'b'), ('dir/sub/c', 'c'), ('dir/_logs/x', 'x'), ('dir/d', 'd')):
+            path = os.path.join(self.wd, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _uri(self, name):
+        return 'file://' + os.path.join(self.wd, name)
+
+    def _read(self, name):
+        with open(os.path.join(self.wd, name)) as f:
+            return f.read()
+
+    def test_concatenate(self):
+        pset = FilePathset(self._uri('dir'), self._uri('a'))
+        self.assertEqual([ self._uri(n) for n in ('dir/b', 'dir/d', 'dir/sub/c', 'a') ], list(iter_files(pset)))
+        for readers in (0, 2):
+            perform_copy(pset, self._uri('out'), readers=readers)
+            self.assertEqual('bdca', self._read('out'))
+
+    def test_link_single_file(self):
+        perform_copy(FilePathset(self._uri('a')), self._uri('out'))
+        self.assertEqual(os.stat(os.path.join(self.wd, 'a')).st_ino, os.stat(os.path.join(self.wd, 'out')).st_ino)
+
+    def test_delete_source(self):
+        perform_copy(FilePathset(self._uri('dir')), self._uri('out'), delete_source=True)
+        self.assertEqual('bdc', self._read('out'))
+        self.assertFalse(os.path.exists(os.path.join(self.wd, 'dir')))
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestReadAheadCopier)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPerformCopy))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
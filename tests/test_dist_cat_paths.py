@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+from StringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy.dist_cat_paths as dist_cat_paths
+from hadoop_galaxy.dist_cat_paths import DistCatPaths, _PathInfo, serialize, unserialize
+
+Output = 'file:///data/out'
+
+class _MockWriter(object):
+    def __init__(self):
+        self.counters = {}
+
+    def status(self, msg):
+        pass
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+class TestSplitPathInfo(unittest.TestCase):
+    def _split(self, size, max_chunk_size):
+        return DistCatPaths.split_path_info(_PathInfo('file:///a', size), max_chunk_size)
+
+    def test_no_limit(self):
+        self.assertEqual([ (0, 100) ], self._split(100, None))
+
+    def test_exactly_one_chunk(self):
+        self.assertEqual([ (0, 10) ], self._split(10, 10))
+
+    def test_whole_chunks(self):
+        self.assertEqual([ (0, 10), (10, 10) ], self._split(20, 10))
+
+    def test_last_partial_chunk(self):
+        self.assertEqual([ (0, 10), (10, 10), (20, 1) ], self._split(21, 10))
+
+    def test_empty_file(self):
+        self.assertEqual([ (0, 0) ], self._split(0, 10))
+        self.assertEqual([ (0, 0) ], self._split(0, None))
+
+class TestSerialize(unittest.TestCase):
+    def test_round_trip(self):
+        line = serialize('file:///a', 10, 20, Output, 30)
+        self.assertEqual([ dict(src_path='file:///a', src_pos=10, src_size=20, dest_path=Output, dest_pos=30) ],
+                unserialize(line + '\n'))
+
+    def test_packed(self):
+        line = '\t'.join([ serialize('file:///a', 0, 5, Output, 0), serialize('file:///b', 0, 7, Output, 5) ])
+        records = unserialize(line)
+        self.assertEqual([ 'file:///a', 'file:///b' ], [ r['src_path'] for r in records ])
+        self.assertEqual([ 0, 5 ], [ r['dest_pos'] for r in records ])
+
+    def test_bad_line(self):
+        self.assertRaises(ValueError, unserialize, 'file:///a\t0\t5\n')
+        self.assertRaises(ValueError, unserialize, serialize('file:///a', 0, 5, Output, 0) + '\tfile:///b\n')
+
+class TestMrInput(unittest.TestCase):
+    def _write(self, sizes, max_chunk_size=None, pack_size=None):
+        """
+        Returns the job input lines for files of the given sizes, each as
+        a list of (src_path, src_pos, src_size, dest_pos) tuples.
+        """
+        driver = DistCatPaths()
+        driver.output_path = Output
+        driver.max_chunk_size = max_chunk_size
+        driver.pack_size = pack_size
+        driver._src_paths = [ _PathInfo('file:///f%d' % i, size) for i, size in enumerate(sizes) ]
+        io = StringIO()
+        n_lines = driver._write_mr_input(io)
+        lines = io.getvalue().splitlines()
+        self.assertEqual(n_lines, len(lines))
+        return [ [ (r['src_path'], r['src_pos'], r['src_size'], r['dest_pos']) for r in unserialize(line) ]
+                    for line in lines ]
+
+    def test_one_per_file(self):
+        self.assertEqual([ [ ('file:///f0', 0, 4, 0) ], [ ('file:///f1', 0, 0, 4) ], [ ('file:///f2', 0, 6, 4) ] ],
+                self._write([ 4, 0, 6 ]))
+
+    def test_chunks(self):
+        self.assertEqual([ [ ('file:///f0', 0, 10, 0) ], [ ('file:///f0', 10, 5, 10) ], [ ('file:///f1', 0, 10, 15) ] ],
+                self._write([ 15, 10 ], max_chunk_size=10))
+
+    def test_pack(self):
+        # the third file doesn't fit in the first task
+        self.assertEqual([ [ ('file:///f0', 0, 4, 0), ('file:///f1', 0, 4, 4) ], [ ('file:///f2', 0, 4, 8) ] ],
+                self._write([ 4, 4, 4 ], pack_size=10))
+        # exactly full
+        self.assertEqual([ [ ('file:///f0', 0, 5, 0), ('file:///f1', 0, 5, 5) ], [ ('file:///f2', 0, 1, 10) ] ],
+                self._write([ 5, 5, 1 ], pack_size=10))
+
+    def test_pack_overflow(self):
+        # a file larger than the pack size gets a task of its own
+        self.assertEqual([ [ ('file:///f0', 0, 1, 0) ], [ ('file:///f1', 0, 20, 1) ], [ ('file:///f2', 0, 1, 21) ] ],
+                self._write([ 1, 20, 1 ], pack_size=10))
+
+    def test_pack_chunks(self):
+        self.assertEqual([ [ ('file:///f0', 0, 3, 0) ], [ ('file:///f1', 0, 8, 3) ], [ ('file:///f1', 8, 2, 11), ('file:///f2', 0, 2, 13) ] ],
+                self._write([ 3, 10, 2 ], max_chunk_size=8, pack_size=8))
+
+class TestMapper(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_dist_cat_paths')
+        dist_cat_paths._engine = None
+
+    def tearDown(self):
+        dist_cat_paths._engine = None
+        shutil.rmtree(self.wd)
+
+    def test_concatenate(self):
+        contents = [ 'a' * 25, '', 'b' * 3, 'c' * 10 ]
+        sources = []
+        for i, data in enumerate(contents):
+            path = os.path.join(self.wd, 'f%d' % i)
+            with open(path, 'w') as f:
+                f.write(data)
+            sources.append(_PathInfo('file://' + path, len(data)))
+        driver = DistCatPaths()
+        driver.output_path = os.path.join(self.wd, 'out')
+        driver.max_chunk_size = 10
+        driver.pack_size = 12
+        driver._src_paths = sources
+        io = StringIO()
+        driver._write_mr_input(io)
+        with open(os.path.join(self.wd, 'out'), 'w') as f:
+            f.truncate(sum(len(data) for data in contents))
+        writer = _MockWriter()
+        for line in io.getvalue().splitlines():
+            dist_cat_paths.mapper(None, line, writer, {})
+        with open(os.path.join(self.wd, 'out')) as f:
+            self.assertEqual(''.join(contents), f.read())
+        self.assertEqual(len(contents), writer.counters['files catted'])
+        self.assertEqual(sum(len(data) for data in contents), writer.counters['file bytes written'])
+
+    def test_short_source(self):
+        path = os.path.join(self.wd, 'f')
+        with open(path, 'w') as f:
+            f.write('abc')
+        open(os.path.join(self.wd, 'out'), 'w').close()
+        line = serialize('file://' + path, 0, 10, 'file://' + os.path.join(self.wd, 'out'), 0)
+        self.assertRaises(RuntimeError, dist_cat_paths.mapper, None, line, _MockWriter(), {})
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestSplitPathInfo)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestSerialize))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestMrInput))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestMapper))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+from StringIO import StringIO
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.dist_text_zipper import TextZipperDriver
+
+class TestMrInput(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_dist_text_zipper')
+        for name in ('in/a', 'in/sub/b', 'in/sub/deeper/c', 'single'):
+            path = os.path.join(self.wd, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(name)
+        os.mkdir(os.path.join(self.wd, 'in', 'empty'))
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _uri(self, name):
+        return 'file://' + os.path.join(self.wd, name)
+
+    def _write(self, *input_paths):
+        # the constructor checks the paths with pydoop, so we skip it
+        driver = TextZipperDriver.__new__(TextZipperDriver)
+        driver.log = logging.getLogger('TextZipper')
+        driver.output_path = self._uri('out')
+        driver.input_paths = list(input_paths)
+        io = StringIO()
+        n_lines = driver._TextZipperDriver__write_mr_input(io)
+        lines = [ tuple(line.split('\t')) for line in io.getvalue().splitlines() ]
+        self.assertEqual(n_lines, len(lines))
+        return lines
+
+    def test_directory(self):
+        expected = [ (self._uri('in'), self._uri('out'), name) for name in ('a', 'sub/b', 'sub/deeper/c') ]
+        self.assertEqual(expected, self._write(self._uri('in')))
+
+    def test_file(self):
+        self.assertEqual([ ('file://' + self.wd, self._uri('out'), 'single') ], self._write(self._uri('single')))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(TestMrInput)
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
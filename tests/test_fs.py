@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy.fs as hfs
+from hadoop_galaxy.fs import FsPool, LocalFs, LockFile, split_uri
+
+class _MockFs(object):
+    def __init__(self, host, port, user):
+        self.key = (host, port, user)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class TestLocalFs(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_fs')
+        self.fs = LocalFs()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_info(self):
+        path = os.path.join(self.wd, 'f')
+        with self.fs.open_file(path, 'w') as f:
+            f.write('abc')
+        info = self.fs.get_path_info(path)
+        self.assertEqual('file://' + path, info['name'])
+        self.assertEqual(('file', 3), (info['kind'], info['size']))
+        self.assertEqual('directory', self.fs.get_path_info(self.wd)['kind'])
+        self.assertRaises(IOError, self.fs.get_path_info, os.path.join(self.wd, 'missing'))
+
+    def test_tree_operations(self):
+        d = os.path.join(self.wd, 'a', 'b')
+        self.fs.create_directory(d)
+        self.fs.create_directory(d) # already exists
+        with open(os.path.join(d, 'f'), 'w') as f:
+            f.write('abc')
+        self.assertEqual([ 'file://' + os.path.join(d, 'f') ],
+                [ info['name'] for info in self.fs.list_directory(d) ])
+        names = sorted(info['name'] for info in self.fs.walk(os.path.join(self.wd, 'a')))
+        self.assertEqual([ 'file://' + p for p in (os.path.join(self.wd, 'a'), d, os.path.join(d, 'f')) ], names)
+        self.fs.rename(os.path.join(self.wd, 'a'), os.path.join(self.wd, 'c'))
+        self.assertTrue(self.fs.exists(os.path.join(self.wd, 'c', 'b', 'f')))
+        self.fs.delete(os.path.join(self.wd, 'c'))
+        self.assertEqual([], os.listdir(self.wd))
+        self.assertRaises(IOError, self.fs.delete, os.path.join(self.wd, 'c'))
+
+    def test_pool_routes_file_uris(self):
+        pool = FsPool()
+        self.assertTrue(isinstance(pool.get_for('file://' + self.wd), LocalFs))
+        self.assertEqual(('', 0, '/tmp/x'), split_uri('file:///tmp/x'))
+
+class TestLocalFsWithoutScandir(TestLocalFs):
+    def setUp(self):
+        super(TestLocalFsWithoutScandir, self).setUp()
+        self.saved_scandir = hfs._scandir
+        hfs._scandir = None
+
+    def tearDown(self):
+        hfs._scandir = self.saved_scandir
+        super(TestLocalFsWithoutScandir, self).tearDown()
+
+class TestDispatch(unittest.TestCase):
+    """
+    The module-level functions, run against the local backend.
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_fs')
+        self.root = 'file://' + self.wd
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _uri(self, *parts):
+        return '/'.join((self.root,) + parts)
+
+    def _write(self, uri, data):
+        with hfs.open(uri, 'w') as f:
+            f.write(data)
+
+    def test_files(self):
+        hfs.mkdir(self._uri('d'))
+        self._write(self._uri('d', 'f'), 'abc')
+        self.assertTrue(hfs.exists(self._uri('d', 'f')))
+        self.assertTrue(hfs.isdir(self._uri('d')))
+        self.assertFalse(hfs.isdir(self._uri('d', 'f')))
+        self.assertFalse(hfs.isdir(self._uri('missing')))
+        self.assertEqual(3, hfs.stat(self._uri('d', 'f'))['size'])
+        with hfs.open(self._uri('d', 'f')) as f:
+            self.assertTrue(isinstance(f, file)) # so that kernel_copy can be used
+            self.assertEqual('abc', f.read())
+        self.assertRaises(IOError, hfs.stat, self._uri('missing'))
+        self.assertRaises(IOError, hfs.open, self._uri('missing'))
+
+    def test_ls_and_walk(self):
+        hfs.mkdir(self._uri('d', 'e'))
+        self._write(self._uri('d', 'f'), 'abc')
+        self._write(self._uri('d', 'e', 'g'), 'defg')
+        listing = dict( (info['name'], info['kind']) for info in hfs.ls(self._uri('d')) )
+        self.assertEqual({ self._uri('d', 'e'): 'directory', self._uri('d', 'f'): 'file' }, listing)
+        self.assertEqual([ self._uri('d', 'f') ], [ info['name'] for info in hfs.ls(self._uri('d', 'f')) ])
+        walked = [ info['name'] for info in hfs.walk(self._uri('d')) ]
+        self.assertEqual(self._uri('d'), walked[0])
+        self.assertEqual(sorted([ self._uri('d'), self._uri('d', 'e'), self._uri('d', 'e', 'g'), self._uri('d', 'f') ]),
+                sorted(walked))
+        self.assertTrue(walked.index(self._uri('d', 'e')) < walked.index(self._uri('d', 'e', 'g')))
+
+    def test_rename_rm(self):
+        hfs.mkdir(self._uri('d'))
+        self._write(self._uri('d', 'f'), 'abc')
+        hfs.rename(self._uri('d'), self._uri('e'))
+        self.assertEqual([ 'f' ], os.listdir(os.path.join(self.wd, 'e')))
+        hfs.rm(self._uri('e'))
+        self.assertEqual([], os.listdir(self.wd))
+        self.assertRaises(IOError, hfs.rm, self._uri('e'))
+
+    def test_link(self):
+        self._write(self._uri('f'), 'abc')
+        hfs.link(self._uri('f'), self._uri('g'))
+        self.assertEqual(os.stat(os.path.join(self.wd, 'f')).st_ino, os.stat(os.path.join(self.wd, 'g')).st_ino)
+        self.assertRaises(IOError, hfs.link, self._uri('f'), self._uri('g'))
+
+    def test_different_file_systems(self):
+        saved_split = hfs.split_uri
+        hfs.split_uri = lambda uri: ('nn', 9000, '/x') if uri.startswith('hdfs:') else saved_split(uri)
+        try:
+            for fn in (hfs.rename, hfs.link):
+                try:
+                    fn(self._uri('f'), 'hdfs://nn:9000/x')
+                    self.fail("%s across file systems didn't raise IOError" % fn.__name__)
+                except IOError as e:
+                    self.assertEqual(errno.EXDEV, e.errno)
+        finally:
+            hfs.split_uri = saved_split
+
+class TestFsPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = FsPool(max_size=2, connect=_MockFs)
+
+    def test_reuse(self):
+        fs = self.pool.get('nn', 9000)
+        self.assertEqual(('nn', 9000, None), fs.key)
+        self.assertTrue(fs is self.pool.get('nn', 9000))
+        self.assertFalse(fs is self.pool.get('nn', 9000, 'someone'))
+        self.assertEqual(1, self.pool.counter.get('hits'))
+        self.assertEqual(2, self.pool.counter.get('opened'))
+        self.assertEqual(2, len(self.pool))
+
+    def test_evict_lru(self):
+        a = self.pool.get('a', 1)
+        b = self.pool.get('b', 1)
+        self.pool.get('a', 1) # now b is the least recently used
+        c = self.pool.get('c', 1)
+        # b may still be in use by another thread
+        self.assertFalse(a.closed or b.closed or c.closed)
+        self.assertEqual(2, len(self.pool))
+        self.assertEqual(1, self.pool.counter.get('evicted'))
+        self.assertFalse(b is self.pool.get('b', 1))
+        self.pool.close_all()
+        self.assertTrue(all(fs.closed for fs in (a, b, c)))
+        self.assertEqual(4, self.pool.counter.get('closed'))
+
+    def test_close_all(self):
+        handles = [ self.pool.get('a', 1), self.pool.get('b', 1) ]
+        self.pool.close_all()
+        self.assertTrue(all(fs.closed for fs in handles))
+        self.assertEqual(0, len(self.pool))
+
+    def test_bad_size(self):
+        self.assertRaises(ValueError, FsPool, 0)
+
+class TestLockFile(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_fs')
+        self.path = os.path.join(self.wd, 'lock')
+        self.uri = 'file://' + self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _backdate(self, seconds):
+        t = time.time() - seconds
+        os.utime(self.path, (t, t))
+
+    def test_lock(self):
+        with LockFile(self.uri) as lock:
+            self.assertTrue(lock.locked)
+            self.assertTrue(os.path.exists(self.path))
+            self.assertFalse(LockFile(self.uri).try_acquire())
+        self.assertFalse(lock.locked)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(LockFile(self.uri).try_acquire())
+
+    def test_stale_lock(self):
+        # a lock left behind by a process that died an hour ago
+        open(self.path, 'w').close()
+        self._backdate(3600)
+        with LockFile(self.uri, poll_interval=0.01):
+            self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_refreshed(self):
+        lock = LockFile(self.uri, refresh_interval=0.01)
+        lock.acquire()
+        try:
+            self._backdate(3600)
+            time.sleep(0.2)
+            self.assertTrue(lock.age() < 10)
+            self.assertFalse(LockFile(self.uri).try_acquire())
+        finally:
+            lock.release()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_contended_stale_lock(self):
+        with open(self.path, 'w') as f:
+            f.write('dead')
+        self._backdate(3600)
+        first = LockFile(self.uri, poll_interval=0.01)
+        second = LockFile(self.uri, poll_interval=0.01)
+        # the first waiter takes the stale lock while the second is
+        # deciding whether to remove it
+        second_age = second.age
+        def age():
+            result = second_age()
+            if not first.locked:
+                first.acquire()
+            return result
+        second.age = age
+        waiter = threading.Thread(target=second.acquire)
+        waiter.start()
+        try:
+            time.sleep(0.2)
+            self.assertTrue(first.held())
+            self.assertFalse(second.locked)
+        finally:
+            first.release()
+            waiter.join()
+        self.assertTrue(second.held())
+        second.release()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_lost_lock(self):
+        lock = LockFile(self.uri)
+        lock.acquire()
+        lock.check()
+        # another process removed it as stale and took it
+        os.remove(self.path)
+        self.assertTrue(LockFile(self.uri).try_acquire())
+        self.assertFalse(lock.held())
+        self.assertRaises(IOError, lock.check)
+        lock.release()
+        self.assertTrue(os.path.exists(self.path))
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestLocalFs)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLocalFsWithoutScandir))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestDispatch))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestFsPool))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLockFile))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
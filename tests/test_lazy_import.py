@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.lazy import LazyModule
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import bench_import
+
+# Generous:  importing the tool modules takes a fraction of this, while
+# starting a JVM for pydoop.hdfs usually takes longer.
+MaxImportTime = 2.0
+
+class TestLazyModule(unittest.TestCase):
+    def test_load_on_access(self):
+        m = LazyModule('json')
+        self.assertFalse(m.loaded)
+        self.assertEqual('[1]', m.dumps([1]))
+        self.assertTrue(m.loaded)
+
+    def test_missing_module(self):
+        m = LazyModule('hadoop_galaxy_no_such_module')
+        self.assertRaises(ImportError, getattr, m, 'anything')
+
+class TestImports(unittest.TestCase):
+    def _run(self, code):
+        """Run code in a fresh interpreter; return whether it loaded pydoop.hdfs"""
+        code += "\nimport sys\nsys.stdout.write(str('pydoop.hdfs' in sys.modules))\n"
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=bench_import.PackageDir)
+        return out.strip().endswith('True')
+
+    def test_tool_modules_dont_load_pydoop(self):
+        elapsed, loaded = bench_import.time_import(bench_import.ToolModules, 1)
+        self.assertFalse(loaded)
+        self.assertTrue(elapsed < MaxImportTime, "importing the tools took %0.2f s" % elapsed)
+
+    def test_help_doesnt_load_pydoop(self):
+        for module in bench_import.ToolModules[1:]:
+            code = "import %s as m\ntry:\n    m.main(['--help'])\nexcept SystemExit:\n    pass" % module
+            self.assertFalse(self._run(code), "%s --help loaded pydoop.hdfs" % module)
+
+    def test_local_cat_paths_doesnt_load_pydoop(self):
+        wd = tempfile.mkdtemp(prefix='hg_test_lazy_import')
+        try:
+            os.mkdir(os.path.join(wd, 'dir'))
+            for name, data in (('a', 'aaa'), ('dir/b', 'bbb'), ('dir/_SUCCESS', '')):
+                with open(os.path.join(wd, name), 'w') as f:
+                    f.write(data)
+            with open(os.path.join(wd, 'pathset'), 'w') as f:
+                f.write("# Pathset\tVersion:0.0\tDataType:Unknown\n")
+                f.write("file://%s/a\nfile://%s/dir\n" % (wd, wd))
+            code = "from hadoop_galaxy.cat_paths import main\nmain(['%s/pathset', 'file://%s/out'])" % (wd, wd)
+            self.assertFalse(self._run(code))
+            with open(os.path.join(wd, 'out')) as f:
+                self.assertEqual('aaabbb', f.read())
+        finally:
+            shutil.rmtree(wd)
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestLazyModule)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestImports))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy.make_pathset as make_pathset
+from hadoop_galaxy.make_pathset import resolve_paths, _ResolveExit
+from hadoop_galaxy.pathset import FilePathset, PathMeta
+
+class TestResolvePaths(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_make_pathset')
+        os.mkdir(os.path.join(self.wd, 'dir'))
+        self.names = [ 'f%02d' % i for i in xrange(20) ] + [ 'dir/a.txt', 'dir/b.txt', 'dir/c.dat' ]
+        for name in self.names:
+            with open(os.path.join(self.wd, name), 'w') as f:
+                f.write(name)
+        # print_err writes to stderr
+        self.saved_stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.saved_stderr
+        shutil.rmtree(self.wd)
+
+    def _path(self, name):
+        return os.path.join(self.wd, name)
+
+    def _uri(self, name):
+        return 'file://' + self._path(name)
+
+    def test_order(self):
+        # reversed, so that the order isn't the one of the listing
+        names = list(reversed(self.names[0:20]))
+        for n_workers in (1, 4, 30):
+            resolved = resolve_paths('local', [ self._path(n) for n in names ], n_workers)
+            self.assertEqual([ (self._uri(n), None) for n in names ], resolved)
+
+    def test_glob(self):
+        paths = [ self._path('f01'), self._path('dir/*.txt'), self._path('f00') ]
+        expected = [ self._uri(n) for n in ('f01', 'dir/a.txt', 'dir/b.txt', 'f00') ]
+        for n_workers in (1, 4):
+            self.assertEqual(expected, [ u for u, _ in resolve_paths('local', paths, n_workers) ])
+
+    def test_metadata(self):
+        resolved = resolve_paths('local', [ self._path('f00'), self._path('dir') ], 2, 'stat')
+        self.assertEqual([ self._uri('f00'), self._uri('dir') ], [ u for u, _ in resolved ])
+        self.assertEqual((3, 'file'), (resolved[0][1].size, resolved[0][1].kind))
+        self.assertEqual(('directory', None), (resolved[1][1].kind, resolved[1][1].size))
+        meta = resolve_paths('local', [ self._path('dir') ], 1, 'summary')[0][1]
+        self.assertEqual((27, 3), (meta.size, meta.count))
+
+    def test_no_match(self):
+        paths = [ self._path(n) for n in self.names[0:10] ] + [ self._path('missing*') ] + \
+                [ self._path(n) for n in self.names[10:20] ]
+        for n_workers in (1, 4):
+            try:
+                resolve_paths('local', paths, n_workers)
+                self.fail("resolve_paths didn't raise _ResolveExit")
+            except _ResolveExit as e:
+                self.assertEqual(1, e.code)
+
+    def test_do_work_exits(self):
+        output = self._path('out')
+        options = make_pathset.parse_args([ '--force-local', '--resolve-workers', '4', output,
+                self._path('f00'), self._path('missing*'), self._path('f01') ])
+        try:
+            make_pathset.do_work(options)
+            self.fail("do_work didn't exit")
+        except SystemExit as e:
+            self.assertEqual(1, e.code)
+        self.assertFalse(os.path.exists(output))
+
+    def test_do_work(self):
+        output = self._path('out')
+        options = make_pathset.parse_args([ '--force-local', '--data-format', 'text', output,
+                self._path('f00'), self._path('dir/*.txt') ])
+        make_pathset.do_work(options)
+        ps = FilePathset.from_file(output)
+        self.assertEqual('text', ps.datatype)
+        self.assertEqual([ self._uri(n) for n in ('f00', 'dir/a.txt', 'dir/b.txt') ], ps.get_paths())
+        self.assertEqual(PathMeta(3, int(os.path.getmtime(self._path('f00'))), 'file', None),
+                ps.get_meta(self._uri('f00')))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(TestResolvePaths)
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,10 +15,12 @@ import unittest
 
 import os
 import sys
+import tempfile
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from hadoop_galaxy.pathset import Pathset, FilePathset
+import hadoop_galaxy.pathset as pathset
+from hadoop_galaxy.pathset import Pathset, FilePathset, LazyFilePathset, PathMeta, CompactPathList
 
 class TestPathset(unittest.TestCase):
     def setUp(self):
@@ -49,6 +51,25 @@ class TestPathset(unittest.TestCase):
         self.assertEqual("hdfs://localhost:9000/user/myname",
             self.ps.sanitize_path("hdfs://localhost:9000/user/myname"))
 
+    def test_sanitize_w_cwd(self):
+        self.assertEqual("file:///base/tmp", self.ps.sanitize_path("tmp", "/base"))
+        self.assertEqual("file:///tmp", self.ps.sanitize_path("../tmp", "/base"))
+        self.assertEqual("file:///tmp", self.ps.sanitize_path("/tmp", "/base"))
+        self.assertEqual("file:/tmp", self.ps.sanitize_path("file:/tmp", "/base"))
+        self.assertEqual("s3n://bucket/key", self.ps.sanitize_path("s3n://bucket/key", "/base"))
+
+    def test_extend(self):
+        cwd = os.path.abspath(os.getcwd())
+        retval = self.ps.extend(iter([ "/tmp", "tmp", "hdfs://localhost:9000/user/myname" ]))
+        self.assertTrue(retval is self.ps)
+        self.assertEqual(
+                [ "file:///tmp", "file://%s/tmp" % cwd, "hdfs://localhost:9000/user/myname" ],
+                self.ps.get_paths())
+
+    def test_extend_trusted(self):
+        self.ps.extend([ "hdfs://localhost:9000/a", "tmp" ], trusted=True)
+        self.assertEqual([ "hdfs://localhost:9000/a", "tmp" ], self.ps.get_paths())
+
     def test_append(self):
         retval = self.ps.append("/tmp")
         self.assertTrue(retval is self.ps)
@@ -85,10 +106,232 @@ class TestFilePathset(unittest.TestCase):
         self.assertEqual(self.ps.datatype, ps2.datatype)
         self.assertEqual(self.ps.comment, ps2.comment)
 
+    def test_iter_file(self):
+        io = StringIO("# Pathset\tVersion:0.0\tDataType:fastq\n#a comment\nfile:///a\n\nfile:///b\n")
+        ps = FilePathset()
+        it = ps.iter_file(io)
+        self.assertEqual('fastq', ps.datatype)
+        self.assertEqual('file:///a', next(it))
+        self.assertEqual("a comment", ps.comment)
+        self.assertEqual(['file:///b'], list(it))
+
+    def test_plain_version_without_meta(self):
+        io = StringIO()
+        FilePathset('/a', '/b').write(io)
+        self.assertTrue("Version:0.0" in io.getvalue().split('\n')[0])
+
+    def test_meta_round_trip(self):
+        ps = FilePathset()
+        ps.append('/data/file', PathMeta(1234, 1400000000, 'file', None))
+        ps.append('/data/dir', PathMeta(5678, 1400000001, 'directory', 3))
+        ps.append('/data/unknown')
+        io = StringIO()
+        ps.write(io)
+        self.assertTrue("Version:1.0" in io.getvalue().split('\n')[0])
+        io.seek(0)
+        ps2 = FilePathset.from_file(io)
+        self.assertEqual(ps.get_paths(), ps2.get_paths())
+        self.assertEqual(PathMeta(1234, 1400000000, 'file', None), ps2.get_meta('file:///data/file'))
+        self.assertEqual(PathMeta(5678, 1400000001, 'directory', 3), ps2.get_meta('file:///data/dir'))
+        self.assertTrue(ps2.get_meta('file:///data/unknown') is None)
+
+    def test_partial_meta_columns(self):
+        io = StringIO("# Pathset\tVersion:1.0\tDataType:Unknown\nfile:///a\t10\nfile:///b\t\t\tdirectory\n")
+        ps = FilePathset.from_file(io)
+        self.assertEqual(PathMeta(10, None, None, None), ps.get_meta('file:///a'))
+        self.assertEqual(PathMeta(None, None, 'directory', None), ps.get_meta('file:///b'))
+
+    def test_front_coded(self):
+        ps = FilePathset()
+        ps.datatype = 'fastq'
+        ps.comment = "line 1\nline 2"
+        for i in xrange(300):
+            ps.append('hdfs://nn:9000/user/galaxy/workspace/dir%d/part-%05d' % (i // 100, i))
+        ps.set_meta(ps.get_paths()[7], PathMeta(10, 20, 'file', None))
+        for encoding in (FilePathset.FrontCodedEncoding, FilePathset.FrontCodedZlibEncoding):
+            io = StringIO()
+            ps.write(io, encoding)
+            self.assertTrue(("Encoding:%s" % encoding) in io.getvalue().split('\n')[0])
+            io.seek(0)
+            ps2 = FilePathset.from_file(io)
+            self.assertEqual(ps.get_paths(), ps2.get_paths())
+            self.assertEqual(ps.datatype, ps2.datatype)
+            self.assertEqual(ps.comment, ps2.comment)
+            self.assertEqual(PathMeta(10, 20, 'file', None), ps2.get_meta(ps.get_paths()[7]))
+            self.assertTrue(ps2.get_meta(ps.get_paths()[8]) is None)
+
+    def test_front_coded_streamed(self):
+        ps = FilePathset()
+        ps.comment = "a comment longer than a chunk"
+        for i in xrange(1000):
+            ps.append('hdfs://nn:9000/user/galaxy/workspace/dir%d/part-%05d' % (i // 100, i), PathMeta(i, i, 'file', None))
+        saved = pathset._ChunkedInput.ChunkSize
+        pathset._ChunkedInput.ChunkSize = 16
+        try:
+            for encoding in (FilePathset.FrontCodedEncoding, FilePathset.FrontCodedZlibEncoding):
+                io = StringIO()
+                ps.write(io, encoding)
+                io.seek(0)
+                it = FilePathset().iter_file(io, with_meta=True)
+                self.assertEqual(list(ps.iter_with_meta())[0], next(it))
+                # the rest of the file is read as it's needed
+                self.assertTrue(io.tell() < len(io.getvalue()) / 2)
+                self.assertEqual(list(ps.iter_with_meta())[1:], list(it))
+        finally:
+            pathset._ChunkedInput.ChunkSize = saved
+
+    def test_front_coded_smaller(self):
+        ps = FilePathset(*[ 'hdfs://nn:9000/user/galaxy/workspace/part-%05d' % i for i in xrange(100) ])
+        text = StringIO()
+        ps.write(text)
+        compact = StringIO()
+        ps.write(compact, FilePathset.FrontCodedEncoding)
+        self.assertTrue(len(compact.getvalue()) < len(text.getvalue()) / 2)
+
+    def test_bad_encoding(self):
+        self.assertRaises(ValueError, FilePathset('/a').write, StringIO(), 'bad')
+        io = StringIO("# Pathset\tVersion:1.0\tDataType:Unknown\tEncoding:bad\nfile:///a\n")
+        self.assertRaises(ValueError, FilePathset.from_file, io)
+
+    def test_unsupported_version(self):
+        io = StringIO("# Pathset\tVersion:9.9\tDataType:Unknown\nfile:///a\n")
+        self.assertRaises(ValueError, FilePathset.from_file, io)
+
+class TestLazyFilePathset(unittest.TestCase):
+    def setUp(self):
+        self.paths = [ 'file:///etc', 'file:///lib', 'hdfs://localhost:9000/user/x' ]
+        ps = FilePathset(*self.paths)
+        ps.datatype = 'text/plain'
+        ps.comment = "A test pathset"
+        fd, self.filename = tempfile.mkstemp(prefix='hg_test_pathset')
+        with os.fdopen(fd, 'w') as f:
+            ps.write(f)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_from_file(self):
+        ps = FilePathset.from_file(self.filename, lazy=True)
+        self.assertTrue(isinstance(ps, LazyFilePathset))
+        self.assertEqual('text/plain', ps.datatype)
+        self.assertTrue(ps._paths is None)
+        self.assertEqual(self.paths, list(ps))
+        # can be iterated more than once
+        self.assertEqual(self.paths, list(ps))
+        self.assertEqual(len(self.paths), len(ps))
+        self.assertEqual("A test pathset", ps.comment)
+        self.assertTrue(ps._paths is None)
+
+    def test_lazy_requires_path(self):
+        with open(self.filename) as f:
+            self.assertRaises(ValueError, FilePathset.from_file, f, True)
+
+    def test_append_materializes(self):
+        ps = FilePathset.from_file(self.filename, lazy=True)
+        ps.append('/tmp')
+        self.assertEqual(self.paths + ['file:///tmp'], ps.get_paths())
+        self.assertEqual(len(self.paths) + 1, len(ps))
+
+    def test_iter_with_meta(self):
+        ps = FilePathset()
+        ps.append('/data/file', PathMeta(1234, 1400000000, 'file', None))
+        ps.append('/data/other')
+        with open(self.filename, 'w') as f:
+            ps.write(f)
+        lazy = FilePathset.from_file(self.filename, lazy=True)
+        self.assertEqual(list(ps.iter_with_meta()), list(lazy.iter_with_meta()))
+        self.assertEqual(ps.get_paths(), list(lazy))
+
+    def test_lazy_front_coded(self):
+        ps = FilePathset(*self.paths)
+        with open(self.filename, 'w') as f:
+            ps.write(f, FilePathset.FrontCodedZlibEncoding)
+        lazy = FilePathset.from_file(self.filename, lazy=True)
+        self.assertEqual(self.paths, list(lazy))
+        self.assertEqual(len(self.paths), len(lazy))
+
+    def test_write(self):
+        ps = FilePathset.from_file(self.filename, lazy=True)
+        io = StringIO()
+        ps.write(io)
+        io.seek(0)
+        ps2 = FilePathset.from_file(io)
+        self.assertEqual(self.paths, ps2.get_paths())
+        self.assertEqual(ps.datatype, ps2.datatype)
+        self.assertEqual("A test pathset", ps2.comment)
+
+    def test_len_cached(self):
+        ps = FilePathset.from_file(self.filename, lazy=True)
+        self.assertEqual(len(self.paths), len(ps))
+        # the file isn't read again
+        os.remove(self.filename)
+        self.assertEqual(len(self.paths), len(ps))
+        self.assertEqual("A test pathset", ps.comment)
+        open(self.filename, 'w').close()
+
+    def test_set_comment(self):
+        ps = FilePathset.from_file(self.filename, lazy=True)
+        ps.comment = "new comment"
+        self.assertEqual(self.paths, list(ps))
+        self.assertEqual("new comment", ps.comment)
+        io = StringIO()
+        ps.write(io, FilePathset.FrontCodedEncoding)
+        io.seek(0)
+        self.assertEqual("new comment", FilePathset.from_file(io).comment)
+
+class TestCompactPathList(unittest.TestCase):
+    def setUp(self):
+        self.paths = [
+                'hdfs://nn:9000/data/run1/part-00000',
+                'hdfs://nn:9000/data/run1/part-00001',
+                'hdfs://nn:9000/data/run2/part-00000',
+                'file:///tmp/x',
+                'file:///',
+                'hdfs://nn:9000',
+                'relative/path',
+                'name',
+        ]
+
+    def test_round_trip(self):
+        l = CompactPathList(self.paths)
+        self.assertEqual(len(self.paths), len(l))
+        self.assertEqual(self.paths, list(l))
+        self.assertEqual(self.paths[2], l[2])
+        self.assertEqual(self.paths[-1], l[-1])
+        self.assertEqual(self.paths[1:3], l[1:3])
+        self.assertEqual(l, self.paths)
+        self.assertRaises(IndexError, l.__getitem__, len(self.paths))
+
+    def test_shared_prefixes(self):
+        l = CompactPathList(self.paths[0:3])
+        self.assertEqual(2, len(l._prefixes))
+        self.assertEqual(1, len(l._authorities))
+        self.assertTrue(l._entry_name[0] is l._entry_name[2])
+
+    def test_compact_pathset(self):
+        ps = FilePathset(*self.paths[0:4], compact=True)
+        self.assertTrue(isinstance(ps.paths, CompactPathList))
+        ps.append('/data/x', PathMeta(1, None, 'file', None))
+        self.assertEqual(5, len(ps))
+        self.assertEqual(self.paths[0:4] + ['file:///data/x'], ps.get_paths())
+        self.assertTrue(isinstance(ps.get_paths(), list))
+        io = StringIO()
+        ps.write(io)
+        io.seek(0)
+        ps2 = FilePathset.from_file(io, compact=True)
+        self.assertTrue(isinstance(ps2.paths, CompactPathList))
+        self.assertEqual(ps.get_paths(), ps2.get_paths())
+        self.assertEqual(list(ps.iter_with_meta()), list(ps2.iter_with_meta()))
+
+    def test_bad_kwarg(self):
+        self.assertRaises(TypeError, Pathset, '/a', bad=True)
+
 
 def suite():
     s = unittest.TestLoader().loadTestsFromTestCase(TestPathset)
     s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestFilePathset))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLazyFilePathset))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestCompactPathList))
     return s
 
 def main():
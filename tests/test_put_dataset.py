@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from urlparse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy.fs as hfs
+import hadoop_galaxy.put_dataset as put_dataset
+from hadoop_galaxy.cas import CasDir, CasStore
+
+def _local(uri):
+    return urlparse(uri).path
+
+class _MockPath(object):
+    """
+    The parts of pydoop.hdfs.path used by put_dataset, for file: URIs.
+    """
+    split = staticmethod(hfs.split_uri)
+    exists = staticmethod(hfs.exists)
+    isdir = staticmethod(hfs.isdir)
+
+    @staticmethod
+    def join(uri, *parts):
+        return '/'.join([ uri.rstrip('/') ] + [ p.strip('/') for p in parts ])
+
+    @staticmethod
+    def dirname(uri):
+        return uri.rstrip('/').rsplit('/', 1)[0]
+
+    @staticmethod
+    def basename(uri):
+        return uri.rstrip('/').rsplit('/', 1)[-1]
+
+class _MockHdfs(object):
+    """
+    The parts of pydoop.hdfs used by put_dataset, for file: URIs.
+    """
+    path = _MockPath()
+
+    def __init__(self):
+        self.copied = []
+
+    def mkdir(self, uri):
+        if not os.path.isdir(_local(uri)):
+            os.makedirs(_local(uri))
+
+    def rmr(self, uri):
+        if not os.path.exists(_local(uri)):
+            raise IOError("No such file or directory: %s" % uri)
+        hfs.rm(uri)
+
+    def open(self, uri, mode='r'):
+        return open(_local(uri), mode)
+
+    def cp(self, src, dest):
+        self.copied.append((src, dest))
+        src, dest = _local(src), _local(dest)
+        # like pydoop, copy into dest if it's an existing directory
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        if os.path.isdir(src):
+            shutil.copytree(src, dest)
+        else:
+            shutil.copy(src, dest)
+
+class _MockWriter(object):
+    def __init__(self):
+        self.counters = {}
+
+    def status(self, msg):
+        pass
+
+    def count(self, name, n):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+class _MockScriptMain(object):
+    """
+    Runs a pydoop script job by calling its mapper on each input line.
+    """
+    def __init__(self):
+        self.writer = _MockWriter()
+
+    def main(self, args):
+        with open(_local(args[-2])) as f:
+            for line in f:
+                put_dataset.mapper(None, line, self.writer)
+
+class TestPutDataset(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_put_dataset')
+        self.saved = (put_dataset.phdfs, put_dataset.pydoop_main, put_dataset.RetryDelay)
+        self.hdfs = _MockHdfs()
+        self.script = _MockScriptMain()
+        put_dataset.phdfs, put_dataset.pydoop_main = self.hdfs, self.script
+        put_dataset.RetryDelay = 0
+
+    def tearDown(self):
+        put_dataset.phdfs, put_dataset.pydoop_main, put_dataset.RetryDelay = self.saved
+        shutil.rmtree(self.wd)
+
+    def _uri(self, *parts):
+        return 'file://' + os.path.join(self.wd, *parts)
+
+    def _make_files(self, *names):
+        for name in names:
+            path = os.path.join(self.wd, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(name)
+
+    def _tree(self, *parts):
+        """The relative paths of the files under a directory"""
+        top = os.path.join(self.wd, *parts)
+        return sorted( os.path.relpath(os.path.join(d, f), top) for d, _, files in os.walk(top) for f in files )
+
+    def test_mapper_retried(self):
+        self._make_files('src/a', 'src/b')
+        # what a failed attempt of the task left behind
+        self._make_files('dest/src/a')
+        line = '%s\t%s\n' % (self._uri('src'), self._uri('dest', 'src'))
+        put_dataset.mapper(None, line, self.script.writer)
+        self.assertEqual([ 'a', 'b' ], self._tree('dest', 'src'))
+        # and once more, as if the task were run twice
+        put_dataset.mapper(None, line, self.script.writer)
+        self.assertEqual([ 'a', 'b' ], self._tree('dest', 'src'))
+        self.assertEqual(2, self.script.writer.counters['paths copied'])
+
+    def test_distcp(self):
+        self._make_files('in/a', 'in/dir/b', 'in/dir/c')
+        dest = self._uri('ws', 'out')
+        self.hdfs.mkdir(self._uri('ws'))
+        put_dataset.perform_distcp([ self._uri('in', 'a'), self._uri('in', 'dir') ], dest)
+        self.assertEqual([ 'a', 'dir/b', 'dir/c' ], self._tree('ws', 'out', self.wd.lstrip('/'), 'in'))
+        # the staging and work directories are gone
+        self.assertEqual([ 'out' ], os.listdir(os.path.join(self.wd, 'ws')))
+
+    def test_distcp_missing_copy(self):
+        self._make_files('in/a', 'in/b')
+        # a job that silently skips its last input line
+        def main(args):
+            with open(_local(args[-2])) as f:
+                put_dataset.mapper(None, f.readline(), self.script.writer)
+        self.script.main = main
+        dest = self._uri('ws', 'out')
+        self.hdfs.mkdir(self._uri('ws'))
+        self.assertRaises(RuntimeError, put_dataset.perform_distcp, [ self._uri('in', 'a'), self._uri('in', 'b') ], dest)
+        self.assertEqual([], os.listdir(os.path.join(self.wd, 'ws')))
+
+    def _failing_cp(self, failures):
+        """A cp that fails the first failures[name] times it copies name"""
+        def cp(src, dest):
+            name = os.path.basename(src)
+            if failures.get(name, 0) > 0:
+                failures[name] -= 1
+                with open(_local(dest), 'w') as f:
+                    f.write('partial')
+                raise IOError("failed to copy %s" % name)
+            _MockHdfs.cp(self.hdfs, src, dest)
+        return cp
+
+    def _copy_tasks(self, *names):
+        self._make_files(*( 'in/' + name for name in names ))
+        self.hdfs.mkdir(self._uri('out'))
+        return [ (self._uri('in', name), self._uri('out', name)) for name in names ]
+
+    def test_copy_retried(self):
+        tasks = self._copy_tasks('a', 'b')
+        self.hdfs.cp = self._failing_cp({ 'b': 2 })
+        put_dataset._copy_all(tasks, 1, 2)
+        self.assertEqual([ 'a', 'b' ], self._tree('out'))
+        with open(os.path.join(self.wd, 'out', 'b')) as f:
+            self.assertEqual('in/b', f.read())
+
+    def test_copy_fails(self):
+        tasks = self._copy_tasks('a', 'b', 'c')
+        self.hdfs.cp = self._failing_cp({ 'a': 2 })
+        self.assertRaises(IOError, put_dataset._copy_all, tasks, 1, 1)
+        # the copies after the failed one are never started
+        self.assertEqual([], [ (src, dest) for src, dest in self.hdfs.copied if not src.endswith('/a') ])
+
+    def test_aborted_copy(self):
+        tasks = self._copy_tasks('a')
+        abort = threading.Event()
+        abort.set()
+        self.assertEqual(0, put_dataset._copy_with_retries(tasks[0][0], tasks[0][1], 2, abort))
+        self.assertEqual([], self.hdfs.copied)
+
+    def test_parallel_copy(self):
+        names = [ 'f%d' % i for i in xrange(20) ]
+        tasks = self._copy_tasks(*names)
+        self.hdfs.cp = self._failing_cp({ 'f3': 1, 'f7': 1 })
+        put_dataset._copy_all(tasks, 4, 1)
+        self.assertEqual(sorted(names), self._tree('out'))
+        self.hdfs.cp = self._failing_cp({ 'f5': 2 })
+        self.assertRaises(IOError, put_dataset._copy_all, [ (src, dest + '.new') for src, dest in tasks ], 4, 1)
+
+    def test_copy_size(self):
+        tasks = self._copy_tasks('a', 'b')
+        abort = threading.Event()
+        self.assertEqual(4, put_dataset._copy_with_retries(tasks[0][0], tasks[0][1], 0, abort))
+        # a known size is trusted, without calling stat
+        self.assertEqual(100, put_dataset._copy_with_retries(tasks[1][0], tasks[1][1], 0, abort, 100))
+        self.assertEqual(0, put_dataset._path_size(self._uri('in')))
+        self.assertEqual(0, put_dataset._path_size(self._uri('missing')))
+
+    def test_sync_dest_path(self):
+        a, b = self._uri('in', 'a'), self._uri('in', 'b')
+        path = put_dataset.sync_dest_path(self._uri('ws'), [ a, b ])
+        self.assertTrue(path.startswith(self._uri('ws', put_dataset.SyncDir) + '/'))
+        self.assertEqual(path, put_dataset.sync_dest_path(self._uri('ws'), [ b, a ]))
+        self.assertNotEqual(path, put_dataset.sync_dest_path(self._uri('ws'), [ a ]))
+
+    def test_iter_files(self):
+        self._make_files('in/a', 'in/dir/bb')
+        os.utime(os.path.join(self.wd, 'in', 'a'), (1000, 1000))
+        self.assertEqual([ (self._uri('in', 'a'), 4, 1000) ], list(put_dataset._iter_files(self._uri('in', 'a'))))
+        files = sorted(put_dataset._iter_files(self._uri('in')))
+        self.assertEqual([ self._uri('in', 'a'), self._uri('in', 'dir', 'bb') ], [ f[0] for f in files ])
+        self.assertEqual([ 4, 9 ], [ f[1] for f in files ])
+
+    def _sync(self, compare='mtime', n_threads=1):
+        self.hdfs.copied = []
+        put_dataset.perform_sync([ self._uri('in') ], self._uri('ws', 'sync'), compare, n_threads, 0)
+        # the lock and the staging directory are gone
+        self.assertEqual([ 'sync' ], os.listdir(os.path.join(self.wd, 'ws')))
+        return sorted( os.path.basename(src) for src, _ in self.hdfs.copied )
+
+    def _synced(self, *parts):
+        return os.path.join(self.wd, 'ws', 'sync', self.wd.lstrip('/'), 'in', *parts)
+
+    def test_sync(self):
+        self._make_files('in/a', 'in/b', 'in/dir/c')
+        os.utime(os.path.join(self.wd, 'in', 'a'), (1000, 1000))
+        self.assertEqual([ 'a', 'b', 'c' ], self._sync())
+        self.assertEqual([ 'a', 'b', 'dir/c' ], self._tree(self._synced()))
+        self.assertEqual(1000, int(os.path.getmtime(self._synced('a'))))
+        self.assertEqual([], self._sync())
+        # change a file and remove another
+        with open(os.path.join(self.wd, 'in', 'a'), 'a') as f:
+            f.write('more')
+        os.remove(os.path.join(self.wd, 'in', 'b'))
+        self.assertEqual([ 'a' ], self._sync(n_threads=2))
+        self.assertEqual([ 'a', 'dir/c' ], self._tree(self._synced()))
+        with open(self._synced('a')) as f:
+            self.assertEqual('in/amore', f.read())
+
+    def test_sync_checksum(self):
+        self._make_files('in/a', 'in/b', 'in/c')
+        self._sync()
+        # same size and modification time, different contents
+        with open(os.path.join(self.wd, 'in', 'b'), 'w') as f:
+            f.write('in/x')
+        os.utime(os.path.join(self.wd, 'in', 'b'), (1000, 1000))
+        os.utime(self._synced('b'), (1000, 1000))
+        self.assertEqual([], self._sync())
+        self.assertEqual([ 'b' ], self._sync('checksum', n_threads=2))
+        self.assertEqual([], self._sync('checksum', n_threads=2))
+
+    def test_sync_failed(self):
+        self._make_files('in/a', 'in/b')
+        self._sync()
+        for name in 'a', 'b':
+            with open(os.path.join(self.wd, 'in', name), 'a') as f:
+                f.write('more')
+        def cp(src, dest):
+            if src.endswith('/b'):
+                raise IOError("copy failed")
+            _MockHdfs.cp(self.hdfs, src, dest)
+        self.hdfs.cp = cp
+        self.assertRaises(IOError, self._sync)
+        # the earlier copies are left alone
+        for name in 'a', 'b':
+            with open(self._synced(name)) as f:
+                self.assertEqual('in/' + name, f.read())
+        self.assertEqual([ 'sync' ], os.listdir(os.path.join(self.wd, 'ws')))
+
+    def test_sync_lost_lock(self):
+        self._make_files('in/a')
+        self._sync()
+        with open(os.path.join(self.wd, 'in', 'a'), 'a') as f:
+            f.write('more')
+        lock_path = os.path.join(self.wd, 'ws', 'sync.lock')
+        def cp(src, dest):
+            _MockHdfs.cp(self.hdfs, src, dest)
+            # another sync removed our lock as stale and took it
+            os.remove(lock_path)
+            hfs.LockFile('file://' + lock_path).try_acquire()
+        self.hdfs.cp = cp
+        self.assertRaises(IOError, put_dataset.perform_sync, [ self._uri('in') ], self._uri('ws', 'sync'))
+        with open(self._synced('a')) as f:
+            self.assertEqual('in/a', f.read())
+        self.assertTrue(os.path.exists(lock_path))
+
+    def _dedup(self):
+        return put_dataset.perform_dedup([ self._uri('in') ], self._uri('ws'), 2, 0)
+
+    def test_dedup(self):
+        self._make_files('in/a', 'in/b')
+        with open(os.path.join(self.wd, 'in', 'b2'), 'w') as f:
+            f.write('in/b')
+        lock_path = os.path.join(self.wd, 'ws', CasDir, CasStore.LockName)
+        def cp(src, dest):
+            # other uploads can use the store while we copy
+            self.assertFalse(os.path.exists(lock_path))
+            _MockHdfs.cp(self.hdfs, src, dest)
+        self.hdfs.cp = cp
+        objects = self._dedup()
+        self.assertEqual(3, len(objects))
+        self.assertEqual(2, len(set(objects)))
+        self.assertEqual(2, len(self.hdfs.copied))
+        # a second upload copies nothing
+        self.hdfs.copied = []
+        self.assertEqual(sorted(objects), sorted(self._dedup()))
+        self.assertEqual([], self.hdfs.copied)
+        with CasStore(self._uri('ws', CasDir)) as store:
+            self.assertEqual([ 2, 4 ], sorted( store.refcount(os.path.basename(o)) for o in set(objects) ))
+
+    def test_dedup_failed(self):
+        self._make_files('in/a')
+        objects = self._dedup()
+        self._make_files('in/b')
+        def cp(src, dest):
+            raise IOError("copy failed")
+        self.hdfs.cp = cp
+        self.assertRaises(IOError, self._dedup)
+        # the references to the stored objects were released, and the new ones removed
+        with CasStore(self._uri('ws', CasDir)) as store:
+            self.assertEqual(1, store.refcount(os.path.basename(objects[0])))
+        self.assertEqual([ os.path.basename(objects[0]) ], os.listdir(os.path.join(self.wd, 'ws', CasDir, 'objects')))
+
+
+def suite():
+    return unittest.TestLoader().loadTestsFromTestCase(TestPutDataset)
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy.split_pathset as split_pathset
+from hadoop_galaxy.pathset import FilePathset, PathMeta
+
+Root = 'hdfs://nn:9000/root'
+
+class _MockFs(object):
+    """
+    An in-memory directory tree with the part of the hadoop_galaxy.fs
+    interface used by split_pathset.
+    """
+    def __init__(self):
+        self.tree = {
+            Root: [ 'c', 'b', 'a', '_logs', '.hidden' ],
+            Root + '/b': [ 'y', 'x' ],
+            Root + '/b/y': [ 'z' ],
+            Root + '/c': [],
+        }
+        self.calls = []
+
+    def _info(self, name):
+        kind = 'directory' if name in self.tree else 'file'
+        return { 'name': name, 'kind': kind, 'size': 0 if kind == 'directory' else 10, 'last_mod': 0 }
+
+    def stat(self, uri):
+        self.calls.append(('stat', uri))
+        return self._info(uri)
+
+    def ls(self, uri):
+        self.calls.append(('ls', uri))
+        return [ self._info(uri + '/' + child) for child in self.tree[uri] ]
+
+class TestExpand(unittest.TestCase):
+    def setUp(self):
+        self.fs = _MockFs()
+        self.saved_fs = split_pathset.hfs
+        split_pathset.hfs = self.fs
+
+    def tearDown(self):
+        split_pathset.hfs = self.saved_fs
+
+    def _expand(self, levels, workers=1):
+        return [ leaf['name'] for leaf in split_pathset.expand([Root], levels, workers) ]
+
+    def test_no_expansion(self):
+        self.assertEqual([Root], self._expand(0))
+        self.assertEqual([], self.fs.calls)
+
+    def test_no_expansion_streamed(self):
+        read = []
+        def roots():
+            for i in xrange(3):
+                read.append(i)
+                yield '%s/%d' % (Root, i)
+        leaves = split_pathset.expand(roots(), 0)
+        self.assertEqual({ 'name': Root + '/0' }, next(leaves))
+        self.assertEqual([ 0 ], read)
+
+    def test_one_level(self):
+        self.assertEqual([ Root + '/a', Root + '/b', Root + '/c' ], self._expand(1))
+
+    def test_levels(self):
+        expected = [ Root + '/a', Root + '/b/x', Root + '/b/y' ]
+        self.assertEqual(expected, self._expand(2))
+        self.assertEqual(expected, self._expand(2, 4))
+        expected = [ Root + '/a', Root + '/b/x', Root + '/b/y/z' ]
+        self.assertEqual(expected, self._expand(5, 4))
+
+    def test_one_call_per_directory(self):
+        self._expand(5, 4)
+        self.assertEqual([ ('stat', Root) ], [ c for c in self.fs.calls if c[0] == 'stat' ])
+        listed = sorted(path for call, path in self.fs.calls if call == 'ls')
+        self.assertEqual(sorted(self.fs.tree.keys()), listed)
+
+    def test_file_root(self):
+        leaves = list(split_pathset.expand([Root + '/a'], 3))
+        self.assertEqual([ Root + '/a' ], [ leaf['name'] for leaf in leaves ])
+
+class TestExpandLocal(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_split_pathset')
+        for name in ('d/a', 'd/b/x', 'd/b/y/z', 'd/_logs/l', 'f'):
+            path = os.path.join(self.wd, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(name)
+        os.mkdir(os.path.join(self.wd, 'd', 'c'))
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _uri(self, name):
+        return 'file://' + os.path.join(self.wd, name)
+
+    def test_expand(self):
+        for workers in (1, 4):
+            leaves = list(split_pathset.expand([ self._uri('d'), self._uri('f') ], 5, workers))
+            self.assertEqual([ self._uri(n) for n in ('d/a', 'd/b/x', 'd/b/y/z', 'f') ], [ leaf['name'] for leaf in leaves ])
+            self.assertEqual(1, leaves[-1]['size'])
+        leaves = split_pathset.expand([ self._uri('d') ], 1)
+        self.assertEqual([ self._uri(n) for n in ('d/a', 'd/b', 'd/c') ], [ leaf['name'] for leaf in leaves ])
+
+    def test_main(self):
+        input_path = os.path.join(self.wd, 'input')
+        ps = FilePathset(self._uri('d'))
+        ps.datatype = 'text'
+        with open(input_path, 'w') as f:
+            ps.write(f)
+        split_pathset.main([ '-e', '2', '.*/b/.*',
+                input_path, os.path.join(self.wd, 'true'), os.path.join(self.wd, 'false') ])
+        self.assertEqual([ self._uri('d/b/x'), self._uri('d/b/y') ],
+                FilePathset.from_file(os.path.join(self.wd, 'true')).get_paths())
+        self.assertEqual([ self._uri('d/a') ], FilePathset.from_file(os.path.join(self.wd, 'false')).get_paths())
+
+class TestRules(unittest.TestCase):
+    def test_first_match_wins(self):
+        classify = split_pathset.compile_rules([ r'.*/lane1/', r'.*/(lane\d)/s(?P<sample>\d+)', r'.*/lane' ])
+        self.assertEqual(0, classify('hdfs://nn/data/lane1/s1'))
+        self.assertEqual(1, classify('hdfs://nn/data/lane2/s1'))
+        self.assertEqual(2, classify('hdfs://nn/data/laneX/s1'))
+        self.assertEqual(3, classify('hdfs://nn/data/other'))
+
+    def test_anchor_end(self):
+        classify = split_pathset.compile_rules([ r'.*\.gz', r'.*\.bz2' ], anchor_end=True)
+        self.assertEqual(0, classify('file:///a.gz'))
+        self.assertEqual(1, classify('file:///a.bz2'))
+        self.assertEqual(2, classify('file:///a.gz.txt'))
+
+    def test_backreference(self):
+        classify = split_pathset.compile_rules([ r'.*/(\w+)/\1\.txt' ])
+        self.assertEqual(0, classify('file:///data/a/a.txt'))
+        self.assertEqual(1, classify('file:///data/a/b.txt'))
+        classify = split_pathset.compile_rules([ r'.*/(\w+)/\1\.txt', r'.*/(?P<d>\w+)/(?P=d)', r'.*\.txt' ], anchor_end=True)
+        self.assertEqual(0, classify('file:///data/a/a.txt'))
+        self.assertEqual(1, classify('file:///data/a/a'))
+        self.assertEqual(2, classify('file:///data/a/b.txt'))
+        self.assertEqual(3, classify('file:///data/a/b'))
+
+    def test_same_group_name(self):
+        classify = split_pathset.compile_rules([ r'.*/lane(?P<n>1)/', r'.*/lane(?P<n>\d)/' ])
+        self.assertEqual(0, classify('hdfs://nn/data/lane1/s1'))
+        self.assertEqual(1, classify('hdfs://nn/data/lane2/s1'))
+        self.assertEqual(2, classify('hdfs://nn/data/other'))
+
+    def test_inline_flags(self):
+        classify = split_pathset.compile_rules([ r'(?i).*foo', r'.*BAR' ])
+        self.assertEqual(0, classify('hdfs://x/FOO'))
+        self.assertEqual(2, classify('hdfs://x/bar'))
+        classify = split_pathset.compile_rules([ r'.*foo', r'(?i).*BAR' ])
+        self.assertEqual(2, classify('hdfs://x/FOO'))
+        self.assertEqual(1, classify('hdfs://x/bar'))
+        classify = split_pathset.compile_rules([ r'(?x) .*/a  b', r'.*/c d' ])
+        self.assertEqual(0, classify('file:///ab'))
+        self.assertEqual(1, classify('file:///c d'))
+
+    def test_many_groups(self):
+        classify = split_pathset.compile_rules([ r'.*/(s)(%d)$' % i for i in xrange(100) ])
+        self.assertEqual(42, classify('file:///data/s42'))
+        self.assertEqual(100, classify('file:///data/s100'))
+
+    def test_bad_expression(self):
+        self.assertRaises(re.error, split_pathset.compile_rules, [ 'ok', '(bad' ])
+
+class TestParseArgs(unittest.TestCase):
+    def test_two_way(self):
+        options = split_pathset.parse_args([ 'expr', 'in', 'true', 'false' ])
+        self.assertEqual([ 'expr' ], options.expressions)
+        self.assertEqual([ 'true' ], options.outputs)
+        self.assertEqual('false', options.default_output)
+
+    def test_multi_way(self):
+        options = split_pathset.parse_args([ '--rule', 'a', 'x', '--rule', 'b', 'y', '--output-dir', 'out', 'in' ])
+        self.assertEqual([ 'x', 'y' ], options.expressions)
+        self.assertEqual([ os.path.join('out', 'a'), os.path.join('out', 'b') ], options.outputs)
+        self.assertEqual(os.path.join('out', split_pathset.DefaultBucket), options.default_output)
+        self.assertEqual('in', options.input_pathset)
+
+    def test_multi_way_errors(self):
+        for args in (
+                [ '--rule', 'a', 'x', '--rule', 'a', 'y', 'in' ],
+                [ '--rule', 'a/b', 'x', 'in' ],
+                [ '--rule', split_pathset.DefaultBucket, 'x', 'in' ]):
+            self.assertRaises(SystemExit, split_pathset.parse_args, args)
+
+class TestPredicates(unittest.TestCase):
+    def test_no_conditions(self):
+        self.assertTrue(split_pathset.make_predicate() is None)
+
+    def test_size(self):
+        predicate = split_pathset.make_predicate(min_size=1, max_size=100)
+        self.assertFalse(predicate({ 'name': 'a', 'kind': 'file', 'size': 0, 'last_mod': 0 }))
+        self.assertTrue(predicate({ 'name': 'a', 'kind': 'file', 'size': 1, 'last_mod': 0 }))
+        self.assertFalse(predicate({ 'name': 'a', 'kind': 'file', 'size': 101, 'last_mod': 0 }))
+        self.assertFalse(predicate({ 'name': 'a', 'kind': 'file' }))
+        # size conditions don't apply to directories
+        self.assertTrue(predicate({ 'name': 'a', 'kind': 'directory', 'size': 0, 'last_mod': 0 }))
+
+    def test_newer_than(self):
+        predicate = split_pathset.make_predicate(newer_than=1000)
+        self.assertTrue(predicate({ 'name': 'a', 'kind': 'file', 'size': 0, 'last_mod': 1000 }))
+        self.assertFalse(predicate({ 'name': 'a', 'kind': 'directory', 'size': 0, 'last_mod': 999 }))
+        self.assertFalse(predicate({ 'name': 'a', 'kind': 'file', 'size': 0 }))
+
+    def test_timestamp(self):
+        self.assertEqual(1400000000, split_pathset._timestamp('1400000000'))
+        self.assertEqual(
+                split_pathset._timestamp('2014-05-13') + 3600 + 120,
+                split_pathset._timestamp('2014-05-13 01:02'))
+        self.assertRaises(argparse.ArgumentTypeError, split_pathset._timestamp, 'yesterday')
+
+    def test_root_infos(self):
+        fs = _MockFs()
+        saved_fs = split_pathset.hfs
+        split_pathset.hfs = fs
+        try:
+            ps = FilePathset()
+            ps.append(Root + '/a', PathMeta(5, 1400000000, 'file', None))
+            ps.append(Root + '/b')
+            infos = split_pathset.root_infos(ps, 2)
+        finally:
+            split_pathset.hfs = saved_fs
+        self.assertEqual([ Root + '/a', Root + '/b' ], [ info['name'] for info in infos ])
+        self.assertEqual((5, 1400000000), (infos[0]['size'], infos[0]['last_mod']))
+        self.assertEqual('directory', infos[1]['kind'])
+        self.assertEqual([ ('stat', Root + '/b') ], fs.calls)
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestExpand)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestExpandLocal))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestRules))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestParseArgs))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestPredicates))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
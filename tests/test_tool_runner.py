@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hadoop_galaxy
+from hadoop_galaxy import HadoopGalaxy, HadoopToolRunner
+from hadoop_galaxy.pathset import FilePathset
+
+Output = 'file:///data/out'
+
+class _MockFs(object):
+    """
+    Records the calls HadoopToolRunner makes to prepare its output path.
+    """
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.calls = []
+
+    def get_path_info(self, path):
+        self.calls.append(('get_path_info', path))
+        if path not in self.existing:
+            raise IOError("No such file or directory: %s" % path)
+        return { 'name': path, 'kind': 'directory' }
+
+    def create_directory(self, path):
+        self.calls.append(('create_directory', path))
+        self.existing.add(path)
+
+    def rename(self, src, dest):
+        self.calls.append(('rename', src, dest))
+        self.existing.remove(src)
+        self.existing.add(dest)
+
+    def delete(self, path):
+        self.calls.append(('delete', path))
+        self.existing.remove(path)
+
+class _MockPool(object):
+    def __init__(self, fs):
+        self.fs = fs
+
+    def get(self, host='default', port=0, user=None):
+        return self.fs
+
+class TestExecute(unittest.TestCase):
+    def setUp(self):
+        self.saved_pool = hadoop_galaxy.fs_pool
+        self.runner = HadoopToolRunner('true')
+        self.runner.set_input(FilePathset('file:///data/in'))
+        self.runner.set_output(FilePathset(Output))
+        self.logger = logging.getLogger('test_tool_runner')
+
+    def tearDown(self):
+        hadoop_galaxy.fs_pool = self.saved_pool
+
+    def _execute(self, fs):
+        hadoop_galaxy.fs_pool = _MockPool(fs)
+        self.runner.execute(self.logger)
+
+    def test_new_output(self):
+        fs = _MockFs()
+        self._execute(fs)
+        self.assertEqual([ ('get_path_info', '/data/out'), ('create_directory', '/data') ], fs.calls)
+
+    def test_stale_output(self):
+        fs = _MockFs([ '/data', '/data/out' ])
+        self._execute(fs)
+        self.assertEqual([ 'get_path_info', 'rename', 'delete' ], [ c[0] for c in fs.calls ])
+        stale = fs.calls[1][2]
+        self.assertTrue(os.path.basename(stale).startswith('_out.'))
+        self.assertEqual(('delete', stale), fs.calls[2])
+        self.assertEqual(set([ '/data' ]), fs.existing)
+
+    def test_synchronous_cleanup(self):
+        fs = _MockFs([ '/data', '/data/out' ])
+        self.runner.async_cleanup = False
+        self._execute(fs)
+        self.assertEqual([ ('get_path_info', '/data/out'), ('delete', '/data/out') ], fs.calls)
+
+class TestOutputMeta(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_tool_runner')
+        for name in ('part-00000', 'part-00001'):
+            with open(os.path.join(self.wd, name), 'w') as f:
+                f.write('data')
+        self.pset = FilePathset('file://' + self.wd)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_stat_only(self):
+        HadoopGalaxy._record_output_meta(self.pset)
+        meta = self.pset.get_meta('file://' + self.wd)
+        self.assertEqual('directory', meta.kind)
+        self.assertTrue(meta.size is None and meta.count is None)
+
+    def test_summarize(self):
+        HadoopGalaxy._record_output_meta(self.pset, summarize_dirs=True)
+        meta = self.pset.get_meta('file://' + self.wd)
+        self.assertEqual((8, 2), (meta.size, meta.count))
+
+    def test_option(self):
+        parser = HadoopGalaxy.build_parser()
+        self.assertFalse(parser.parse_args([ '--input', 'in', '--output', 'out' ]).summarize_output)
+        self.assertTrue(parser.parse_args([ '--input', 'in', '--output', 'out', '--summarize-output' ]).summarize_output)
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestExecute)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestOutputMeta))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
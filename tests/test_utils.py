@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# BEGIN_COPYRIGHT
+#
+# Copyright (C) 2014 CRS4.
+#
+# This file is part of hadoop-galaxy, released under the terms of the BSD
+# 3-Clause License <http://opensource.org/licenses/BSD-3-Clause>.
+#
+# END_COPYRIGHT
+
+
+from StringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hadoop_galaxy.utils import CopyEngine, kernel_copy, preallocate_file
+from hadoop_galaxy.utils import glob_path, has_glob, _LocalGlobLister
+
+class TestCopyEngine(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_utils')
+        self.data = ''.join(chr(i % 256) for i in xrange(1000))
+        self.src = os.path.join(self.wd, 'src')
+        with open(self.src, 'w') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_copy_file(self):
+        engine = CopyEngine(64)
+        dest = StringIO()
+        with open(self.src) as f:
+            self.assertEqual(len(self.data), engine.copy(f, dest))
+        self.assertEqual(self.data, dest.getvalue())
+
+    def test_copy_max_bytes(self):
+        engine = CopyEngine(64)
+        dest = StringIO()
+        with open(self.src) as f:
+            f.seek(10)
+            self.assertEqual(100, engine.copy(f, dest, 100))
+        self.assertEqual(self.data[10:110], dest.getvalue())
+
+    def test_copy_without_readinto(self):
+        engine = CopyEngine(7)
+        dest = StringIO()
+        chunks = []
+        self.assertEqual(len(self.data), engine.copy(StringIO(self.data), dest, callback=chunks.append))
+        self.assertEqual(self.data, dest.getvalue())
+        self.assertEqual(len(self.data), sum(chunks))
+        self.assertTrue(max(chunks) <= 7)
+
+    def test_buffer_reused(self):
+        engine = CopyEngine(64)
+        buf = engine._buf
+        with open(self.src) as f:
+            engine.copy(f, StringIO())
+        self.assertTrue(buf is engine._buf)
+
+    def test_bad_buffer_size(self):
+        self.assertRaises(ValueError, CopyEngine, 0)
+
+class TestLocalFileOps(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_utils')
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_kernel_copy(self):
+        src = os.path.join(self.wd, 'src')
+        dest = os.path.join(self.wd, 'dest')
+        with open(src, 'w') as f:
+            f.write('0123456789')
+        with open(src) as in_fd, open(dest, 'w') as out_fd:
+            out_fd.write('head')
+            in_fd.seek(2)
+            n = kernel_copy(in_fd, out_fd)
+            # whatever the kernel didn't copy must still be available
+            n += CopyEngine(4).copy(in_fd, out_fd)
+            out_fd.write('tail')
+        self.assertEqual(8, n)
+        with open(dest) as f:
+            self.assertEqual('head23456789tail', f.read())
+
+    def test_preallocate(self):
+        path = os.path.join(self.wd, 'prealloc')
+        for strategy in ('fallocate', 'truncate'):
+            preallocate_file(path, 12345, strategy)
+            self.assertEqual(12345, os.path.getsize(path))
+        preallocate_file(path, 12345, 'none')
+        self.assertEqual(0, os.path.getsize(path))
+        self.assertRaises(ValueError, preallocate_file, path, 10, 'bad')
+
+class TestGlob(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp(prefix='hg_test_utils')
+        for d in ('run1/L001', 'run1/L002', 'run2/L001', 'with space'):
+            os.makedirs(os.path.join(self.wd, d))
+        for f in ('run1/L001/a.fq', 'run1/L002/b.fq', 'run2/L001/c.fq', 'run2/L001/c.txt', 'with space/x y.fq'):
+            open(os.path.join(self.wd, f), 'w').close()
+        self.lister = _LocalGlobLister()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _glob(self, pattern):
+        prefix_len = len(self.wd) + 1
+        return [ p[prefix_len:] for p in glob_path(self.lister, os.path.join(self.wd, pattern)) ]
+
+    def test_has_glob(self):
+        self.assertFalse(has_glob('/a/b/c.fq'))
+        for p in ('/a/*', '/a/?', '/a/[ab]', '/a/{b,c}'):
+            self.assertTrue(has_glob(p))
+
+    def test_star_and_question_mark(self):
+        self.assertEqual(['run1/L001/a.fq', 'run1/L002/b.fq', 'run2/L001/c.fq'], self._glob('run*/L00?/*.fq'))
+
+    def test_char_class(self):
+        self.assertEqual(['run2/L001'], self._glob('run[^1]/*'))
+        self.assertEqual(['run1/L001/a.fq', 'run1/L002/b.fq'], self._glob('run[1]/L00[1-2]/*'))
+
+    def test_char_class_escaped(self):
+        for name in ('a.fq', 'ab.fq', 'a]', 'a\\', 'a-', 'a^', 'b'):
+            open(os.path.join(self.wd, name), 'w').close()
+        # regex syntax in the class is taken literally
+        self.assertEqual(['a.fq'], self._glob('a[.]fq'))
+        self.assertEqual(['a-', 'a^'], self._glob('a[-^]'))
+        self.assertEqual(['a-', 'a\\', 'a]'], self._glob('a[!^]'))
+        self.assertEqual(['a\\'], self._glob('a[\\\\]'))
+        self.assertEqual(['a]'], self._glob('a[]]'))
+        self.assertEqual(['a]'], self._glob('a[\\]]'))
+        # a range from the backslash to '^'
+        self.assertEqual(['a\\', 'a]', 'a^'], self._glob('a[\\\\-^]'))
+        self.assertRaises(ValueError, self._glob, 'a[z-a]')
+
+    def test_braces(self):
+        self.assertEqual(['run1/L001/a.fq', 'run2/L001/c.fq', 'run2/L001/c.txt'], self._glob('run{1,2}/L001/*'))
+        # groups containing a '/' produce separate, ordered expansions
+        self.assertEqual(['run2/L001/c.fq', 'run1/L002/b.fq'], self._glob('{run2/L001,run1/L002}/*.fq'))
+
+    def test_spaces(self):
+        self.assertEqual(['with space/x y.fq'], self._glob('w*/*.fq'))
+
+    def test_no_match(self):
+        self.assertEqual([], self._glob('missing/*'))
+        self.assertEqual([], self._glob('run*/missing'))
+
+    def test_bad_pattern(self):
+        self.assertRaises(ValueError, self._glob, 'run{1,2/*')
+
+
+def suite():
+    s = unittest.TestLoader().loadTestsFromTestCase(TestCopyEngine)
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLocalFileOps))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestGlob))
+    return s
+
+def main():
+    result = unittest.TextTestRunner(verbosity=2).run(suite())
+    return 0 if result.wasSuccessful() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())